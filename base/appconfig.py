@@ -56,29 +56,65 @@ class Configuration(Serializable):
 		self.netflow_version = 10
 		self.netflow_port = 4739
 		self.netflow_ip_mask = '0.0.0.0'
+		self.receiver_processes = 1 # > 1: Sockets with SO_REUSEPORT in separate processes
+		self.receive_buffer_size = 0 # SO_RCVBUF in bytes (0: system default)
+		self.asyncio_receiver = False # One event loop for IPFIX, Netflow v5 and management endpoint
+		self.netflow_v5_port = 0 # Additional Netflow v5 port of the asyncio receiver (0: disabled)
+		self.management_port = 0 # TCP port of the asyncio receiver returning its status as JSON (0: disabled)
+		self.receiver_max_pause_milliseconds = 500 # Queues full: pause reading, afterwards spill to disk
 		self.flow_log_interval = 10
 		self.ipfix_extreme_network_patch = False
 		self.ipfix_cache_seconds = 30
-		self.queues_maxsize = 80000
+		self.queues_maxsize = 80000 # Datagrams / flows in all queues (batches count by their content)
+		self.spill_segment_size = 67108864 # Bytes per segment of the spill log (queues overloaded)
+		self.spill_sync_seconds = 1 # fsync the spill log at most every n seconds
+		self.transport_batch_packets = 64
+		self.transport_batch_microseconds = 2000
+		self.shared_memory_queues = [] # e.g. ['Flow', 'Corrector', 'Conversation']
+		self.shared_memory_queue_size = 16777216 # Bytes per ring
 		self.dns_cache_seconds = 21600
 		self.conversation_consumer_threads = 2
+		self.conversation_consumer_max_threads = 0 # Conversation workers that can be added at runtime (0: conversation_consumer_threads)
 		self.corrector_consumer_threads = 2
+		self.flow_consumer_threads = 1
+		self.flow_batches = False # Pass flows column by column (FlowBatch) instead of one dict per flow
 		self.enabled_handlers = {
 			'elasticsearch': False, 
 			'screen': False,
 			'file': True,
-			'udpreceiver': False
+			'udpreceiver': False,
+			'archive': False
 		}
 		self.elasticsearch = {
 			'host': '127.0.0.1', 
 			'port': 9200, 
 			'index': 'ipfix'
 		}
+		self.elasticsearch_bulk = { # see handler.elasticsearch.BulkWriter
+			'max_documents': 5000,
+			'max_bytes': 5242880,
+			'max_milliseconds': 1000,
+			'concurrency': 2,
+			'max_retries': 3
+		}
+		self.archive = { # Columnar files per hour, see handler.archive
+			'directory': 'data/archive/',
+			'rows_per_group': 65536,
+			'compression_level': 6,
+			'flush_seconds': 60 # Write a row group at least that often
+		}
 		self.udpreceiver = {
 			'host': '127.0.0.1', 
 			'port': 9999
 		}
-		self.filename = 'ipfix.conversations.txt'
+		self.filename = 'ipfix.conversations.jsonl' # One conversation per line (JSON)
+		self.file_output = { # see handler.file.FileWriter
+			'max_bytes': 0, # Rotate when exceeded (0: never)
+			'hourly': False, # Rotate at the full hour
+			'compression': None, # None, 'gzip' or 'lzma'
+			'buffer_bytes': 1048576,
+			'flush_seconds': 1
+		}
 		self.exporter_networks = {
 			'192.168.1.107:1002': { 'networks': ['150.10.0.0/16'], 'label': 'Washington' },
 			'127.0.0.1': { 'networks': ['127.0.0.0/24'], 'label': 'Local' }
@@ -92,6 +128,10 @@ class Configuration(Serializable):
 			'ttl_response_received': 60,
 			'ttl_no_response': 600
 		} 
+		self.conversation_cache_max_entries = 1000000 # per ConversationConsumer (0: unlimited)
+		self.conversation_cache_max_bytes = 0 # estimated, per ConversationConsumer (0: unlimited)
+		self.checkpoint_directory = 'data/checkpoints/'
+		self.checkpoint_interval = 10 # Seconds between checkpoints of open conversations (0: disabled)
 		self.security_sample_percentage = 0.1
 
 		# Config File:
@@ -0,0 +1,172 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, pickle, struct, zlib
+from base.applog import *
+
+class Checkpoint():
+	'''
+	Persists a dict (key -> state) as a snapshot (base) and a journal of
+	the changes since the snapshot. append() writes only the changes, 
+	if the journal grows larger than the snapshot, a new snapshot is 
+	written (compaction). Both files carry a generation number: a journal
+	is only replayed onto the snapshot of the same generation, so a crash
+	during compaction can not apply outdated changes.
+	
+	Records are zlib-compressed pickles, prefixed by their length. An 
+	incomplete last record (crash while writing) is ignored.
+	'''
+	MAGIC = b'CKPT'
+	VERSION = 1
+	HEADER = struct.Struct('!4sBQ') # magic, version, generation
+	RECORD = struct.Struct('!I') # length
+	MIN_JOURNAL_SIZE = 1048576 # Bytes, no compaction below
+	
+	def __init__(self, directory, name):
+		os.makedirs(directory, exist_ok=True)
+		self.base_filename = os.path.join(directory, name + '.base')
+		self.journal_filename = os.path.join(directory, name + '.journal')
+		self.generation = 0
+		self.base_size = 0
+		self.journal = None
+		
+	def load(self):
+		'''
+		@return state (dict) of the last checkpoint, empty if there is none
+		'''
+		state = dict()
+		try:
+			with open(self.base_filename, 'rb') as fo:
+				self.generation = self.__readHeader(fo)
+				for record in self.__readRecords(fo):
+					state = record
+			self.base_size = os.path.getsize(self.base_filename)
+		except (FileNotFoundError, ValueError) as e:
+			if not isinstance(e, FileNotFoundError):
+				log.warning("Checkpoint %s is unusable: %s" % (self.base_filename, e))
+			return state
+		try:
+			with open(self.journal_filename, 'rb') as fo:
+				if self.__readHeader(fo) == self.generation:
+					for upserts, removed in self.__readRecords(fo):
+						state.update(upserts)
+						for key in removed:
+							state.pop(key, None)
+		except (FileNotFoundError, ValueError):
+			pass
+		return state
+		
+	def append(self, upserts, removed, state):
+		'''
+		@param upserts: changed keys (dict key -> state)
+		@param removed: removed keys
+		@param state: function returning the whole state (called for compaction only)
+		'''
+		if self.journal is None:
+			self.compact(state())
+		if upserts or removed:
+			self.__writeRecord(self.journal, (upserts, list(removed)))
+			self.journal.flush()
+			os.fsync(self.journal.fileno())
+		if self.journal.tell() > max(self.base_size, Checkpoint.MIN_JOURNAL_SIZE):
+			self.compact(state())
+			
+	def compact(self, state):
+		'''
+		Writes state as new snapshot and starts an empty journal.
+		'''
+		self.generation += 1
+		self.__replace(self.base_filename, state)
+		self.base_size = os.path.getsize(self.base_filename)
+		if self.journal is not None:
+			self.journal.close()
+		self.__replace(self.journal_filename, None)
+		self.journal = open(self.journal_filename, 'ab')
+		
+	def close(self):
+		if self.journal is not None:
+			self.journal.close()
+			self.journal = None
+			
+	def remove(self):
+		self.close()
+		for filename in [self.base_filename, self.journal_filename]:
+			try:
+				os.remove(filename)
+			except FileNotFoundError:
+				pass
+				
+	@staticmethod
+	def getNames(directory):
+		'''
+		@return names of the checkpoints in directory
+		'''
+		try:
+			return [filename[:-len('.base')] for filename in os.listdir(directory) if filename.endswith('.base')]
+		except FileNotFoundError:
+			return []
+		
+	def __replace(self, filename, record):
+		temporary = filename + '.tmp'
+		with open(temporary, 'wb') as fo:
+			fo.write(Checkpoint.HEADER.pack(Checkpoint.MAGIC, Checkpoint.VERSION, self.generation))
+			if record is not None:
+				self.__writeRecord(fo, record)
+			fo.flush()
+			os.fsync(fo.fileno())
+		os.replace(temporary, filename) # atomic
+		
+	def __writeRecord(self, fo, record):
+		data = zlib.compress(pickle.dumps(record, pickle.HIGHEST_PROTOCOL), 1)
+		fo.write(Checkpoint.RECORD.pack(len(data)) + data)
+		
+	def __readHeader(self, fo):
+		header = fo.read(Checkpoint.HEADER.size)
+		if len(header) < Checkpoint.HEADER.size:
+			raise ValueError('Header incomplete')
+		magic, version, generation = Checkpoint.HEADER.unpack(header)
+		if magic != Checkpoint.MAGIC or version != Checkpoint.VERSION:
+			raise ValueError('Unknown format')
+		return generation
+		
+	def __readRecords(self, fo):
+		while True:
+			prefix = fo.read(Checkpoint.RECORD.size)
+			if len(prefix) < Checkpoint.RECORD.size:
+				return
+			length = Checkpoint.RECORD.unpack(prefix)[0]
+			data = fo.read(length)
+			if len(data) < length:
+				return # incomplete
+			try:
+				yield pickle.loads(zlib.decompress(data))
+			except (zlib.error, pickle.UnpicklingError, EOFError):
+				return
@@ -32,7 +32,7 @@
 
 class ByteInterpreter:
 	def __init__(self, bytestring):
-		self.bytestring = bytestring
+		self.bytestring = memoryview(bytestring) # slicing a memoryview does not copy
 	
 	def getValue(self, offset, length):
 		if offset < 0 or length <= 0:
@@ -0,0 +1,89 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import math, time
+
+class TimerWheel():
+	'''
+	Expiry index with one bucket per tick (resolution in seconds). expire() 
+	only visits the buckets of the elapsed ticks and the keys in them, 
+	independent of the number of keys waiting. Rescheduling or cancelling
+	a key does not search its old bucket: the bucket entry becomes stale 
+	and is skipped when the bucket is due (lazy deletion).
+	'''
+	def __init__(self, resolution=1, now=None):
+		self.resolution = resolution
+		self.buckets = dict()	# tick -> [keys]
+		self.deadlines = dict()	# key -> tick
+		self.current = self.__getTick(time.time() if now is None else now)
+		
+	def __len__(self):
+		return len(self.deadlines)
+		
+	def __contains__(self, key):
+		return key in self.deadlines
+		
+	def __getTick(self, timestamp):
+		return int(timestamp // self.resolution)
+		
+	def schedule(self, key, deadline):
+		'''
+		(Re-)schedules key to expire at deadline (seconds since epoch, never earlier).
+		'''
+		tick = max(int(math.ceil(deadline / self.resolution)), self.current)
+		if self.deadlines.get(key) == tick:
+			return
+		self.deadlines[key] = tick
+		if tick in self.buckets:
+			self.buckets[tick].append(key)
+		else:
+			self.buckets[tick] = [key]
+			
+	def cancel(self, key):
+		self.deadlines.pop(key, None)
+		
+	def expire(self, now=None):
+		'''
+		@return keys whose deadline has passed (removed from the wheel)
+		'''
+		last = self.__getTick(time.time() if now is None else now)
+		expired = []
+		if last - self.current > len(self.buckets): # long idle: visit existing buckets only
+			ticks = sorted(t for t in self.buckets if t <= last)
+		else:
+			ticks = range(self.current, last + 1)
+		for tick in ticks:
+			for key in self.buckets.pop(tick, ()):
+				if self.deadlines.get(key) == tick:
+					del self.deadlines[key]
+					expired.append(key)
+		self.current = max(self.current, last + 1)
+		return expired
@@ -0,0 +1,132 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, struct, mmap
+from array import array
+from network.prefixtable import IntervalIndex
+
+class BlacklistCache():
+	'''
+	Parsed ranges of all feeds and their merged IntervalIndex in one binary 
+	file, loaded by mmap. The ranges of a feed are only valid for the same 
+	file content (digest), the index only for the same feeds in the same order.
+	
+	Layout: !4sBBII (magic, version, byte order, feeds, blocks of the index), 
+	per feed !28s20sII (key, digest, offset and number of its ranges), padding 
+	to 8 bytes, first and last address of all ranges ('I'), start of all 
+	blocks ('I'), padding to 8 bytes, bitset of all blocks ('Q').
+	'''
+	HEADER = struct.Struct('!4sBBII')
+	FEED = struct.Struct('!28s20sII')
+	MAGIC = b'BLIX'
+	VERSION = 1 # Increment if the parser changes
+	
+	def __init__(self, filename):
+		self.filename = filename
+		self.feeds = dict() # key -> (digest, first addresses, last addresses)
+		self.keys = [] # (key, digest) in order of the index
+		self.index = None
+		
+	def load(self):
+		'''
+		@return False: missing, outdated version or corrupt
+		'''
+		try:
+			with open(self.filename, 'rb') as f:
+				data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			magic, version, little, feeds, blocks = BlacklistCache.HEADER.unpack_from(data, 0)
+			if magic != BlacklistCache.MAGIC or version != BlacklistCache.VERSION or little != (sys.byteorder == 'little'):
+				return False
+			offset = BlacklistCache.HEADER.size
+			entries = []
+			for i in range(feeds):
+				entries.append(BlacklistCache.FEED.unpack_from(data, offset))
+				offset += BlacklistCache.FEED.size
+			offset += -offset % 8
+			count = sum(e[3] for e in entries)
+			view = memoryview(data)
+			firsts = view[offset:offset + 4 * count].cast('I')
+			lasts = view[offset + 4 * count:offset + 8 * count].cast('I')
+			offset += 8 * count
+			starts = view[offset:offset + 4 * blocks].cast('I')
+			offset += 4 * blocks
+			offset += -offset % 8
+			masks = view[offset:offset + 8 * blocks].cast('Q')
+		except (OSError, ValueError, struct.error, TypeError):
+			return False
+		for key, digest, first, number in entries:
+			self.feeds[key] = (digest, firsts[first:first + number], lasts[first:first + number])
+		self.keys = [(key, digest) for key, digest, _, _ in entries]
+		if blocks:
+			self.index = IntervalIndex.fromArrays(starts, masks)
+		return True
+		
+	def getRanges(self, key, digest):
+		'''
+		@return [(first, last address), ...] or None (not cached or changed)
+		'''
+		feed = self.feeds.get(key)
+		if feed is None or feed[0] != digest:
+			return None
+		return list(zip(feed[1], feed[2]))
+		
+	def getIndex(self, keys):
+		'''
+		@param keys: [(key, digest), ...] of the feeds, in order of their bits
+		@return IntervalIndex or None
+		'''
+		if keys != self.keys:
+			return None
+		return self.index
+		
+	def save(self, feeds, index):
+		'''
+		@param feeds: [(key, digest, ranges), ...] in order of the bits of index
+		'''
+		firsts = array('I')
+		lasts = array('I')
+		data = bytearray(BlacklistCache.HEADER.pack(BlacklistCache.MAGIC, BlacklistCache.VERSION, 
+			sys.byteorder == 'little', len(feeds), len(index) if index.isCompact() else 0))
+		for key, digest, ranges in feeds:
+			data += BlacklistCache.FEED.pack(key, digest, len(firsts), len(ranges))
+			firsts.extend(first for first, _ in ranges)
+			lasts.extend(last for _, last in ranges)
+		data += bytes(-len(data) % 8)
+		data += firsts.tobytes() + lasts.tobytes()
+		if index.isCompact():
+			data += array('I', index.starts).tobytes()
+			data += bytes(-len(data) % 8)
+			data += array('Q', index.masks).tobytes()
+		temp = '%s.%i' % (self.filename, os.getpid())
+		with open(temp, 'wb') as f:
+			f.write(data)
+		os.replace(temp, self.filename)
+		self.keys = [(key, digest) for key, digest, _ in feeds]
@@ -36,23 +36,63 @@ import os
 import math
 import ipaddress
 import time
+import threading
 
 from urllib.parse import urlparse
 from lex.parser import SyntaxParser
-from network.iprange import IPRangeLookupManager
+from network.prefixtable import IntervalIndex
+from classifier.blacklistcache import BlacklistCache
+from base.applog import *
 
 class BlacklistReader:
 	DIRECTORY = 'download_cache'
 	CACHE_TTL = 86400 # One Day
 	
-	def __init__(self, feedUrl, reason, lineStartsNotWith, listtype):
+	'''
+	@param cache: BlacklistCache. The feed is only parsed if its file is not in there (or changed).
+	'''
+	def __init__(self, feedUrl, reason, lineStartsNotWith, listtype, cache = None):
 		self.feedUrl = feedUrl
 		self.lineStartsNotWith = lineStartsNotWith
 		self.listtype = listtype # White oder Blacklist
 		self.reason = reason
-		self.irlm = IPRangeLookupManager()
+		self.key = hashlib.sha224(feedUrl.encode('utf-8')).digest()
+		self.ranges = [] # (first, last address as int)
+		self.mtime = None # of the parsed file
+		self.digest = None # of the parsed file
 		self.__load()
+		digest = self.__getDigest()
+		ranges = cache.getRanges(self.key, digest) if cache and digest else None
+		if ranges is None:
+			self.__parse()
+		else:
+			self.ranges = ranges
+			self.mtime = os.path.getmtime(self.__getFilename())
+			self.digest = digest
+		
+	def refresh(self):
+		'''
+		Downloads the feed again if the cache is outdated and parses it if the file changed.
+		@return True: ranges changed
+		'''
+		self.__load()
+		try:
+			if os.path.getmtime(self.__getFilename()) == self.mtime:
+				return False
+		except OSError:
+			return False
+		if self.__getDigest() == self.digest: # downloaded again, but same content
+			self.mtime = os.path.getmtime(self.__getFilename())
+			return False
 		self.__parse()
+		return True
+		
+	def __getDigest(self):
+		try:
+			with open(self.__getFilename(), 'rb') as f:
+				return hashlib.sha1(f.read()).digest()
+		except OSError:
+			return None
 	
 	def __getFilename(self):
 		if self.feedUrl in ['whitelist', 'blacklist']:
@@ -91,13 +131,13 @@ class BlacklistReader:
 		except urllib3.exceptions.ProtocolError as e:
 			print(e, self.feedUrl)
 	
-	def getRisk(self, ip):
-		return self.irlm.lookupIP(ip)
-	
 	def __parse(self):
 		try:
 			sp = SyntaxParser()
-			fo = open(self.__getFilename(), 'r')
+			ranges = []
+			filename = self.__getFilename()
+			mtime = os.path.getmtime(filename)
+			fo = open(filename, 'r')
 			for line in fo:
 				line = line.strip()
 				if not line: continue
@@ -106,8 +146,11 @@ class BlacklistReader:
 				uni = self.getUnified(sp.getTokens(line))
 				if uni:
 					for s,e in uni:
-						self.irlm.addIP(s, e, (self.listtype, self.reason))
+						ranges.append((int(s), int(e)))
 			fo.close()
+			self.ranges = ranges
+			self.mtime = mtime
+			self.digest = self.__getDigest()
 		except FileNotFoundError:
 			print("Error in Securitymodule. File does not exist. Probably not downloaded properly: %s" % self.feedUrl)
 
@@ -202,21 +245,73 @@ More Blacklists @
 '''
 
 class HostClassifier:
-	def __init__(self):
-		self.alllists = [BlacklistReader(f,r,s,l) for f,r,s,l in blacklists]
+	'''
+	All lists are merged into one IntervalIndex (bit n: n-th list), which is 
+	rebuilt by a background thread when a feed was refreshed (see BlacklistReader.CACHE_TTL).
+	The thread is started by the first getRisk of a process (e.g. SecurityConsumer 
+	after fork, threads of the creating process do not survive it).
+	
+	@param refresh_interval: Seconds between two checks of the feeds (0: never)
+	'''
+	def __init__(self, refresh_interval=3600):
+		self.cache = BlacklistCache(os.path.join(BlacklistReader.DIRECTORY, 'blacklists.index'))
+		self.cache.load()
+		self.alllists = [BlacklistReader(f,r,s,l,self.cache) for f,r,s,l in blacklists]
+		self.index = self.cache.getIndex(self.__getKeys())
+		if self.index is None:
+			self.__rebuild()
+		self.refresh_interval = refresh_interval
+		self.refresh_pid = None # process running the refresh thread
+		
+	def __startRefresh(self):
+		self.refresh_pid = os.getpid()
+		if self.refresh_interval:
+			threading.Thread(target=self.__refresh, name='HostClassifier-Refresh', daemon=True).start()
+		
+	def __refresh(self):
+		while True:
+			time.sleep(self.refresh_interval)
+			try:
+				changed = [l.feedUrl for l in self.alllists if l.refresh()]
+				if changed:
+					self.__rebuild()
+					log.info("Blacklist index rebuilt (%s changed)" % ', '.join(changed))
+			except Exception as e:
+				log.error("Error while refreshing blacklists: %s" % e)
+				
+	def __getKeys(self):
+		return [(l.key, l.digest or bytes(20)) for l in self.alllists] # missing file: no digest
+		
+	def __rebuild(self):
+		index = IntervalIndex([l.ranges for l in self.alllists])
+		self.index = index # replaced at once: lookups use the old one until then
+		try:
+			self.cache.save([key + (l.ranges,) for key, l in zip(self.__getKeys(), self.alllists)], index)
+		except OSError as e:
+			log.warning("Blacklist cache not saved: %s" % e)
 		
 	def getRisk(self, ip):
-		count_all = 0
+		'''
+		@param ip: int, IPv4Address or string
+		'''
+		if self.refresh_pid != os.getpid():
+			self.__startRefresh()
+		count_all = len(self.alllists)
 		good = []
 		bad = []
-		for l in self.alllists:
-			count_all += 1
-			r = l.getRisk(ip)
-			if r:
-				if r[0] > 0:
-					good.append(r[1])
-				elif r[0] < 0:
-					bad.append(r[1])
+		mask = self.index.lookup(ip if type(ip) is int else int(ipaddress.ip_address(ip)))
+		bit = 0
+		while mask:
+			if mask & 1:
+				l = self.alllists[bit]
+				if l.listtype > 0:
+					good.append(l.reason)
+				elif l.listtype < 0:
+					bad.append(l.reason)
+			mask >>= 1
+			bit += 1
+		if type(ip) is int:
+			ip = ipaddress.IPv4Address(ip) # for the messages
 
 		if len(good) > 0:
 			return (ListType.WHITELIST, "Unsuspicious Host %s listed on %s" % (ip, ', '.join(good)))
@@ -0,0 +1,311 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, time, json, zlib, struct
+from base.applog import *
+from array import array
+from itertools import accumulate
+from ipaddress import IPv4Address
+
+MAGIC = b'IPXC'
+GROUP = struct.Struct('<4sII')
+
+def _toLittleEndian(values):
+	if sys.byteorder == 'big':
+		values.byteswap()
+	return values
+	
+def _getGroupEnd(f, offset, size):
+	'''
+	@return end of the group at offset (None: no complete group there)
+	'''
+	f.seek(offset)
+	data = f.read(GROUP.size)
+	if len(data) < GROUP.size:
+		return None
+	magic, header_length, body_length = GROUP.unpack(data)
+	end = offset + GROUP.size + header_length + body_length
+	return end if magic == MAGIC and end <= size else None
+	
+def _getKind(values):
+	types = set(type(v) for v in values if v is not None)
+	if not types:
+		return 's'
+	if types == {bool}:
+		return 'b'
+	if types == {int}:
+		return 'i'
+	if types <= {int, float}:
+		return 'f'
+	if types == {IPv4Address}:
+		return 'a'
+	return 's'
+	
+class ArchiveWriter():
+	'''
+	Buffers conversations and writes them as row group (rows_per_group rows, 
+	after flush_seconds, at the full hour or on close) to directory/prefix-YYYYMMDDHH.ipxc.
+	
+	A file is a sequence of row groups, each: GROUP (magic, header length, body length), header 
+	(JSON: rows, columns) and body (compressed blobs). Per column the header 
+	contains its kind and the position of its blobs in the body:
+		i	integers (and bools, kind b), delta-encoded int64
+		f	floats (and mixed integers / floats), float64
+		a	IPv4 addresses, uint32
+		s	strings (and other objects: str), dictionary (JSON list) and uint32 codes
+	Missing values (None or key not present) are marked in an optional null 
+	bitmap. Nested dicts (flow_request, flow_response) are flattened to 
+	'flow_request.octetDeltaCount' etc. Arrays are stored little-endian. 
+	Readers only decompress the columns they ask for.
+	'''
+	SUFFIX = '.ipxc'
+	
+	def __init__(self, directory, rows_per_group=65536, compression_level=6, prefix='conversations', flush_seconds=60):
+		self.directory = directory
+		self.rows_per_group = rows_per_group
+		self.compression_level = compression_level
+		self.prefix = prefix
+		self.flush_seconds = flush_seconds
+		self.rows = []
+		self.hour = None # local time, YYYYMMDDHH
+		self.last_flush = time.time()
+		self.checked = None # file whose end was checked for an incomplete group
+		
+	def append(self, document):
+		self.appendMany((document,))
+		
+	def appendMany(self, documents):
+		hour = time.strftime('%Y%m%d%H')
+		if hour != self.hour:
+			self.flush()
+			self.hour = hour
+		for document in documents:
+			row = {}
+			for key, value in document.items():
+				if isinstance(value, dict):
+					for subkey, subvalue in value.items():
+						row[key + '.' + subkey] = subvalue
+				else:
+					row[key] = value
+			self.rows.append(row)
+		if len(self.rows) >= self.rows_per_group:
+			self.flush()
+		else:
+			self.poll()
+			
+	def poll(self):
+		'''
+		Writes the rows as row group if flush_seconds have passed (or the hour changed).
+		'''
+		now = time.time()
+		if now - self.last_flush >= self.flush_seconds or time.strftime('%Y%m%d%H', time.localtime(now)) != self.hour:
+			self.flush()
+			
+	def flush(self):
+		self.last_flush = time.time()
+		if not self.rows:
+			return
+		names = {}
+		for row in self.rows:
+			for name in row:
+				names[name] = None # ordered by first appearance
+		header = { 'rows': len(self.rows), 'columns': {} }
+		body = bytearray()
+		for name in names:
+			values = [row.get(name) for row in self.rows]
+			column = header['columns'][name] = {}
+			for blob, data in self.__encodeColumn(values, column):
+				column[blob] = (len(body), len(data))
+				body += data
+		header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+		os.makedirs(self.directory, exist_ok=True)
+		filename = self.getFilename(self.hour)
+		with open(filename, 'a+b') as f: # read: see __truncateIncomplete
+			if self.checked != filename:
+				self.__truncateIncomplete(f, filename)
+			f.write(GROUP.pack(MAGIC, len(header), len(body)))
+			f.write(header)
+			f.write(body)
+		self.rows = []
+		
+	def close(self):
+		self.flush()
+		
+	def __truncateIncomplete(self, f, filename):
+		'''
+		Removes an incomplete group at the end (e.g. crash while writing), 
+		otherwise groups appended after it could not be read.
+		'''
+		self.checked = filename
+		size = os.fstat(f.fileno()).st_size
+		end = 0
+		while end < size:
+			group_end = _getGroupEnd(f, end, size)
+			if group_end is None:
+				log.warning("Archive %s: incomplete row group (%i bytes) removed." % (filename, size - end))
+				f.truncate(end)
+				break
+			end = group_end
+		
+	def getFilename(self, hour):
+		'''
+		@param hour: local time, YYYYMMDDHH
+		'''
+		return os.path.join(self.directory, '%s-%s%s' % (self.prefix, hour, ArchiveWriter.SUFFIX))
+		
+	def __encodeColumn(self, values, column):
+		'''
+		Sets the kind of column.
+		@return [(blob name, compressed bytes)]
+		'''
+		blobs = []
+		if None in values:
+			nulls = bytearray((len(values) + 7) // 8)
+			for i, value in enumerate(values):
+				if value is None:
+					nulls[i >> 3] |= 1 << (i & 7)
+			blobs.append(('nulls', nulls))
+		kind = _getKind(values)
+		try:
+			if kind in 'ib':
+				deltas, previous = [], 0
+				for value in values:
+					if value is not None:
+						deltas.append(value - previous)
+						previous = value
+					else:
+						deltas.append(0)
+				data = array('q', deltas)
+			elif kind == 'f':
+				data = array('d', [v if v is not None else 0 for v in values])
+			elif kind == 'a':
+				data = array('I', [int(v) if v is not None else 0 for v in values])
+		except OverflowError: # beyond int64
+			kind = 's'
+		if kind == 's':
+			dictionary, codes = {}, array('I')
+			for value in values:
+				if value is None:
+					codes.append(0)
+				else:
+					value = value if type(value) is str else str(value)
+					code = dictionary.get(value)
+					if code is None:
+						code = dictionary[value] = len(dictionary)
+					codes.append(code)
+			blobs.append(('dictionary', json.dumps(list(dictionary), ensure_ascii=False, separators=(',', ':')).encode('utf-8')))
+			data = codes
+		column['kind'] = kind
+		blobs.append(('data', _toLittleEndian(data).tobytes()))
+		return [(name, zlib.compress(blob, self.compression_level)) for name, blob in blobs]
+		
+class ArchiveReader():
+	'''
+	Reads archive files of ArchiveWriter column by column.
+	'''
+	def __init__(self, filename):
+		self.filename = filename
+		
+	def getGroups(self):
+		'''
+		@return generator of (rows, {column: kind}) per row group
+		'''
+		for f, start, header in self.__iterGroups():
+			yield header['rows'], { name: column['kind'] for name, column in header['columns'].items() }
+			
+	def scan(self, columns):
+		'''
+		@param columns: names of the columns to read (other columns are skipped)
+		@return generator of {column: list of values} per row group (missing: None)
+		'''
+		for f, start, header in self.__iterGroups():
+			result = {}
+			for name in columns:
+				column = header['columns'].get(name)
+				if column is None:
+					result[name] = [None] * header['rows']
+				else:
+					result[name] = self.__decodeColumn(f, start, header['rows'], column)
+			yield result
+			
+	def getRows(self, columns):
+		'''
+		@return generator of dicts (only columns present in a row)
+		'''
+		for group in self.scan(columns):
+			for values in zip(*group.values()):
+				yield { name: value for name, value in zip(columns, values) if value is not None }
+				
+	def __iterGroups(self):
+		with open(self.filename, 'rb') as f:
+			size = os.fstat(f.fileno()).st_size
+			offset = 0
+			while True:
+				data = f.read(GROUP.size)
+				if len(data) < GROUP.size: # end (or incomplete group)
+					return
+				magic, header_length, body_length = GROUP.unpack(data)
+				if magic != MAGIC:
+					raise ValueError("%s is not an archive file." % self.filename)
+				start = offset + GROUP.size + header_length
+				if start + body_length > size: # incomplete group at the end (crash while writing)
+					return
+				header = json.loads(f.read(header_length).decode('utf-8'))
+				yield f, start, header
+				offset = start + body_length
+				f.seek(offset)
+				
+	def __readBlob(self, f, start, blob):
+		f.seek(start + blob[0])
+		return zlib.decompress(f.read(blob[1]))
+		
+	def __decodeColumn(self, f, start, rows, column):
+		kind = column['kind']
+		data = array({ 'i': 'q', 'b': 'q', 'f': 'd', 'a': 'I', 's': 'I' }[kind])
+		data.frombytes(self.__readBlob(f, start, column['data']))
+		_toLittleEndian(data)
+		if kind in 'ib':
+			values = list(accumulate(data))
+			if kind == 'b':
+				values = [bool(v) for v in values]
+		elif kind == 'a':
+			values = [IPv4Address(v) for v in data]
+		elif kind == 's':
+			dictionary = json.loads(self.__readBlob(f, start, column['dictionary']).decode('utf-8'))
+			values = [dictionary[code] for code in data] if dictionary else [None] * rows
+		else:
+			values = data.tolist()
+		if 'nulls' in column:
+			nulls = self.__readBlob(f, start, column['nulls'])
+			for i in range(rows):
+				if nulls[i >> 3] & (1 << (i & 7)):
+					values[i] = None
+		return values
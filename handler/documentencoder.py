@@ -0,0 +1,73 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import json
+from socket import inet_ntoa
+from ipaddress import IPv4Address
+
+class DocumentEncoder():
+	'''
+	Encodes conversation and stats documents as JSON lines (bulk API of 
+	Elasticsearch) into a bytearray. Fields and nested objects with plain 
+	values (flow_request / flow_response) are left to the C encoder of json 
+	(compact, no circular check), addresses (ADDRESS_FIELDS) are converted 
+	before by inet_ntoa instead of IPv4Address.__str__. Other objects are 
+	written as str(). Action lines are built once per index and doctype.
+	'''
+	ADDRESS_FIELDS = ('sourceIPv4Address', 'destinationIPv4Address')
+	
+	def __init__(self):
+		self.encode = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(',', ':'), default=str).encode
+		self.actions = dict() # (index, doctype) -> bytes
+		
+	def getAction(self, index, doctype):
+		action = self.actions.get((index, doctype))
+		if action is None:
+			if len(self.actions) > 64: # daily indices
+				self.actions.clear()
+			action = self.actions[(index, doctype)] = (self.encode({ "index" : { "_index" : index, "_type" : doctype } }) + '\n').encode('utf-8')
+		return action
+		
+	def append(self, buffer, document):
+		'''
+		Appends document (dict or mapping, not modified) as one line to buffer.
+		'''
+		copy = None
+		for field in DocumentEncoder.ADDRESS_FIELDS:
+			value = document.get(field)
+			if type(value) is IPv4Address:
+				if copy is None:
+					copy = dict(document)
+				copy[field] = inet_ntoa(value.packed)
+		if copy is None and type(document) is not dict:
+			copy = dict(document) # e.g. view of a FlowBatch
+		buffer += self.encode(copy if copy is not None else document).encode('utf-8')
+		buffer += b'\n'
@@ -32,13 +32,186 @@
 from base.applog import *
 import urllib.request
 from urllib.error import HTTPError
+import urllib3
+import json, time, threading, queue
+from handler.documentencoder import DocumentEncoder
 
+class BulkWriter():
+	'''
+	Collects documents and sends them with the _bulk API of Elasticsearch 
+	over a pool of keep-alive connections (vendored urllib3). A request is 
+	sent when max_documents or max_bytes are reached, or max_milliseconds 
+	after its first document. Up to concurrency requests are in flight 
+	(sender threads), add() blocks if all of them are busy (backpressure).
+	
+	Items rejected by Elasticsearch (RETRY_STATUS, e.g. 429: queue full) 
+	are sent again, up to max_retries times with increasing delay. Other 
+	failed items (e.g. mapping errors) are logged and dropped. Documents not
+	saved after all attempts (or because of an unexpected error) are counted 
+	in failed.
+	
+	@param index_name: function returning the name of the index
+	'''
+	RETRY_STATUS = (429, 502, 503, 504)
+	RETRY_DELAY = 0.5 # Seconds, multiplied with the attempt
+	TIMEOUT = 30 # Seconds per request
+	
+	def __init__(self, host, port, index_name, max_documents=5000, max_bytes=5242880, max_milliseconds=1000, concurrency=2, max_retries=3):
+		self.host = host
+		self.port = port
+		self.index_name = index_name
+		self.max_documents = max_documents
+		self.max_bytes = max_bytes
+		self.max_seconds = max_milliseconds / 1000
+		self.concurrency = concurrency
+		self.max_retries = max_retries
+		self.encoder = DocumentEncoder()
+		self.pending = bytearray() # action and document lines
+		self.offsets = [] # of the actions in pending
+		self.started = 0
+		self.lock = threading.Lock()
+		self.requests = None # created in the process using it (threads do not survive fork)
+		self.pool = None
+		self.senders = []
+		self.timer = None
+		self.stopped = None
+		self.failed = 0 # documents not saved
+		
+	def add(self, documents, doctype):
+		'''
+		@param documents: iterable of dicts
+		'''
+		if self.requests is None:
+			self.__start()
+		action = self.encoder.getAction(self.index_name(), doctype)
+		due = []
+		with self.lock:
+			for document in documents:
+				if not self.offsets:
+					self.started = time.time()
+				self.offsets.append(len(self.pending))
+				self.pending += action
+				self.encoder.append(self.pending, document)
+				if len(self.offsets) >= self.max_documents or len(self.pending) >= self.max_bytes:
+					due.append(self.__take())
+		for items in due:
+			self.requests.put((items, 0)) # blocks if all senders are busy
+			
+	def flush(self):
+		with self.lock:
+			items = self.__take() if self.offsets else None
+		if items:
+			self.requests.put((items, 0))
+			
+	def close(self):
+		'''
+		Sends everything pending and waits for the requests in flight.
+		'''
+		if self.requests is None:
+			return
+		self.stopped.set()
+		self.timer.join() # no request after the final one
+		self.flush()
+		for sender in self.senders:
+			self.requests.put(None)
+		for sender in self.senders:
+			sender.join()
+		self.requests = None
+		self.senders = []
+		self.timer = None
+		
+	def __take(self):
+		'''
+		@return (body, offsets of its items)
+		'''
+		items = (bytes(self.pending), self.offsets)
+		del self.pending[:]
+		self.offsets = []
+		return items
+		
+	def __start(self):
+		self.requests = queue.Queue(self.concurrency)
+		self.pool = urllib3.HTTPConnectionPool(self.host, self.port, maxsize=self.concurrency, block=True, 
+			retries=False, timeout=BulkWriter.TIMEOUT, headers={'Content-Type': 'application/json'})
+		self.senders = [threading.Thread(target=self.__send, name='BulkWriter-%i' % i, daemon=True) for i in range(self.concurrency)]
+		self.stopped = threading.Event()
+		self.timer = threading.Thread(target=self.__flushDue, name='BulkWriter-Timer', daemon=True)
+		for thread in self.senders + [self.timer]:
+			thread.start()
+			
+	def __flushDue(self):
+		while not self.stopped.wait(self.max_seconds / 2): # until closed
+			with self.lock:
+				items = self.__take() if self.offsets and self.started + self.max_seconds <= time.time() else None
+			if items:
+				self.requests.put((items, 0))
+				
+	def __send(self):
+		while True:
+			request = self.requests.get()
+			if request is None:
+				return
+			items, attempt = request
+			while items:
+				if attempt:
+					time.sleep(BulkWriter.RETRY_DELAY * attempt)
+				try:
+					items = self.__bulk(*items)
+				except (urllib3.exceptions.HTTPError, ValueError) as e: # whole request failed (connection, bad response)
+					log.warning("Elasticsearch bulk request with %i documents failed: %s" % (len(items[1]), e))
+				except Exception as e: # the sender must not die
+					log.error("%i documents not saved to Elasticsearch: %s" % (len(items[1]), e))
+					self.__addFailed(len(items[1]))
+					break
+				attempt += 1
+				if items and attempt > self.max_retries:
+					log.error("%i documents not saved to Elasticsearch after %i attempts." % (len(items[1]), attempt))
+					self.__addFailed(len(items[1]))
+					break
+					
+	def __addFailed(self, count):
+		with self.lock:
+			self.failed += count
+					
+	def __bulk(self, body, offsets):
+		'''
+		@return (body, offsets) of the items to be sent again or None
+		'''
+		response = self.pool.urlopen('POST', '/_bulk', body=body)
+		if response.status in BulkWriter.RETRY_STATUS:
+			return body, offsets
+		if response.status != 200:
+			log.error("Elasticsearch bulk request failed (HTTP-Status: %i): %s" % (response.status, response.data[:1000].decode('utf-8', 'replace')))
+			return None
+		result = json.loads(response.data.decode('utf-8'))
+		if not result.get('errors'):
+			return None
+		retry = bytearray()
+		retry_offsets = []
+		failed = 0
+		ends = offsets[1:] + [len(body)]
+		for start, end, answer in zip(offsets, ends, result['items']):
+			answer = next(iter(answer.values())) # { "index": { "status": ... } }
+			if answer.get('status') in BulkWriter.RETRY_STATUS:
+				retry_offsets.append(len(retry))
+				retry += body[start:end]
+			elif answer.get('error'):
+				failed += 1
+				error = answer['error']
+		if failed:
+			log.error("Elasticsearch rejected %i documents: %s" % (failed, error))
+		return (bytes(retry), retry_offsets) if retry_offsets else None
+		
 class ElasticsearchClient():
-	def __init__(self, host='127.0.0.1', port=9200, index='default', doctype='doc'):
+	'''
+	@param bulk: Options of BulkWriter (max_documents, max_bytes, max_milliseconds, concurrency, max_retries)
+	'''
+	def __init__(self, host='127.0.0.1', port=9200, index='default', doctype='doc', bulk={}):
 		self.index = index
 		self.doctype = doctype
 		self.host = host
 		self.port = port
+		self.writer = BulkWriter(host, port, self.__getDailyIndex, **bulk)
 		#self.setup()
 		
 	def setup(self):
@@ -63,43 +236,21 @@ class ElasticsearchClient():
 
 		
 	def saveMany(self, data, doctype):
+		'''
+		Queues the documents for the BulkWriter (sent asynchronously).
+		'''
 		log.debug("Trying to save %d items to Elasticsearch." % len(data))
-		serialized_data = [self.__makeStringsFromDict(x) for x in data]
-		return self.__bulkJSON(serialized_data, doctype)
+		self.writer.add(data, doctype)
+		
+	def close(self):
+		self.writer.close()
 	
-	def __makeStringsFromDict(self, dictionary):
-		try:
-			for key in dictionary.keys():	# Native Datatypes: No Objects!
-				if isinstance(dictionary[key], dict): # nested...
-					dictionary[key] = self.__makeStringsFromDict(dictionary[key])
-				elif not isinstance(dictionary[key], str) and not isinstance(dictionary[key], int) and not isinstance(dictionary[key], float):
-					dictionary[key] = dictionary[key].__str__()
-			return dictionary
-		except Exception as e:
-			log.error(e)
-
 	def deleteIndex(self):
 		request = urllib.request.Request('http://%s:%i/%s/' % (self.host, self.port, self.__getDailyIndex()))
 		request.get_method = lambda: 'DELETE'
 		res = urllib.request.urlopen(request)
 		log.info("Elasticsearch-Index '%s' was removed." % self.index)
 		
-	def __bulkJSON(self, bulkdata, doctype):
-		try:
-			head = ({ "index" : { "_index" : self.__getDailyIndex(), "_type" : doctype } }).__str__() + '\n'
-			dataAsStr = ('\n'.join([head + line.__str__() for line in bulkdata])).replace('\'', '\"') + '\n'
-			req = urllib.request.Request(
-				'http://%s:%i/%s/%s/_bulk' % (self.host, self.port, self.__getDailyIndex(), doctype),
-				dataAsStr.encode("utf8"),
-				headers={'Content-Type':'application/json'}
-			)
-			res = urllib.request.urlopen(req)
-			return res.read().decode("utf8")
-			if res.status != 200:
-				raise Exception(res.read().decode("utf8"))
-		except HTTPError as e:
-			raise Exception(e.read().decode("utf8"))
-			
 	def __exists_index(self):
 		try:
 			req = urllib.request.Request(
@@ -29,11 +29,122 @@
 # OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
 # POSSIBILITY OF SUCH DAMAGE.
 
+import os, time, gzip, lzma
+from handler.documentencoder import DocumentEncoder
+
 class FileWriter():
-	def __init__(self, filename):
+	'''
+	Writes conversations as JSON lines (see DocumentEncoder) to filename. 
+	Lines are buffered and written when buffer_bytes are pending or 
+	flush_seconds have passed, the file stays open. 
+	The file is rotated (renamed to filename.YYYYMMDDHH[.N]) when it 
+	exceeds max_bytes (0: never) or, if hourly, at the full hour. 
+	compression: None, 'gzip' or 'lzma' (suffix .gz / .xz). A compressed file 
+	left from an earlier run is rotated, not appended to (it may lack its trailer).
+	LZMAFile.flush() does not flush the compressor: with lzma, every flush after 
+	flush_seconds finishes the stream and starts a new one (xz reads them as one file).
+	'''
+	COMPRESSION = { None: '', 'gzip': '.gz', 'lzma': '.xz' }
+	
+	def __init__(self, filename, max_bytes=0, hourly=False, compression=None, buffer_bytes=1048576, flush_seconds=1):
+		if compression not in FileWriter.COMPRESSION:
+			raise ValueError("Unknown compression: %s" % compression)
 		self.filename = filename
+		self.max_bytes = max_bytes
+		self.hourly = hourly
+		self.compression = compression
+		self.buffer_bytes = buffer_bytes
+		self.flush_seconds = flush_seconds
+		self.encoder = DocumentEncoder()
+		self.pending = bytearray()
+		self.last_flush = time.time()
+		self.raw = None # file on disk (size)
+		self.file = None # compressing file (or raw)
+		self.hour = None # local time, YYYYMMDDHH
+		
+	def append(self, document):
+		self.appendMany((document,))
+		
+	def appendMany(self, documents):
+		for document in documents:
+			self.encoder.append(self.pending, document)
+		if len(self.pending) >= self.buffer_bytes:
+			self.flush(sync=False)
+		else:
+			self.poll()
+			
+	def poll(self):
+		'''
+		Flushes if flush_seconds have passed (also without new lines, e.g. to rotate at the full hour).
+		'''
+		now = time.time()
+		if now - self.last_flush >= self.flush_seconds:
+			self.flush(now)
+			
+	def flush(self, now=None, sync=True):
+		'''
+		@param sync: lines on disk afterwards (not only in the compressor / buffer)
+		'''
+		if now is None:
+			now = time.time()
+		self.last_flush = now
+		hour = time.strftime('%Y%m%d%H', time.localtime(now))
+		if self.file is not None and ((self.hourly and hour != self.hour) or (self.max_bytes and self.raw.tell() >= self.max_bytes)):
+			self.__rotate()
+		if not self.pending:
+			return
+		if self.file is None:
+			self.__open(hour)
+		self.file.write(self.pending)
+		if sync:
+			self.__sync()
+		del self.pending[:]
+		
+	def close(self):
+		self.flush(sync=False) # closing finishes the stream / writes the trailer
+		if self.file is not None:
+			self.__close()
+			
+	def __getPath(self):
+		return self.filename + FileWriter.COMPRESSION[self.compression]
+		
+	def __open(self, hour):
+		path = self.__getPath()
+		if os.path.exists(path):
+			modified = time.strftime('%Y%m%d%H', time.localtime(os.path.getmtime(path)))
+			if self.compression or (self.hourly and modified != hour):
+				self.__rename(modified) # left from an earlier run (compressed: maybe without trailer) or hour
+		self.raw = open(path, 'ab')
+		if self.compression == 'gzip':
+			self.file = gzip.GzipFile(fileobj=self.raw, mode='ab') # new member
+		elif self.compression == 'lzma':
+			self.file = lzma.LZMAFile(self.raw, 'ab') # new stream
+		else:
+			self.file = self.raw
+		self.hour = hour
+		
+	def __sync(self):
+		if self.compression == 'lzma': # flush() would keep the data in the compressor
+			self.file.close() # finishes the stream, raw stays open
+			self.raw.flush()
+			self.file = lzma.LZMAFile(self.raw, 'ab')
+		else:
+			self.file.flush()
+		
+	def __close(self):
+		self.file.close()
+		if self.file is not self.raw:
+			self.raw.close()
+		self.file = self.raw = None
+		
+	def __rotate(self):
+		self.__close()
+		self.__rename(self.hour)
 		
-	def append(self, line):
-		with open(self.filename, "a") as outfile:
-			outfile.write(str(line))
-			outfile.write("\n")
\ No newline at end of file
+	def __rename(self, hour):
+		name = '%s.%s' % (self.filename, hour)
+		target, n = name, 0
+		while os.path.exists(target + FileWriter.COMPRESSION[self.compression]):
+			n += 1
+			target = '%s.%i' % (name, n)
+		os.rename(self.__getPath(), target + FileWriter.COMPRESSION[self.compression])
@@ -45,7 +45,7 @@ class UDPSender():
 		
 	def send(self, mylist):
 		for chunk in self.chunks(mylist, 5):
-			data = pickle.dumps(chunk)
+			data = pickle.dumps([dict(item) for item in chunk]) # FlowBatch: dicts for the receiver
 			newchunksizerecommendation = int((self.__mtu / len(data)) - 1)
 			if self.__chunksize > newchunksizerecommendation:
 				self.__chunksize = newchunksizerecommendation
@@ -0,0 +1,148 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Name tables of iana.protocol, compiled into a binary file (protocol.tables, 
+next to this module) and loaded by mmap: every forked worker shares the 
+pages instead of importing the dict literals of iana.protocol. A lookup is 
+one index into the port (65536 entries) or protocol (256 entries) array, 
+the names of unknown ports / protocols are precomputed as well.
+
+The file is compiled when it is missing or iana/protocol.py has changed
+(its modification time and size in the header), or explicitly: python -m iana.tables
+
+Layout: !4sBQQII (magic, byte order, mtime (ns) and size of protocol.py, 
+number of names, size of the name pool), name pool (utf-8, NUL separated), padding to 8 bytes,
+65536 ports + 256 protocols (unsigned short, native byte order: index of the name).
+'''
+
+import os, sys, struct, mmap
+from array import array
+
+HEADER = struct.Struct('!4sBQQII')
+MAGIC = b'IANA'
+PORTS = 65536
+PROTOCOLS = 256
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'protocol.py')
+FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'protocol.tables')
+
+def _getSourceKey():
+	stat = os.stat(SOURCE)
+	return stat.st_mtime_ns, stat.st_size
+		
+def _build():
+	from iana.protocol import serviceNum2Name, transportNum2Name
+	names = []
+	index = dict()
+	def intern(name):
+		if name not in index:
+			index[name] = len(names)
+			names.append(name)
+		return index[name]
+	ports = array('H', [intern(serviceNum2Name(port)) for port in range(PORTS)])
+	protocols = array('H', [intern(transportNum2Name(protocol)) for protocol in range(PROTOCOLS)])
+	pool = '\0'.join(names).encode('utf-8')
+	data = HEADER.pack(MAGIC, sys.byteorder == 'little', *_getSourceKey(), len(names), len(pool)) + pool
+	data += bytes(-len(data) % 8)
+	return data + ports.tobytes() + protocols.tobytes()
+	
+def compileTables(filename=FILENAME, data=None):
+	'''
+	Writes the tables of iana.protocol to filename (atomically).
+	@param data: compiled tables (default: compiled now)
+	'''
+	temp = '%s.%i' % (filename, os.getpid())
+	with open(temp, 'wb') as f:
+		f.write(data or _build())
+	os.replace(temp, filename)
+	
+def _parse(data, verify=True):
+	magic, little, mtime, source_size, count, size = HEADER.unpack_from(data, 0)
+	if magic != MAGIC or little != (sys.byteorder == 'little'):
+		return None
+	if verify and (mtime, source_size) != _getSourceKey():
+		return None
+	offset = HEADER.size
+	names = bytes(data[offset:offset + size]).decode('utf-8').split('\0') # one object per name
+	offset += size + (-(offset + size) % 8)
+	if len(names) != count or len(data) != offset + 2 * (PORTS + PROTOCOLS):
+		return None
+	indices = memoryview(data)[offset:].cast('H')
+	return names, indices[:PORTS], indices[PORTS:]
+	
+def loadTables(filename=FILENAME):
+	'''
+	@return (names, ports, protocols): names as list of (distinct) strings, 
+		ports and protocols as memoryview of name indices (None: missing or outdated)
+	'''
+	try:
+		with open(filename, 'rb') as f:
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	except (OSError, ValueError): # missing or empty
+		return None
+	if len(data) < HEADER.size:
+		return None
+	return _parse(data)
+	
+def _load():
+	tables = loadTables()
+	if tables is None:
+		data = _build()
+		try:
+			compileTables(data=data)
+			tables = loadTables()
+		except OSError:
+			pass
+		if tables is None: # read-only installation (or protocol.py changed meanwhile): not shared
+			tables = _parse(data, verify=False)
+	return tables
+	
+NAMES, _PORTS, _PROTOCOLS = _load()
+
+def serviceNum2Name(number):
+	if 0 <= number < PORTS:
+		return NAMES[_PORTS[number]]
+	return 'Unknown Service' # see iana.protocol.serviceNum2Name
+	
+def transportNum2Name(number):
+	if 0 <= number < PROTOCOLS:
+		return NAMES[_PROTOCOLS[number]]
+	return 'Unknown Transport Protocol (%s)' % number
+	
+def getServiceNames():
+	'''
+	@return Names of all ports (set)
+	'''
+	return set(NAMES[i] for i in set(_PORTS))
+	
+if __name__ == "__main__":
+	compileTables()
+	print("%s compiled." % FILENAME)
@@ -29,45 +29,85 @@
 # OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
 # POSSIBILITY OF SUCH DAMAGE.
 
-import time, math
+import time, math, sys
+from collections import OrderedDict
 # sort: http://stackoverflow.com/questions/72899/how-do-i-sort-a-list-of-dictionaries-by-values-of-the-dictionary-in-python
 import operator
-from base.aggregator import ListAggregator
+from ipfix.flowbatch import FlowBatch
+from ipfix.socket_key import socketKeyToString
+from base.timerwheel import TimerWheel
 
 class IPFIXConversation():
+	'''
+	Aggregates the flows of a conversation as they arrive (add): per direction 
+	only the running sum / min / max and the number of flows are kept, besides 
+	the first flow (reference). Memory per conversation is constant.
+	'''
+	DEFAULT_AGGS = {
+		'octetDeltaCount': 'sum', 
+		'packetDeltaCount': 'sum', 
+		'flowDurationMilliseconds': 'sum', 
+		'timestamp': 'min',
+		'flowStartSysUpTime': 'min',
+		'flowEndSysUpTime': 'max'
+	}
+	ACTION_SIZE = sys.getsizeof(dict.fromkeys(['flow_count'] + list(DEFAULT_AGGS), 0)) # aggregates of one direction
 	
-	def __init__(self, related_flows):
-		self.related_flows = related_flows
-		self.default_aggs = {
-			'octetDeltaCount': 'sum', 
-			'packetDeltaCount': 'sum', 
-			'flowDurationMilliseconds': 'sum', 
-			'timestamp': 'min',
-			'flowStartSysUpTime': 'min',
-			'flowEndSysUpTime': 'max'
-		} 
+	def __init__(self, reference_flow, add=True):
+		self.reference = dict(reference_flow) # copy (e.g. view of a FlowBatch)
 		self.action1 = None
 		self.action2 = None
+		if add:
+			self.add(reference_flow)
+			
+	def getState(self):
+		return (self.reference, self.action1, self.action2)
+		
+	@classmethod
+	def fromState(cls, state):
+		conversation = cls(state[0], False)
+		conversation.action1, conversation.action2 = state[1], state[2]
+		return conversation
+		
+	def merge(self, other):
+		'''
+		Adds the flows aggregated by another instance of the same conversation 
+		(e.g. handed over by another worker). The reference flow is kept.
+		'''
+		if other.reference['sourceIPv4Address'] == self.reference['sourceIPv4Address']:
+			requests, responses = other.action1, other.action2
+		else:
+			requests, responses = other.action2, other.action1
+		self.action1 = self.__mergeAggregates(self.action1, requests)
+		self.action2 = self.__mergeAggregates(self.action2, responses)
+		
+	def add(self, flow):
+		if flow['sourceIPv4Address'] == self.reference['sourceIPv4Address']: # First Element is Pivot
+			self.action1 = self.__aggregateFlow(self.action1, flow)
+		else:
+			self.action2 = self.__aggregateFlow(self.action2, flow)
+			
+	def hasResponse(self):
+		return self.action2 is not None
+		
+	def getSize(self):
+		'''
+		@return Approximate memory usage in bytes (constant after the first flow)
+		'''
+		size = sys.getsizeof(self) + sys.getsizeof(self.reference) + sum([sys.getsizeof(v) for v in self.reference.values()])
+		return size + 2 * IPFIXConversation.ACTION_SIZE # action1 + action2
 		
 	def getConversation(self):
-		result = []
-		action1_bucket = []
-		action2_bucket = []
-		for flow in self.related_flows:
-			if flow['sourceIPv4Address'] == self.related_flows[0]['sourceIPv4Address']: # First Element is Pivot
-				action1_bucket.append(flow)
-			else:
-				action2_bucket.append(flow)
-		self.action1 = self.__aggregateFlows(action1_bucket)
-		self.action2 = self.__aggregateFlows(action2_bucket)
 		self.__bucketPostprocessing()
 		return self.makeInfo()
 
 	def makeInfo(self):
-		flow = self.related_flows[0] # Reference Flow
+		flow = self.reference # Reference Flow
 		requiredFields = set(['sourceIPv4Address', 'destinationIPv4Address', 'exporter', 'exportInterface']) # anpassen (global)
 		if requiredFields.issubset(set(flow.keys())):
 			dnl = dict(flow) # copy
+			if dnl.get('socketIdentifier') is not None:
+				dnl['socketIdentifier'] = socketKeyToString(dnl['socketIdentifier'])
 			dnl['@timestamp'] = int((flow["timestamp"] - (self.__getOverallDuration() / 1000)) * 1000) # ES needs timestamp in ms (!)
 			dnl['responsetime'] = self.__getResponseTime()
 			
@@ -97,7 +137,7 @@ class IPFIXConversation():
 			# Cleanup (Remove aggregated fields)
 			# del(dnl['sourceNetworkLocation'])
 			# del(dnl['destinationNetworkLocation'])
-			for k in self.default_aggs.keys():
+			for k in IPFIXConversation.DEFAULT_AGGS.keys():
 				del(dnl[k])
 			
 			return dnl
@@ -123,16 +163,38 @@ class IPFIXConversation():
 			flow_duration += self.action2['flowDurationMilliseconds']
 		return flow_duration
 			
-	def __aggregateFlows(self, bucket):
-		if not bucket:
-			return None
-		result = dict()
-		result['flow_count'] = len(bucket)
-		for field,function in self.default_aggs.items(): # TODO: all other fields: mostCommon (?)
-			column = [flow[field] for flow in bucket]
-			if column:
-				la = ListAggregator(column)
-				result[field] = la.aggregate(function)
+	def __aggregateFlow(self, result, flow):
+		if result is None:
+			result = { 'flow_count': 0 }
+		result['flow_count'] += 1
+		for field,function in IPFIXConversation.DEFAULT_AGGS.items(): # TODO: all other fields: mostCommon (?)
+			if field not in flow:
+				continue
+			self.__aggregateValue(result, field, function, flow[field])
+		return result
+		
+	def __aggregateValue(self, result, field, function, value):
+		if field not in result:
+			result[field] = value
+		elif function == 'sum':
+			result[field] += value
+		elif function == 'min':
+			result[field] = min(result[field], value)
+		elif function == 'max':
+			result[field] = max(result[field], value)
+		else:
+			raise Exception("Aggregationsfunktion für '%s' ist nicht implementiert. (Benutze: sum, min, max)" % function)
+		
+	def __mergeAggregates(self, result, other):
+		if other is None:
+			return result
+		if result is None:
+			return dict(other)
+		result['flow_count'] += other['flow_count']
+		for field,function in IPFIXConversation.DEFAULT_AGGS.items():
+			if field not in other:
+				continue
+			self.__aggregateValue(result, field, function, other[field])
 		return result
 		
 	def __bucketPostprocessing(self):
@@ -161,13 +223,30 @@ class IPFIXConversation():
 '''
 
 class OpenSocketAggregator():
+	'''
+	@param max_entries: Maximum number of open conversations (0: unlimited)
+	@param max_bytes: Maximum (estimated) memory of open conversations (0: unlimited)
+		If a limit is exceeded, the least recently used conversations are 
+		flushed early, flagged with 'partial': True.
+	@param track_changes: Remember changed and removed sockets (see takeChanges)
+	'''
 	# Jeder Exporter könnte eine eigene Instanz bekommen, für den Fall, dass zufällig irgendwelche Socket-Kollisionen entstehen (sehr sehr unwahrscheinlich)
 	#WriteLock = threading.Lock() 
+	EVICTION_BATCH = 1000 # Partial conversations to collect before they should be fetched
 	
-	def __init__(self, ttl_response_received=60, ttl_no_response=600): # TTL in Sekunden
+	def __init__(self, ttl_response_received=60, ttl_no_response=600, max_entries=0, max_bytes=0, track_changes=False): # TTL in Sekunden
 		self.ttl_response_received = ttl_response_received
 		self.ttl_no_response = ttl_no_response
-		self.raw_flow_cache = dict()
+		self.raw_flow_cache = OrderedDict() # least recently used first
+		self.expiry = TimerWheel() # socket -> time of expiry (only due entries are visited)
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.size = 0 # Bytes (estimated)
+		self.evicted = [] # Partial conversations, returned by getItemsOutOfTTL
+		self.evicted_entries = 0
+		self.evicted_bytes = 0
+		self.changed = set() if track_changes else None
+		self.removed = set() if track_changes else None
 		# ttl_no_response ttl_response_received
 		# first n flows in learning mode? no decisions?
 		# multiple intiator-flows? (paritionized)
@@ -176,47 +255,148 @@ class OpenSocketAggregator():
 		
 	def cache_size(self):
 		return len(self.raw_flow_cache)
+		
+	def getState(self, socket):
+		entry = self.raw_flow_cache[socket]
+		return (entry['timestamp'], entry['conversation'].getState())
+		
+	def getStates(self):
+		return { socket: self.getState(socket) for socket in self.raw_flow_cache }
+		
+	def takeChanges(self):
+		'''
+		@return (dict socket -> state, removed sockets) since the last call
+		'''
+		upserts = { socket: self.getState(socket) for socket in self.changed }
+		removed = self.removed
+		self.changed = set()
+		self.removed = set()
+		return upserts, removed
+		
+	def restore(self, states):
+		'''
+		Restores open conversations (e.g. of a checkpoint or handed over by 
+		another worker). Their TTL still counts from their first flow. If a 
+		conversation is open already, both are merged (the older reference 
+		flow is kept).
+		'''
+		for socket, (timestamp, state) in states.items():
+			conversation = IPFIXConversation.fromState(state)
+			if socket in self.raw_flow_cache:
+				entry = self.raw_flow_cache.pop(socket)
+				self.size -= entry['size']
+				if timestamp < entry['timestamp']:
+					conversation.merge(entry['conversation'])
+				else:
+					entry['conversation'].merge(conversation)
+					conversation = entry['conversation']
+				timestamp = min(timestamp, entry['timestamp'])
+			entry = {
+				'conversation': conversation,
+				'timestamp': timestamp,
+				'size': conversation.getSize() + sys.getsizeof(socket)
+			}
+			self.raw_flow_cache[socket] = entry
+			self.size += entry['size']
+			self.expiry.schedule(socket, timestamp + (self.ttl_response_received if conversation.hasResponse() else self.ttl_no_response))
+			if self.changed is not None:
+				self.changed.add(socket)
+				self.removed.discard(socket)
+		self.__evict()
+		
+	def takeStates(self, select):
+		'''
+		Removes open conversations (e.g. to hand them over to another worker).
+		
+		@param select: function socket -> bool
+		@return dict socket -> state (see restore)
+		'''
+		states = dict()
+		for socket in [socket for socket in self.raw_flow_cache if select(socket)]:
+			states[socket] = self.getState(socket)
+			entry = self.raw_flow_cache.pop(socket)
+			self.expiry.cancel(socket)
+			self.size -= entry['size']
+			self.__forget(socket)
+		return states
+		
+	def getStatistics(self):
+		return {
+			'entries': len(self.raw_flow_cache),
+			'bytes': self.size,
+			'evicted_entries': self.evicted_entries,
+			'evicted_bytes': self.evicted_bytes
+		}
 	
 	def process(self, data):
+		if isinstance(data, FlowBatch): # flow by flow (views, no dicts)
+			for flow in data:
+				self.process(flow)
+			return
 		# Nachteil: Keine saubere Socket2Socket Zuordnung (andernfalls ineffiziente Aggregation) - sich ständig ändernde High Ports sind in der Aussagekraft zu vernachlässigen
 		#OpenSocketAggregator.WriteLock.acquire() 
 		if 'sourceIPv4Address' in data and 'destinationIPv4Address' in data:
 			socket = data['socketIdentifier']
 			if socket not in self.raw_flow_cache: # Conversation-Initiator
-				self.raw_flow_cache[socket] = {
-					'bucket': [ data ],
-					'timestamp': time.time() # zum aussortieren aus dem cache
+				now = time.time()
+				conversation = IPFIXConversation(data)
+				entry = {
+					'conversation': conversation,
+					'timestamp': now, # zum aussortieren aus dem cache
+					'size': conversation.getSize() + sys.getsizeof(socket)
 				}
+				self.raw_flow_cache[socket] = entry
+				self.size += entry['size']
+				self.expiry.schedule(socket, now + self.ttl_no_response)
+				if self.changed is not None:
+					self.changed.add(socket)
+					self.removed.discard(socket) # expired and reopened within one checkpoint
+				self.__evict()
 			else: # Conversation-Partner
-				self.raw_flow_cache[socket]['bucket'].append(data)
+				entry = self.raw_flow_cache[socket]
+				self.raw_flow_cache.move_to_end(socket)
+				conversation = entry['conversation']
+				had_response = conversation.hasResponse()
+				conversation.add(data)
+				if not had_response and conversation.hasResponse(): # first response: shorter TTL
+					self.expiry.schedule(socket, entry['timestamp'] + self.ttl_response_received)
+				if self.changed is not None:
+					self.changed.add(socket)
 		else:
 			if self.__l3_error_occured_once:
 				print ('INFO@OpenSocketAggregator: Ignoring flow, because not Layer 3 (IP).') # To be done: Create L2-Aggregator (MAC)
 				self.__l3_error_occured_once = True
 		#OpenSocketAggregator.WriteLock.release() 
 	
-	def __getTTLPerBucket(self, bucket):
-		if 'flow_request' in bucket and 'flow_response' in bucket:
-			return self.ttl_response_received
-		return self.ttl_no_response
-	
 	def getItemsOutOfTTL(self):
-		cache_outofdate = dict()
-		cache_new = dict()
+		'''
+		Conversations are expired ttl_response_received after their first flow,
+		if a response was seen, otherwise ttl_no_response.
+		'''
 		conversations = []
-		#OpenSocketAggregator.WriteLock.acquire()
-		for k,v in self.raw_flow_cache.items():
-			if v['timestamp'] <= (time.time() - min(self.ttl_response_received, self.ttl_no_response)): # TTL vorfiltern
-				conv = IPFIXConversation(v['bucket']).getConversation()
-				if v['timestamp'] <= (time.time() - self.__getTTLPerBucket(conv)):
-					cache_outofdate[k] = v
-					conversations.append(conv)
-				else:
-					cache_new[k] = v
-			else:
-				cache_new[k] = v
-		self.raw_flow_cache = cache_new # Update Cache
-		#OpenSocketAggregator.WriteLock.release() 
-		#print("outofdate", len(cache_outofdate))
-		#print("in cache ", len(cache_new))
-		return conversations
\ No newline at end of file
+		for socket in self.expiry.expire():
+			entry = self.raw_flow_cache.pop(socket)
+			self.size -= entry['size']
+			self.__forget(socket)
+			conversations.append(entry['conversation'].getConversation())
+		if self.evicted:
+			conversations.extend(self.evicted)
+			self.evicted = []
+		return conversations
+		
+	def __evict(self):
+		while self.raw_flow_cache and ((self.max_entries and len(self.raw_flow_cache) > self.max_entries) or (self.max_bytes and self.size > self.max_bytes)):
+			socket, entry = self.raw_flow_cache.popitem(last=False)
+			self.expiry.cancel(socket)
+			self.size -= entry['size']
+			self.__forget(socket)
+			self.evicted_entries += 1
+			self.evicted_bytes += entry['size']
+			conversation = entry['conversation'].getConversation()
+			conversation['partial'] = True # flushed before its TTL: more flows may follow
+			self.evicted.append(conversation)
+			
+	def __forget(self, socket):
+		if self.changed is not None:
+			self.changed.discard(socket)
+			self.removed.add(socket)
@@ -0,0 +1,311 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+from array import array
+from collections.abc import Mapping
+import ipaddress
+
+class FlowBatch():
+	'''
+	Flows column by column instead of one dict per flow. Numeric information 
+	elements are stored in arrays, everything else in lists. Fields which are 
+	equal for all flows (e.g. the IPFIX header) are stored only once (header).
+	A flow without a value in a column (e.g. other template) is marked in the 
+	validity mask of the column (bytearray, 1: present). Columns without gaps 
+	have no mask.
+	
+	Behaves like a sequence of flows: iterating yields read-only FlowViews, 
+	getFlows() real dicts.
+	'''
+	INT = 'Q'		# unsigned integers (array)
+	FLOAT = 'd'		# floats (array)
+	IPV4 = 'I'		# IPv4 addresses as integers (array), ipaddress.IPv4Address when read
+	OBJECT = None	# anything else (list)
+
+	def __init__(self, header=None):
+		self.header = dict(header) if header else dict()
+		self.length = 0
+		self.columns = dict()
+		self.kinds = dict()
+		self.valid = dict()
+
+	@classmethod
+	def fromFlows(cls, flows, header=None):
+		batch = cls(header)
+		batch.appendFlows(flows)
+		return batch
+
+	def __len__(self):
+		return self.length
+
+	def __iter__(self):
+		for i in range(self.length):
+			yield FlowView(self, i)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return self.select(range(*index.indices(self.length)))
+		if index < 0:
+			index += self.length
+		if not 0 <= index < self.length:
+			raise IndexError('FlowBatch index out of range')
+		return FlowView(self, index)
+
+	def has(self, name):
+		return name in self.columns or name in self.header
+
+	def isComplete(self, name):
+		'''
+		@return True, if every flow has a value for name
+		'''
+		return name in self.header or (name in self.columns and name not in self.valid)
+
+	def getColumn(self, name):
+		'''
+		@return raw values (addresses as integers, placeholders where not valid)
+		'''
+		return self.columns[name]
+
+	def getValid(self, name):
+		'''
+		@return validity mask or None (all valid)
+		'''
+		return self.valid.get(name)
+
+	def isValid(self, name, index):
+		if name in self.columns:
+			mask = self.valid.get(name)
+			if mask is None or mask[index]:
+				return True
+		return name in self.header
+
+	def getValue(self, name, index):
+		'''
+		@raise KeyError if the flow has no value for name
+		'''
+		if name in self.columns:
+			mask = self.valid.get(name)
+			if mask is None or mask[index]:
+				return self.__decode(name, self.columns[name][index])
+		if name in self.header: # flow values overrule the header
+			return self.header[name]
+		raise KeyError(name)
+
+	def getValues(self, name, decode=True):
+		'''
+		@param decode: False: IPv4 addresses remain integers
+		@return list of values (value of the header or None where not valid)
+		'''
+		if name in self.columns:
+			column = self.columns[name]
+			if decode and self.kinds[name] == FlowBatch.IPV4:
+				column = [ipaddress.IPv4Address(v) for v in column]
+			mask = self.valid.get(name)
+			if mask is None:
+				return list(column)
+			default = self.header.get(name)
+			return [v if m else default for v, m in zip(column, mask)]
+		return [self.header.get(name)] * self.length
+
+	def getNames(self, index=None):
+		'''
+		@return names of the information elements (of the flow at index)
+		'''
+		names = dict.fromkeys(self.header)
+		for name in self.columns:
+			if index is None or name not in self.valid or self.valid[name][index]:
+				names[name] = None
+		return list(names)
+
+	def setColumn(self, name, values, kind=OBJECT, valid=None):
+		'''
+		Adds or replaces a column (one value per flow).
+		@param valid: validity mask (None: all valid)
+		'''
+		if len(values) != self.length:
+			raise ValueError('Column %s has %i values, batch %i flows.' % (name, len(values), self.length))
+		self.columns[name] = list(values) if kind is FlowBatch.OBJECT else array(kind, values)
+		self.kinds[name] = kind
+		if valid is None or all(valid):
+			self.valid.pop(name, None)
+		else:
+			self.valid[name] = bytearray(valid)
+
+	def mapColumn(self, source, target, function, kind=OBJECT):
+		'''
+		target = function(source) for every flow with a value in source.
+		'''
+		if source not in self.columns:
+			if source in self.header: # same for all flows
+				self.header[target] = function(self.header[source])
+			return
+		values = self.getValues(source)
+		mask = None if source in self.header else self.valid.get(source)
+		if mask is None:
+			self.setColumn(target, [function(v) for v in values], kind)
+		else:
+			default = None if kind is FlowBatch.OBJECT else 0
+			self.setColumn(target, [function(v) if m else default for v, m in zip(values, mask)], kind, mask)
+
+	def append(self, columns, count, kinds=None):
+		'''
+		Appends count flows given as columns (name -> sequence of count values).
+		@param kinds: kind per name (default: guessed from the values)
+		'''
+		kinds = kinds or dict()
+		for name in list(self.columns.keys()):
+			if name not in columns: # flows without this element
+				self.__extend(name, [self.__placeholder(name)] * count, bytes(count))
+		for name, values in columns.items():
+			if name not in self.columns:
+				kind = kinds[name] if name in kinds else self.__guessKind(values)
+				self.columns[name] = list() if kind is FlowBatch.OBJECT else array(kind)
+				self.kinds[name] = kind
+				if self.length:
+					self.__extend(name, [self.__placeholder(name)] * self.length, bytes(self.length))
+			self.__extend(name, values)
+		self.length += count
+
+	def appendFlows(self, flows):
+		'''
+		Appends flows given as dicts.
+		'''
+		names = dict()
+		for flow in flows:
+			for name in flow:
+				names[name] = None
+		columns = dict()
+		kinds = dict()
+		valid = dict()
+		for name in names:
+			column = [flow.get(name) for flow in flows]
+			mask = bytes([1 if name in flow else 0 for flow in flows])
+			kind = self.kinds[name] if name in self.kinds else self.__guessKind([v for v, m in zip(column, mask) if m])
+			if kind == FlowBatch.IPV4:
+				column = [int(v) if isinstance(v, ipaddress.IPv4Address) else v for v in column]
+			if kind is not FlowBatch.OBJECT:
+				column = [v if m else 0 for v, m in zip(column, mask)]
+			columns[name] = column
+			kinds[name] = kind
+			valid[name] = mask
+		count = len(flows)
+		before = self.length
+		self.append(columns, count, kinds)
+		for name, mask in valid.items(): # gaps within the appended flows
+			if not all(mask):
+				self.__setMask(name, before, mask)
+
+	def select(self, indices):
+		'''
+		@return new FlowBatch with the given flows (e.g. to route them to different queues)
+		'''
+		indices = list(indices)
+		batch = FlowBatch(self.header)
+		batch.length = len(indices)
+		for name, column in self.columns.items():
+			values = [column[i] for i in indices]
+			batch.columns[name] = list(values) if self.kinds[name] is FlowBatch.OBJECT else array(self.kinds[name], values)
+			batch.kinds[name] = self.kinds[name]
+			if name in self.valid:
+				mask = bytearray([self.valid[name][i] for i in indices])
+				if not all(mask):
+					batch.valid[name] = mask
+		return batch
+
+	def getFlow(self, index):
+		return { name: self.getValue(name, index) for name in self.getNames(index) }
+
+	def getFlows(self):
+		return [self.getFlow(i) for i in range(self.length)]
+
+	def __decode(self, name, value):
+		if self.kinds[name] == FlowBatch.IPV4:
+			return ipaddress.IPv4Address(value)
+		return value
+
+	def __placeholder(self, name):
+		return None if self.kinds[name] is FlowBatch.OBJECT else 0
+
+	def __guessKind(self, values):
+		if all(isinstance(v, ipaddress.IPv4Address) for v in values) and values:
+			return FlowBatch.IPV4
+		if all(type(v) is int and 0 <= v < 18446744073709551616 for v in values) and values:
+			return FlowBatch.INT
+		if all(type(v) is float for v in values) and values:
+			return FlowBatch.FLOAT
+		return FlowBatch.OBJECT
+
+	def __extend(self, name, values, mask=None):
+		column = self.columns[name]
+		size = len(column)
+		try:
+			column.extend(values)
+		except (TypeError, OverflowError): # value does not fit into the array: fall back to a list
+			del column[size:]
+			self.columns[name] = [self.__decode(name, v) for v in column] + list(values)
+			self.kinds[name] = FlowBatch.OBJECT
+		if mask is not None:
+			self.__setMask(name, size, mask)
+		elif name in self.valid:
+			self.valid[name].extend(b'\x01' * (len(self.columns[name]) - len(self.valid[name])))
+
+	def __setMask(self, name, start, mask):
+		if name not in self.valid:
+			self.valid[name] = bytearray(b'\x01' * len(self.columns[name]))
+		self.valid[name][start:start + len(mask)] = mask
+
+	def __repr__(self):
+		return '%s %s' % (type(self).__name__, self.getFlows())
+
+class FlowView(Mapping):
+	'''
+	Read-only view of one flow of a FlowBatch (no dict is allocated).
+	'''
+	__slots__ = ('batch', 'index')
+
+	def __init__(self, batch, index):
+		self.batch = batch
+		self.index = index
+
+	def __getitem__(self, name):
+		return self.batch.getValue(name, self.index)
+
+	def __contains__(self, name):
+		return self.batch.isValid(name, self.index)
+
+	def __iter__(self):
+		return iter(self.batch.getNames(self.index))
+
+	def __len__(self):
+		return len(self.batch.getNames(self.index))
+
+	def __repr__(self):
+		return repr(self.batch.getFlow(self.index))
@@ -33,6 +33,7 @@ import ipaddress, struct
 from ipfix.information_elements import information_elements
 from ipfix.errors import NoTemplateException, InvalidProtocolException, ProtocolException
 from base.interpreter import ByteInterpreter
+from ipfix.flowbatch import FlowBatch
 
 class IPFIXProtocol():
 	def __repr__(self):
@@ -42,7 +43,7 @@ class Header(IPFIXProtocol):
 	FORMAT = '!HHIII'
 	
 	def __init__(self, data):
-		rawnd = struct.unpack(Header.FORMAT, data[:self.getLength()])
+		rawnd = struct.unpack_from(Header.FORMAT, data)
 		self.version, self.length, self.timestamp, self.sequence, self.domain_id = rawnd
 		if self.version != 10:
 			raise InvalidProtocolException()
@@ -54,7 +55,7 @@ class SetHeader(IPFIXProtocol):
 	FORMAT = '!HH'
 	
 	def __init__(self, data, offset=16):
-		rawnd = struct.unpack(SetHeader.FORMAT, data[offset:offset + self.getLength()])
+		rawnd = struct.unpack_from(SetHeader.FORMAT, data, offset)
 		self.set_id, self.set_length = rawnd
 		
 	def getLength(self):
@@ -64,7 +65,7 @@ class TemplateHeader(IPFIXProtocol):
 	FORMAT = '!HH'
 	
 	def __init__(self, data, offset=20):
-		rawnd = struct.unpack(TemplateHeader.FORMAT, data[offset:offset + self.getLength()])
+		rawnd = struct.unpack_from(TemplateHeader.FORMAT, data, offset)
 		self.template_id, self.field_count = rawnd
 		
 	def getLength(self):
@@ -74,7 +75,7 @@ class Template(IPFIXProtocol):
 	def __init__(self, data, field_count, offset=24):
 		self.fields = [] # List of Fields
 		self.__format = '!' + ('HH' * field_count)
-		rawnd = struct.unpack(self.__format, data[offset:offset + self.getLength()])
+		rawnd = struct.unpack_from(self.__format, data, offset)
 		for ie_id, length in zip(rawnd[0::2], rawnd[1::2]):
 			field = dict()
 			field['id'] = ie_id 
@@ -92,15 +93,28 @@ class Flow(IPFIXProtocol):
 		bi = ByteInterpreter(data)
 		
 		for field in template.fields:
-			value = bi.getValue(offset, field['length'])
-			self.__length += field['length']
+			length = field['length']
+			if length == TemplateDecoder.VARIABLE_LENGTH: # RFC 7011, 7.: length in 1 byte (< 255) or 255 and 2 bytes
+				length = bi.getValue(offset, 1)
+				prefix = 1
+				if length == 255:
+					length = bi.getValue(offset + 1, 2)
+					prefix = 3
+				if offset + prefix + length > len(data):
+					raise ProtocolException('Offset is greater than length of Data.')
+				setattr(self, field['caption'], bytes(data[offset + prefix:offset + prefix + length]).decode('utf-8', 'replace')) # mostly strings (e.g. interfaceName)
+				self.__length += prefix + length
+				offset += prefix + length
+				continue
+			value = bi.getValue(offset, length)
+			self.__length += length
 			if field['caption'].endswith('IPv4Address'):
 				setattr(self, field['caption'], ipaddress.ip_address(value))
 			elif field['caption'].endswith('MacAddress'):
 				setattr(self, field['caption'], str(MacAddress(value)))
 			else:
 				setattr(self, field['caption'], value)
-			offset = offset + field['length'] # offset aktualisieren
+			offset = offset + length # offset aktualisieren
 			
 			if offset > len(data):
 				raise ProtocolException('Offset is greater than length of Data.')
@@ -108,17 +122,127 @@ class Flow(IPFIXProtocol):
 	def getLength(self):
 		return self.__length
 
+def _bytesToInt(value):
+	return int.from_bytes(value, byteorder='big')
+
+def _bytesToIPAddress(value):
+	return ipaddress.ip_address(int.from_bytes(value, byteorder='big'))
+
+def _bytesToMacAddress(value):
+	return str(MacAddress(int.from_bytes(value, byteorder='big')))
+
+def _intToMacAddress(value):
+	return str(MacAddress(value))
+
+class TemplateDecoder():
+	'''
+	Compiles a Template once into a struct-format. Every data record is
+	then decoded by a single unpack_from call (instead of interpreting
+	field by field like Flow does). Only a few post-processors remain
+	for addresses and fields without a native struct-type (e.g. MAC).
+	Templates with variable length fields (RFC 7011, 7.) can not be
+	compiled. In this case fixed is False and Flow has to be used.
+	'''
+	VARIABLE_LENGTH = 65535
+	FORMATS = { 1: 'B', 2: 'H', 4: 'I', 8: 'Q' }
+
+	def __init__(self, template):
+		self.template = template
+		self.captions = []
+		self.converters = [] # List of (index, function)
+		self.column_converters = [] # Same for decodeColumns
+		self.kinds = dict() # caption -> kind of the FlowBatch column
+		self.fixed = True
+		self.struct = None
+
+		fmt = '!'
+		for index, field in enumerate(template.fields):
+			length = field['length']
+			caption = field['caption']
+			if length == TemplateDecoder.VARIABLE_LENGTH or length == 0:
+				self.fixed = False
+				return
+			self.captions.append(caption)
+			if length in TemplateDecoder.FORMATS:
+				fmt += TemplateDecoder.FORMATS[length]
+				if caption.endswith('IPv4Address'):
+					self.converters.append((index, ipaddress.IPv4Address if length == 4 else ipaddress.ip_address))
+				elif caption.endswith('MacAddress'):
+					self.converters.append((index, _intToMacAddress))
+			else: # e.g. 3 Bytes, MAC (6 Bytes), IPv6 (16 Bytes)
+				fmt += '%is' % length
+				if caption.endswith('IPv4Address'):
+					self.converters.append((index, _bytesToIPAddress))
+				elif caption.endswith('MacAddress'):
+					self.converters.append((index, _bytesToMacAddress))
+				else:
+					self.converters.append((index, _bytesToInt))
+			# decodeColumns keeps IPv4 addresses as integers
+			if caption.endswith('IPv4Address') and length == 4:
+				self.kinds[caption] = FlowBatch.IPV4
+			elif caption.endswith('IPv4Address') or caption.endswith('MacAddress') or length > 8:
+				self.kinds[caption] = FlowBatch.OBJECT
+			else:
+				self.kinds[caption] = FlowBatch.INT
+			if self.converters and self.converters[-1][0] == index and self.kinds[caption] != FlowBatch.IPV4:
+				self.column_converters.append(self.converters[-1])
+		self.struct = struct.Struct(fmt)
+
+	def getLength(self):
+		return self.struct.size
+
+	def decode(self, data, offset):
+		if offset + self.struct.size > len(data):
+			raise ProtocolException('Offset is greater than length of Data.')
+		return self.__toDict(self.struct.unpack_from(data, offset))
+
+	def decodeSet(self, data, offset, length):
+		'''
+		Decodes all records of a data set at once. Remaining bytes
+		(shorter than one record) are padding.
+		'''
+		size = self.struct.size
+		count = length // size
+		if offset + (count * size) > len(data):
+			raise ProtocolException('Offset is greater than length of Data.')
+		records = memoryview(data)[offset:offset + (count * size)]
+		return [self.__toDict(values) for values in self.struct.iter_unpack(records)]
+
+	def decodeColumns(self, data, offset, length):
+		'''
+		Like decodeSet, but column by column (see FlowBatch).
+		@return (dict caption -> values, count)
+		'''
+		size = self.struct.size
+		count = length // size
+		if offset + (count * size) > len(data):
+			raise ProtocolException('Offset is greater than length of Data.')
+		if count == 0:
+			return dict(), 0
+		columns = list(zip(*self.struct.iter_unpack(memoryview(data)[offset:offset + (count * size)])))
+		for index, function in self.column_converters:
+			columns[index] = [function(v) for v in columns[index]]
+		return dict(zip(self.captions, columns)), count
+
+	def __toDict(self, values):
+		if self.converters:
+			values = list(values)
+			for index, function in self.converters:
+				values[index] = function(values[index])
+		return dict(zip(self.captions, values))
+
 # Cache IPFIX-Templates by Exporter and it's Template-ID
 class StatefulTemplateManager():
 	def __init__(self):
 		self.data = dict()
-		
+
+	# exporter_ip: (Exporter-IP, Observation Domain ID) - Template-IDs are only unique per domain
 	def process(self, template_id, exporter_ip, template):
 		if exporter_ip not in self.data:
 			self.data[exporter_ip] = dict()
 		if template_id not in self.data[exporter_ip]:
-			self.data[exporter_ip][template_id] = template
-			
+			self.data[exporter_ip][template_id] = TemplateDecoder(template) # compile once
+
 	def get(self, template_id, exporter_ip):
 		try:
 			return self.data[exporter_ip][template_id]
@@ -126,47 +250,95 @@ class StatefulTemplateManager():
 			return None
 		
 
+def getObservationDomain(data):
+	return struct.unpack_from('!I', data, 12)[0]
+
+def hasTemplateSet(data):
+	'''
+	Walks the set headers of a message without decoding it.
+	'''
+	offset = 16
+	length = len(data)
+	while offset + 4 <= length:
+		set_id, set_length = struct.unpack_from(SetHeader.FORMAT, data, offset)
+		if set_id == 2 or set_id == 3: # (Options) Template Set
+			return True
+		if set_length < 4:
+			return False
+		offset += set_length
+	return False
+
 stm = StatefulTemplateManager()
 class IPFIXReader():
-	def __init__(self, request, exporter):
+	'''
+	@param templates_only: Only learn the templates of the message (skip data sets)
+	@param columnar: Decode the flows into a FlowBatch (see getFlowBatch) instead of dicts
+	'''
+	def __init__(self, request, exporter, templates_only=False, columnar=False):
 		self.header = Header(request)
 		offset = self.header.getLength()
 		self.flowdata = []
 		self.exporter = exporter
+		self.batch = FlowBatch(self.__getHeaderDict()) if columnar else None
+		domain = (exporter, self.header.domain_id)
 		
 		while offset < self.header.length:
 			s = SetHeader(request, offset)
 			
 			if s.set_id == 2: # Data Template
 				th = TemplateHeader(request, offset + s.getLength())
-				stm.process(th.template_id, exporter, Template(request, th.field_count, offset + th.getLength() + s.getLength()))
+				stm.process(th.template_id, domain, Template(request, th.field_count, offset + th.getLength() + s.getLength()))
+			elif templates_only:
+				pass
 			else: # Data
-				template = stm.get(s.set_id, exporter)
-				if template:
-					default_msg_length = 1 # Length of first Message unknown yet (reason for workaround: msg-end could be padding)
-					while (offset + default_msg_length) < self.header.length:
-						flow = Flow(request, template, offset + s.getLength())
-						flow.exporter = self.exporter
-						self.flowdata.append(flow)
-						default_msg_length = flow.getLength()
-						offset = offset + flow.getLength()
-					#print(" -- FLOW DATA RECEIVED -- ", self.header, offset + s.getLength())
-				else: 
+				decoder = stm.get(s.set_id, domain)
+				if decoder:
+					if decoder.fixed and columnar:
+						columns, count = decoder.decodeColumns(request, offset + s.getLength(), s.set_length - s.getLength())
+						self.batch.append(columns, count, decoder.kinds)
+					elif decoder.fixed:
+						self.flowdata.extend(decoder.decodeSet(request, offset + s.getLength(), s.set_length - s.getLength()))
+					else:
+						self.__readVariableLengthSet(request, decoder.template, offset + s.getLength(), offset + s.set_length)
+						if columnar:
+							self.batch.appendFlows(self.flowdata)
+							self.flowdata = []
+				else:
 					raise NoTemplateException()
 			offset = offset + s.set_length
-	
+
+	def __readVariableLengthSet(self, request, template, offset, set_end):
+		# Padding is shorter than the shortest record (variable length fields: at least their length byte)
+		min_length = sum(1 if f['length'] == TemplateDecoder.VARIABLE_LENGTH else f['length'] for f in template.fields)
+		while offset + max(min_length, 1) <= set_end:
+			flow = Flow(request, template, offset)
+			self.flowdata.append({k: v for k, v in flow.__dict__.items() if not k.startswith('_')})
+			offset = offset + flow.getLength()
+
 	def getHeader(self):
 		return self.header
-		
+
 	def getFlows(self):
 		return self.flowdata
-		
+
+	def getFlowBatch(self):
+		'''
+		@return FlowBatch, header and exporter are stored once (only with columnar=True)
+		'''
+		return self.batch
+
+	def __getHeaderDict(self):
+		header = {k: v for k, v in self.header.__dict__.items() if not k.startswith('_')}
+		header['exporter'] = self.exporter
+		return header
+
 	def getFlowsWithHeader(self):
 		result = []
+		header = self.__getHeaderDict()
 		for flow in self.getFlows():
-			newdict = self.header.__dict__.copy()
-			newdict.update(flow.__dict__)
-			result.append({k: v for k, v in newdict.items() if not k.startswith('_')})
+			newdict = header.copy()
+			newdict.update(flow)
+			result.append(newdict)
 		return result
 
 
@@ -0,0 +1,85 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Conversations are identified by a packed 5-tuple instead of a string: 
+(ip_a, port_a, ip_b, port_b, protocol), canonically ordered, so that 
+request and response get the same key. Ports are replaced by the class 
+of their service name (see iana.tables.serviceNum2Name), because all 
+high ports of a host belong to one conversation. The readable 
+socketIdentifier ("ip:service-ip:service") is rendered only when the 
+conversation is written out.
+'''
+
+import ipaddress, struct
+from array import array
+from iana.tables import serviceNum2Name, getServiceNames
+
+KEY = struct.Struct('!IHIHB')
+
+NO_PORT = 0 # Flow without transport ports (e.g. ICMP)
+PORT_CLASS_NAMES = [None, 'Unknown Service', 'High-Port'] + sorted(getServiceNames() - set(['Unknown Service', 'High-Port']))
+_class_by_name = { name: i for i, name in enumerate(PORT_CLASS_NAMES) }
+PORT_CLASSES = array('H', [_class_by_name[serviceNum2Name(port)] for port in range(65536)])
+
+def getPortClass(port):
+	if port is None:
+		return NO_PORT
+	if 0 <= port < 65536:
+		return PORT_CLASSES[port]
+	return _class_by_name[serviceNum2Name(port)]
+
+def getSocketKey(source, destination, source_port, destination_port, protocol):
+	'''
+	@param source, destination: IPv4 addresses as integers
+	@param source_port, destination_port: Transport ports or None
+	@param protocol: protocolIdentifier or None
+	@return bytes (13), equal for both directions
+	'''
+	a = (source, getPortClass(source_port))
+	b = (destination, getPortClass(destination_port))
+	if b < a:
+		a, b = b, a
+	return KEY.pack(a[0], a[1], b[0], b[1], protocol or 0)
+
+def socketKeyToString(key):
+	'''
+	@return socketIdentifier as it was built from the flow dicts: 
+		"ip:service-ip:service" (lower string first)
+	'''
+	ip_a, class_a, ip_b, class_b, protocol = KEY.unpack(key)
+	sockets = sorted([_socketToString(ip_a, class_a), _socketToString(ip_b, class_b)])
+	return "%s-%s" % tuple(sockets)
+
+def _socketToString(ip, port_class):
+	if port_class == NO_PORT:
+		return str(ipaddress.IPv4Address(ip))
+	return '%s:%s' % (ipaddress.IPv4Address(ip), PORT_CLASS_NAMES[port_class])
@@ -0,0 +1,236 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, struct, time, pickle
+from base.applog import *
+
+class SpillLog():
+	'''
+	Append-only log on disk for elements which do not fit into the queues 
+	(overload), replayed in order of arrival when the queues are drained.
+	
+	The log consists of segments (TIME-PID-SEQUENCE.open while written, renamed 
+	to TIME-PID-SEQUENCE.spill when complete): several writer processes (receivers) 
+	write their own segments, one reader (BackgroundWorker) consumes them. 
+	Records: !IBH (length, kind, shard) + payload. Datagram batches are 
+	written as they are (RAW), everything else is pickled.
+	
+	Writes are fsynced at most every sync_seconds (and when a segment is 
+	completed). A segment is completed when it exceeds segment_size or no 
+	element was appended for idle_seconds. The reader remembers its 
+	position (cursor file) and removes segments once they are consumed.
+	An open segment counts as complete if its writer is gone: the process 
+	does not exist, or it started after the segment was created (PID reused, 
+	e.g. after a restart or reboot).
+	'''
+	RECORD = struct.Struct('!IBH')
+	RAW, PICKLE = range(2)
+	OPEN = '.open'
+	COMPLETE = '.spill'
+	CURSOR = 'cursor'
+	
+	def __init__(self, directory, segment_size=67108864, sync_seconds=1, idle_seconds=2):
+		self.directory = directory
+		self.segment_size = segment_size
+		self.sync_seconds = sync_seconds
+		self.idle_seconds = idle_seconds
+		# Writer
+		self.pid = None
+		self.file = None
+		self.name = None
+		self.sequence = 0
+		self.size = 0
+		self.last_sync = 0
+		self.last_append = 0
+		# Reader
+		self.reading = None # (name, file)
+		self.offset = 0
+		self.size_read = None # size of the segment when its end was reached
+		
+	def append(self, element, shard=0):
+		'''
+		@param element: bytes (datagram batch) or any picklable element
+		@param shard: e.g. decoder the batch was meant for
+		'''
+		if isinstance(element, (bytes, bytearray)):
+			kind, payload = SpillLog.RAW, element
+		else:
+			kind, payload = SpillLog.PICKLE, pickle.dumps(element, pickle.HIGHEST_PROTOCOL)
+		if self.pid != os.getpid(): # e.g. receiver process (forked): own segments
+			self.pid = os.getpid()
+			self.file = None
+		if self.file is None:
+			self.__open()
+		self.file.write(SpillLog.RECORD.pack(len(payload), kind, shard))
+		self.file.write(payload)
+		self.size += SpillLog.RECORD.size + len(payload)
+		self.last_append = time.time()
+		if self.size >= self.segment_size:
+			self.__complete()
+		elif self.last_append - self.last_sync >= self.sync_seconds:
+			self.__sync()
+			
+	def poll(self):
+		'''
+		Completes the segment of this writer, if nothing was appended for idle_seconds.
+		'''
+		if self.file is not None and self.pid == os.getpid() and self.last_append + self.idle_seconds < time.time():
+			self.__complete()
+			
+	def close(self):
+		if self.file is not None and self.pid == os.getpid():
+			self.__complete()
+		if self.reading is not None:
+			self.reading[1].close()
+			self.reading = None
+			
+	def __open(self):
+		os.makedirs(self.directory, exist_ok=True)
+		self.sequence += 1 # several segments within one millisecond
+		self.name = '%013i-%i-%06i' % (int(time.time() * 1000), self.pid, self.sequence)
+		self.file = open(os.path.join(self.directory, self.name + SpillLog.OPEN), 'ab')
+		self.size = 0
+		self.last_sync = time.time()
+		
+	def __sync(self):
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.last_sync = time.time()
+		
+	def __complete(self):
+		self.__sync()
+		self.file.close()
+		os.replace(os.path.join(self.directory, self.name + SpillLog.OPEN), os.path.join(self.directory, self.name + SpillLog.COMPLETE))
+		self.file = None
+		
+	def read(self, count):
+		'''
+		@return up to count elements as (element, shard), oldest first
+		'''
+		elements = []
+		while len(elements) < count:
+			if self.reading is None and not self.__next():
+				break
+			name, f = self.reading
+			header = f.read(SpillLog.RECORD.size)
+			if len(header) == SpillLog.RECORD.size:
+				length, kind, shard = SpillLog.RECORD.unpack(header)
+				payload = f.read(length)
+				if len(payload) == length:
+					self.offset += SpillLog.RECORD.size + length
+					elements.append((payload if kind == SpillLog.RAW else pickle.loads(payload), shard))
+					continue
+			f.seek(self.offset) # incomplete record (still written?)
+			if not self.__isComplete(name):
+				break
+			size = os.fstat(f.fileno()).st_size
+			if size != self.size_read: # appended before it was completed: once more
+				self.size_read = size
+				continue
+			if size > self.offset: # writer died within a record
+				log.warning("Spill log: %i bytes of an incomplete record at the end of %s dropped." % (size - self.offset, name))
+			f.close() # consumed
+			os.remove(self.__getPath(name))
+			self.reading = None
+			self.offset = 0
+		return elements
+		
+	def commit(self):
+		'''
+		Remembers the position of the reader (elements read are not replayed after a restart).
+		'''
+		if self.reading is None:
+			return
+		path = os.path.join(self.directory, SpillLog.CURSOR)
+		with open(path + '.tmp', 'w') as f:
+			f.write('%s %i' % (self.reading[0], self.offset))
+		os.replace(path + '.tmp', path)
+		
+	def __next(self):
+		'''
+		Opens the oldest segment (at the position of the cursor, if it is this one).
+		'''
+		try:
+			names = sorted(set(os.path.splitext(n)[0] for n in os.listdir(self.directory) if n.endswith((SpillLog.OPEN, SpillLog.COMPLETE))))
+		except FileNotFoundError:
+			return False
+		for name in names:
+			try:
+				f = open(self.__getPath(name), 'rb')
+			except FileNotFoundError: # renamed meanwhile
+				try:
+					f = open(self.__getPath(name), 'rb')
+				except FileNotFoundError:
+					continue
+			self.reading = (name, f)
+			self.offset = self.__getCursor(name)
+			self.size_read = None
+			f.seek(self.offset)
+			return True
+		return False
+		
+	def __getCursor(self, name):
+		try:
+			with open(os.path.join(self.directory, SpillLog.CURSOR)) as f:
+				cursor_name, offset = f.read().split()
+			return int(offset) if cursor_name == name else 0
+		except (OSError, ValueError):
+			return 0
+			
+	def __getPath(self, name):
+		complete = os.path.join(self.directory, name + SpillLog.COMPLETE)
+		return complete if os.path.exists(complete) else os.path.join(self.directory, name + SpillLog.OPEN)
+		
+	def __isComplete(self, name):
+		if os.path.exists(os.path.join(self.directory, name + SpillLog.COMPLETE)):
+			return True
+		created, pid = name.split('-')[:2]
+		try:
+			os.kill(int(pid), 0)
+		except ProcessLookupError: # writer died: segment will not be completed
+			return True
+		except PermissionError:
+			pass
+		started = _getStartTime(int(pid))
+		return started is not None and int(created) / 1000 < started - 1 # another process (clock ticks, boot time in seconds)
+		
+def _getStartTime(pid):
+	'''
+	@return start time of process pid (seconds since the epoch, from /proc) or None
+	'''
+	try:
+		with open('/proc/%i/stat' % pid) as f:
+			ticks = int(f.read().rpartition(')')[2].split()[19]) # starttime (clock ticks since boot)
+		with open('/proc/stat') as f:
+			boot = next(int(line.split()[1]) for line in f if line.startswith('btime '))
+		return boot + ticks / os.sysconf('SC_CLK_TCK')
+	except (OSError, ValueError, IndexError, StopIteration):
+		return None
@@ -0,0 +1,386 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import struct, time, os, pickle, ipaddress, zlib
+from multiprocessing import Array, Lock, Semaphore, shared_memory
+from queue import Empty
+from ipfix.protocol import getObservationDomain
+
+class DatagramBatch():
+	'''
+	Collects datagrams for up to max_packets or max_microseconds and 
+	ships them as one buffer (one pickle, one pipe write and one lock 
+	per batch instead of per datagram).
+	
+	Layout per datagram: !HBB (datagram length, exporter length, flags), 
+	exporter (ascii), datagram
+	'''
+	ENTRY_HEADER = struct.Struct('!HBB')
+	TEMPLATES_ONLY = 1 # Datagram was broadcasted. Only learn its templates.
+	
+	def __init__(self, max_packets=64, max_microseconds=2000):
+		self.max_packets = max_packets
+		self.max_seconds = max_microseconds / 1000000
+		self.buffer = bytearray()
+		self.count = 0
+		self.started = 0
+		
+	def append(self, data, exporter, flags=0):
+		if self.count == 0:
+			self.started = time.time()
+		exporter = exporter.encode('ascii')
+		self.buffer += DatagramBatch.ENTRY_HEADER.pack(len(data), len(exporter), flags)
+		self.buffer += exporter
+		self.buffer += data
+		self.count += 1
+		
+	def isDue(self):
+		if self.count == 0:
+			return False
+		return self.count >= self.max_packets or (time.time() - self.started) >= self.max_seconds
+		
+	def take(self):
+		batch = bytes(self.buffer)
+		del self.buffer[:]
+		self.count = 0
+		return batch
+		
+	def __len__(self):
+		return self.count
+		
+class DecoderRouter():
+	'''
+	Routes datagrams to decoder processes (FlowConsumer) by exporter and
+	observation domain id, so templates of an exporter stay on one decoder.
+	The routing table (shard -> decoder) is kept in shared memory. Shards 
+	of a failed decoder are moved to its peers (which know all templates, 
+	because template sets are broadcasted).
+	'''
+	def __init__(self, decoders=1):
+		self.decoders = decoders
+		self.routes = Array('i', range(decoders), lock=False)
+		
+	def getDecoder(self, data, exporter):
+		try:
+			domain = getObservationDomain(data)
+		except struct.error:
+			domain = 0 # invalid message, any decoder may report it
+		shard = zlib.crc32(('%s/%i' % (exporter, domain)).encode('ascii')) % self.decoders
+		return self.routes[shard]
+		
+	def getDecoders(self):
+		'''
+		@return set of decoders which shards are routed to (alive ones after failover)
+		'''
+		return set(self.routes)
+		
+	def failover(self, alive):
+		'''
+		@param alive: List of booleans (one per decoder)
+		@return List of (shard, new decoder) which were moved
+		'''
+		peers = [i for i, a in enumerate(alive) if a]
+		moved = []
+		if not peers:
+			return moved
+		for shard in range(self.decoders):
+			decoder = shard if alive[shard] else peers[shard % len(peers)]
+			if self.routes[shard] != decoder:
+				self.routes[shard] = decoder
+				moved.append((shard, decoder))
+		return moved
+		
+def _mix64(value):
+	# splitmix64 finalizer
+	value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+	value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+	return value ^ (value >> 31)
+
+class ConversationRouter():
+	'''
+	Routes flows to conversation workers (slots) by rendezvous hashing of 
+	their conversation key (socketIdentifier): each key goes to the active 
+	slot with the highest score. If a slot is added or removed, only the 
+	keys won or lost by that slot move, all others stay where they are.
+	Membership is kept in shared memory, version is incremented on every
+	change (see ConversationConsumer for the handoff of open conversations).
+	
+	@param slots: Maximum number of workers
+	@param active: Number of workers active at start (slots 0..active-1)
+	'''
+	def __init__(self, slots=1, active=1):
+		self.slots = slots
+		self.members = Array('b', [1 if i < active else 0 for i in range(slots)], lock=False)
+		self.version = Array('i', 1, lock=False)
+		self.salts = [_mix64(slot + 1) for slot in range(slots)]
+		self.__known_version = -1
+		self.__active = []
+		
+	def getActive(self):
+		if self.__known_version != self.version[0]:
+			self.__known_version = self.version[0]
+			self.__active = [slot for slot in range(self.slots) if self.members[slot]]
+		return self.__active
+		
+	def getOwner(self, key):
+		'''
+		@param key: conversation key (bytes) or None (not aggregated: any slot)
+		'''
+		active = self.getActive()
+		if len(active) == 1 or key is None:
+			return active[0] if active else 0
+		h = zlib.crc32(key)
+		best = None
+		for slot in active:
+			score = _mix64(h ^ self.salts[slot])
+			if best is None or score > best:
+				best, owner = score, slot
+		return owner
+		
+	def setActive(self, slot, active):
+		self.members[slot] = 1 if active else 0
+		self.version[0] += 1
+		
+def iterBatch(batch):
+	'''
+	@return Generator of (datagram as memoryview, exporter, flags)
+	'''
+	view = memoryview(batch)
+	offset = 0
+	header_size = DatagramBatch.ENTRY_HEADER.size
+	while offset < len(view):
+		length, exporter_length, flags = DatagramBatch.ENTRY_HEADER.unpack_from(view, offset)
+		offset += header_size
+		exporter = str(view[offset:offset + exporter_length], 'ascii')
+		offset += exporter_length
+		yield view[offset:offset + length], exporter, flags
+		offset += length
+
+def countBatch(batch):
+	'''
+	@return Number of datagrams in a DatagramBatch buffer
+	'''
+	count = 0
+	offset = 0
+	header_size = DatagramBatch.ENTRY_HEADER.size
+	while offset < len(batch):
+		length, exporter_length, flags = DatagramBatch.ENTRY_HEADER.unpack_from(batch, offset)
+		offset += header_size + exporter_length + length
+		count += 1
+	return count
+
+class RecordLayout():
+	'''
+	Fixed layout for flow dicts with the same keys and value types. 
+	Numbers are packed with one struct, IPv4Address as 32 bit integer 
+	and strings / bytes as length + (utf-8) bytes behind the struct. 
+	'''
+	FORMATS = { int: 'Q', float: 'd', bool: '?', str: 'H', bytes: 'H', ipaddress.IPv4Address: 'I', type(None): '' }
+
+	def __init__(self, signature):
+		self.signature = signature
+		self.keys = [k for k,t in signature if t is not type(None)]
+		self.none_keys = [k for k,t in signature if t is type(None)]
+		self.strings = [i for i,t in enumerate(t for k,t in signature if t is not type(None)) if t is str]
+		self.binaries = [i for i,t in enumerate(t for k,t in signature if t is not type(None)) if t is bytes]
+		self.addresses = [i for i,t in enumerate(t for k,t in signature if t is not type(None)) if t is ipaddress.IPv4Address]
+		self.struct = struct.Struct('!' + ''.join(RecordLayout.FORMATS[t] for k,t in signature))
+
+	def encode(self, element):
+		values = []
+		strings = []
+		for value in element.values():
+			if type(value) is str:
+				value = value.encode('utf-8')
+				values.append(len(value))
+				strings.append(value)
+			elif type(value) is bytes:
+				values.append(len(value))
+				strings.append(value)
+			elif type(value) is ipaddress.IPv4Address:
+				values.append(int(value))
+			elif value is not None:
+				values.append(value)
+		return self.struct.pack(*values) + b''.join(strings)
+
+	def decode(self, data, offset):
+		values = list(self.struct.unpack_from(data, offset))
+		offset += self.struct.size
+		for i in sorted(self.strings + self.binaries): # in order of the struct
+			length = values[i]
+			values[i] = bytes(data[offset:offset + length])
+			if i in self.strings:
+				values[i] = str(values[i], 'utf-8')
+			offset += length
+		for i in self.addresses:
+			values[i] = ipaddress.IPv4Address(values[i])
+		element = dict(zip(self.keys, values))
+		for k in self.none_keys:
+			element[k] = None
+		return element
+
+class RecordCodec():
+	'''
+	Encodes elements for a SharedMemoryQueue. Flow dicts are written in 
+	a RecordLayout (its definition is sent once per producer in front of 
+	the first record), bytes are written as they are. Everything else 
+	(e.g. lists of conversations) is pickled.
+	'''
+	RAW, PICKLE, LAYOUT, RECORD = range(4)
+	HEADER = struct.Struct('!BIH') # kind, producer (pid), layout id
+
+	def __init__(self):
+		self.layouts = dict()	# Producer: signature -> (layout id, RecordLayout)
+		self.known = dict()		# Consumer: (producer, layout id) -> RecordLayout
+
+	def encode(self, element):
+		'''
+		@return List of payloads (layout definition is prepended if new)
+		'''
+		if isinstance(element, (bytes, bytearray)):
+			return [bytes([RecordCodec.RAW]) + element]
+		if type(element) is dict:
+			signature = tuple(zip(element.keys(), map(type, element.values())))
+			try:
+				payloads = []
+				layout_id, layout = self.layouts.get(signature, (None, None))
+				if layout is None:
+					layout = RecordLayout(signature)
+				record = layout.encode(element)
+				if layout_id is None:
+					layout_id = len(self.layouts)
+					self.layouts[signature] = (layout_id, layout)
+					payloads.append(RecordCodec.HEADER.pack(RecordCodec.LAYOUT, os.getpid(), layout_id) + pickle.dumps(signature))
+				payloads.append(RecordCodec.HEADER.pack(RecordCodec.RECORD, os.getpid(), layout_id) + record)
+				return payloads
+			except (KeyError, struct.error):
+				pass # Unknown type or value out of range
+		return [bytes([RecordCodec.PICKLE]) + pickle.dumps(element, pickle.HIGHEST_PROTOCOL)]
+
+	def decode(self, payload):
+		'''
+		@return (True, element) or (False, None) for layout definitions
+		'''
+		kind = payload[0]
+		if kind == RecordCodec.RAW:
+			return True, bytes(payload[1:])
+		elif kind == RecordCodec.PICKLE:
+			return True, pickle.loads(payload[1:])
+		_, producer, layout_id = RecordCodec.HEADER.unpack_from(payload)
+		if kind == RecordCodec.LAYOUT:
+			self.known[(producer, layout_id)] = RecordLayout(pickle.loads(payload[RecordCodec.HEADER.size:]))
+			return False, None
+		return True, self.known[(producer, layout_id)].decode(payload, RecordCodec.HEADER.size)
+
+class SharedMemoryQueue():
+	'''
+	Ring buffer in multiprocessing.shared_memory with the interface of
+	multiprocessing.Queue (put, get, qsize). It has a single consumer, 
+	writes of several producers are serialized by a lock (uncontended, 
+	if there is only one producer). A semaphore counts the records, so
+	get() blocks like Queue.get().
+
+	Layout: !QQQQ (write position, read position, records written, 
+	records read), followed by the ring. Each record: !I length + payload.
+	'''
+	HEADER = struct.Struct('QQQQ')
+	RECORD = struct.Struct('I')
+	WRAP = 0xFFFFFFFF
+
+	def __init__(self, size=16777216):
+		self.capacity = size
+		self.shm = shared_memory.SharedMemory(create=True, size=SharedMemoryQueue.HEADER.size + size)
+		SharedMemoryQueue.HEADER.pack_into(self.shm.buf, 0, 0, 0, 0, 0)
+		self.items = Semaphore(0)
+		self.lock = Lock()
+		self.codec = RecordCodec()
+
+	def put(self, element):
+		payloads = self.codec.encode(element)
+		with self.lock:
+			for payload in payloads:
+				self.__write(payload)
+		for payload in payloads:
+			self.items.release()
+
+	def get(self, timeout=None):
+		while True:
+			if not self.items.acquire(timeout=timeout):
+				raise Empty
+			complete, element = self.codec.decode(self.__read())
+			if complete:
+				return element
+
+	def qsize(self):
+		_, _, written, read = SharedMemoryQueue.HEADER.unpack_from(self.shm.buf, 0)
+		return written - read
+
+	def close(self):
+		self.shm.close()
+		self.shm.unlink()
+
+	def __write(self, payload):
+		need = SharedMemoryQueue.RECORD.size + len(payload)
+		if need > self.capacity:
+			raise Exception('Element (%i bytes) does not fit into shared memory queue (%i bytes).' % (need, self.capacity))
+		buf = self.shm.buf
+		while True:
+			wpos, rpos, written, _ = SharedMemoryQueue.HEADER.unpack_from(buf, 0)
+			index = wpos % self.capacity
+			contiguous = self.capacity - index
+			skip = contiguous if contiguous < need else 0 # record never wraps around
+			if self.capacity - (wpos - rpos) >= skip + need:
+				break
+			time.sleep(0.001) # Ring full: Backpressure
+		if skip:
+			if contiguous >= SharedMemoryQueue.RECORD.size:
+				SharedMemoryQueue.RECORD.pack_into(buf, SharedMemoryQueue.HEADER.size + index, SharedMemoryQueue.WRAP)
+			index = 0
+		offset = SharedMemoryQueue.HEADER.size + index
+		SharedMemoryQueue.RECORD.pack_into(buf, offset, len(payload))
+		buf[offset + SharedMemoryQueue.RECORD.size:offset + need] = payload
+		struct.pack_into('Q', buf, 0, wpos + skip + need)
+		struct.pack_into('Q', buf, 16, written + 1)
+
+	def __read(self):
+		buf = self.shm.buf
+		rpos = struct.unpack_from('Q', buf, 8)[0]
+		index = rpos % self.capacity
+		contiguous = self.capacity - index
+		if contiguous < SharedMemoryQueue.RECORD.size or SharedMemoryQueue.RECORD.unpack_from(buf, SharedMemoryQueue.HEADER.size + index)[0] == SharedMemoryQueue.WRAP:
+			rpos += contiguous
+			index = 0
+		offset = SharedMemoryQueue.HEADER.size + index
+		length = SharedMemoryQueue.RECORD.unpack_from(buf, offset)[0]
+		payload = bytes(buf[offset + SharedMemoryQueue.RECORD.size:offset + SharedMemoryQueue.RECORD.size + length])
+		struct.pack_into('Q', buf, 8, rpos + SharedMemoryQueue.RECORD.size + length)
+		struct.pack_into('Q', buf, 24, struct.unpack_from('Q', buf, 24)[0] + 1)
+		return payload
@@ -29,13 +29,15 @@
 # OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
 # POSSIBILITY OF SUCH DAMAGE.
 
-from multiprocessing import Process, Pool, Queue, current_process
+from multiprocessing import Process, Pool, Queue, Array, current_process
 from queue import Empty
 import time
 from base.appconfig import Configuration
 from base.applog import *
-from ipfix.protocol import IPFIXReader
+from ipfix.protocol import IPFIXReader, hasTemplateSet
 from ipfix.errors import ProtocolException
+from ipfix.transport import DatagramBatch, iterBatch, countBatch, SharedMemoryQueue, DecoderRouter, ConversationRouter
+from ipfix.flowbatch import FlowBatch
 
 
 from enum import Enum
@@ -49,20 +51,49 @@ class QueueEnum(Enum):
 	Postprocessing = 32
 	Output = 64 
 
-import random 
 class QueueDirector:
-	def __init__(self, flow_log_interval = 10):
+	'''
+	Every consumer of a stage has its own queue (shard). Stateful stages own their 
+	shard (n-th consumer reads n-th queue only), consumers of stateless stages 
+	(STEALING) read their own queue first and take work from the others if it is empty.
+	
+	@param shared_memory_queues: Names of stages (QueueEnum) whose input is a SharedMemoryQueue
+		instead of a multiprocessing.Queue. Each consumer of such a stage gets its own ring.
+	@param consumers: Number of consumer processes per stage (QueueEnum -> int)
+	
+	Lengths count datagrams and flows, not queue elements: a DatagramBatch 
+	or FlowBatch counts as the datagrams / flows in it (see getWeight), so 
+	queues_maxsize means the same with and without batches.
+	'''
+	STEALING = [QueueEnum.Corrector, QueueEnum.Postprocessing] # stateless
+	STEAL_TIMEOUT = 0.05 # Seconds to wait for the own queue before trying the others again
+	
+	def __init__(self, flow_log_interval = 10, shared_memory_queues = [], consumers = {}, shared_memory_queue_size = 16777216):
 		self.queues = dict()
 		self.queues[QueueEnum.Start] = { 'queues': [], 'successor': [ QueueEnum.Flow ] }
-		self.queues[QueueEnum.Flow] = { 'queues': [ Queue() ], 'successor': [ QueueEnum.Corrector ] }
-		self.queues[QueueEnum.Corrector] = { 'queues': [ Queue() ], 'successor': [ QueueEnum.Conversation ] }
-		self.queues[QueueEnum.Conversation] = { 'queues': [ Queue() ], 'successor': [ QueueEnum.Security ] }
+		self.queues[QueueEnum.Flow] = { 'queues': [ Queue() for i in range(consumers.get(QueueEnum.Flow, 1)) ], 'successor': [ QueueEnum.Corrector ] }
+		self.queues[QueueEnum.Corrector] = { 'queues': [ Queue() for i in range(consumers.get(QueueEnum.Corrector, 1)) ], 'successor': [ QueueEnum.Conversation ] }
+		self.queues[QueueEnum.Conversation] = { 'queues': [ Queue() for i in range(consumers.get(QueueEnum.Conversation, 1)) ], 'successor': [ QueueEnum.Security ] }
 		# Stats temporary disabled
 		# self.queues[QueueEnum.Conversation] = { 'queues': [ Queue() ], 'successor': [ QueueEnum.Stats, QueueEnum.Security ] }
 		self.queues[QueueEnum.Stats] = { 'queues': [ Queue() ], 'successor': [ QueueEnum.Output ] }
 		self.queues[QueueEnum.Security] = { 'queues': [ Queue() ], 'successor': [ QueueEnum.Postprocessing ] }
-		self.queues[QueueEnum.Postprocessing] = { 'queues': [ Queue() ], 'successor': [ QueueEnum.Output ] }
+		self.queues[QueueEnum.Postprocessing] = { 'queues': [ Queue() for i in range(consumers.get(QueueEnum.Postprocessing, 1)) ], 'successor': [ QueueEnum.Output ] }
 		self.queues[QueueEnum.Output] = { 'queues': [ Queue() ], 'successor': [] }
+		for me, stage in self.queues.items():
+			stage['shared_memory'] = False
+			stage['owned'] = me not in QueueDirector.STEALING # True: n-th consumer reads n-th queue only
+		# Flow: Decoders are sharded by exporter, Conversation: sharded by ConversationRouter
+		for name in shared_memory_queues:
+			stage = QueueEnum[name]
+			if stage == QueueEnum.Start:
+				continue # Start has no queue of its own
+			self.queues[stage]['queues'] = [SharedMemoryQueue(shared_memory_queue_size) for i in range(consumers.get(stage, 1))]
+			self.queues[stage]['shared_memory'] = True
+			self.queues[stage]['owned'] = True # Single consumer per ring: no stealing
+		self.slots = { stage: i for i, stage in enumerate(QueueEnum) }
+		self.extra = Array('q', len(self.slots)) # weight - 1 of the batches per stage (with lock)
+		self.round_robin = 0
 		self.flow_log_interval = flow_log_interval
 		self.flow_count = 0
 		self.counter_accesstime = time.time()
@@ -70,39 +101,90 @@ class QueueDirector:
 	def __mergeQueueInfo(self, k, v):
 		return "%s: %s" % (k,v)
 	
-	def putFlow(self, me, element, identifier = 0):
+	@staticmethod
+	def getWeight(element):
+		'''
+		@return Datagrams or flows the element stands for
+		'''
+		if isinstance(element, (bytes, bytearray)): # DatagramBatch
+			return countBatch(element)
+		if isinstance(element, FlowBatch):
+			return len(element)
+		return 1
+		
+	def __addExtra(self, stage, extra):
+		with self.extra.get_lock():
+			self.extra[self.slots[stage]] += extra
+			
+	def putFlow(self, me, element, identifier = None):
 		if me not in self.queues:
 			raise Exception('QueueDirector does not know %s.' % str(me))
 		else:
+			weight = QueueDirector.getWeight(element)
 			if me == QueueEnum.Flow:
-				self.flow_count += 1
+				self.flow_count += weight
 				if self.flow_log_interval != 0:
 					if (time.time() - self.counter_accesstime) >= self.flow_log_interval:
-						details = '; '.join([self.__mergeQueueInfo(str(k).replace('QueueEnum.', ''), sum([q.qsize() for q in v['queues']])) for k,v in self.queues.items()])
-						log.info('Flows per second: %s. Elements in Queue: %s (%s)' % (round(self.flow_count / self.flow_log_interval, 2), self.getOverallLength(), details))
+						lengths = self.getLengths()
+						details = '; '.join([self.__mergeQueueInfo(k, v) for k,v in lengths.items()])
+						log.info('Flows per second: %s. Elements in Queue: %s (%s)' % (round(self.flow_count / self.flow_log_interval, 2), sum(lengths.values()), details))
 						self.flow_count = 0
 						self.counter_accesstime = time.time()
+			if identifier is None: # stateless: any queue
+				self.round_robin += 1
+				identifier = self.round_robin
 			for q in self.queues[me]['successor']:
 				qnum = (identifier % len(self.queues[q]['queues'])) # -1 ? (weil zustandsbehaftet)
+				if weight != 1:
+					self.__addExtra(q, weight - 1) # before: the consumer may take it at once
 				self.queues[q]['queues'][qnum].put(element)
 		
-	def getFlow(self, me):
+	def getFlow(self, me, index = 0, timeout = None):
+		'''
+		@param timeout: Seconds to wait for an element (None: forever), then Empty is raised
+		'''
 		if me not in self.queues:
 			raise Exception('QueueDirector does not know %s.' % str(me))
+		element = self.__get(me, index, timeout)
+		weight = QueueDirector.getWeight(element)
+		if weight != 1:
+			self.__addExtra(me, 1 - weight)
+		return element
 		
-		return random.choice(self.queues[me]['queues']).get()
+	def __get(self, me, index, timeout):
+		queues = self.queues[me]['queues']
+		own = queues[index % len(queues)]
+		if self.queues[me]['owned'] or len(queues) == 1:
+			return own.get(timeout=timeout)
+		for i in range(1, len(queues)): # own queue is empty? steal
+			if own.qsize() > 0:
+				break
+			try:
+				return queues[(index + i) % len(queues)].get_nowait()
+			except Empty:
+				pass
+		return own.get(timeout=QueueDirector.STEAL_TIMEOUT) # Empty: GenericProcess tries again
+		
+	def close(self):
+		for stage in self.queues.values():
+			if stage['shared_memory']:
+				for q in stage['queues']:
+					q.close()
+		
+	def getLengths(self):
+		'''
+		@return Elements per stage (name of QueueEnum -> int)
+		'''
+		return { k.name: sum([q.qsize() for q in v['queues']]) + self.extra[self.slots[k]] for k,v in self.queues.items() }
 		
 	def getOverallLength(self):
-		size = 0
-		for key,value in self.queues.items():
-			for q in value['queues']:
-				size += q.qsize()
-		return size
+		return sum(self.getLengths().values())
 		
 
 class GenericProcess(Process):
-	def __init__(self, queue_director):
+	def __init__(self, queue_director, index = 0):
 		self.queue_director = queue_director
+		self.index = index # n-th process of its stage
 		super(GenericProcess, self).__init__()
 		self.enabled = True
 		log.info("Process '%s' initialized." % self._name)
@@ -136,34 +218,70 @@ class GenericProcess(Process):
 
 from ipfix.errors import NoTemplateException
 class FlowConsumer(GenericProcess):
-	def __init__(self, queue_director):
+	'''
+	@param flow_batches: put one FlowBatch per message instead of one dict per flow
+	'''
+	def __init__(self, queue_director, index = 0, flow_batches = False):
 		self.has_ipfix_arrived = False
-		super(FlowConsumer, self).__init__(queue_director)
+		self.flow_batches = flow_batches
+		super(FlowConsumer, self).__init__(queue_director, index)
 		
 	def handle(self):
 		log.debug('%s consuming.' %(self._name))
-		requestObject, client_addr = self.queue_director.getFlow(QueueEnum.Flow)
-		ipfix = IPFIXReader(requestObject, client_addr)
-		for flow in ipfix.getFlowsWithHeader():
-			self.queue_director.putFlow(QueueEnum.Flow, flow)
+		batch = self.queue_director.getFlow(QueueEnum.Flow, self.index)
+		error = None
+		for requestObject, client_addr, flags in iterBatch(batch):
+			templates_only = bool(flags & DatagramBatch.TEMPLATES_ONLY)
+			try:
+				ipfix = IPFIXReader(requestObject, client_addr, templates_only, self.flow_batches)
+			except Exception as e:
+				error = e # Don't drop the rest of the batch because of one message
+				continue
+			if templates_only:
+				continue
+			if self.flow_batches:
+				if len(ipfix.getFlowBatch()):
+					self.queue_director.putFlow(QueueEnum.Flow, ipfix.getFlowBatch())
+			else:
+				for flow in ipfix.getFlowsWithHeader():
+					self.queue_director.putFlow(QueueEnum.Flow, flow)
 			
-		if not self.has_ipfix_arrived:
-			log.info('Congratulation: First flow has arrived.')
-			self.has_ipfix_arrived = True
+			if not self.has_ipfix_arrived:
+				log.info('Congratulation: First flow has arrived.')
+				self.has_ipfix_arrived = True
+		if error:
+			raise error
 			
 				
-from iana.protocol import *
+from iana.tables import serviceNum2Name, transportNum2Name
+from ipfix.socket_key import getSocketKey
 from network.subnets import LocationClassifier
+def splitByOwner(batch, router):
+	'''
+	@return List of (conversation worker, FlowBatch), the batch itself if it has one owner only
+	'''
+	groups = dict()
+	for i, key in enumerate(batch.getValues('socketIdentifier', False)):
+		groups.setdefault(router.getOwner(key), []).append(i)
+	if len(groups) == 1:
+		return [(owner, batch) for owner in groups]
+	return [(owner, batch.select(indices)) for owner, indices in groups.items()]
+	
 class CorrectorConsumer(GenericProcess):
-	def __init__(self, queue_director, ipfix_extreme_network_patch=False, conversation_consumer_threads = 2):
+	'''
+	@param router: ConversationRouter (None: one conversation worker)
+	'''
+	def __init__(self, queue_director, ipfix_extreme_network_patch=False, router = None, index = 0):
 		self.ipfix_extreme_network_patch = ipfix_extreme_network_patch
-		self.conversation_consumer_threads = conversation_consumer_threads
+		self.router = router or ConversationRouter()
 		self.locl = LocationClassifier()
-		super(CorrectorConsumer, self).__init__(queue_director)
+		super(CorrectorConsumer, self).__init__(queue_director, index)
 		
 	def handle(self):
 		log.debug('%s consuming.' %(self._name))
-		element = self.queue_director.getFlow(QueueEnum.Corrector)
+		element = self.queue_director.getFlow(QueueEnum.Corrector, self.index)
+		if isinstance(element, FlowBatch):
+			return self.__handleBatch(element)
 		
 		if 'sourceTransportPort' in element:
 			element['sourceTransportPortName'] = serviceNum2Name(element['sourceTransportPort'])
@@ -187,26 +305,78 @@ class CorrectorConsumer(GenericProcess):
 				log.warning("Received IPFIX-Message with an unusual Export-Interface (OutOfRange: %i > 10000). Export-Interface treated as None." % element['exportInterface'])
 				element['exportInterface'] = None
 			
-		# socketIdentifier for distinct conversations:
-		element['socketIdentifier'] = self.__getSocketIdentifier(element)
+		# socketIdentifier for distinct conversations (packed, rendered as string by IPFIXConversation):
+		element['socketIdentifier'] = self.__getSocketKey(element)
 		
 		# Lookup Location
 		if 'sourceIPv4Address' in element:
-			element['sourceNetworkLocation'] = self.locl.getLocation(str(element['sourceIPv4Address']))
+			element['sourceNetworkLocation'] = self.locl.getLocation(int(element['sourceIPv4Address']))
 		else:
 			element['sourceNetworkLocation'] = 'unknown'
 		if 'destinationIPv4Address' in element:
-			element['destinationNetworkLocation'] = self.locl.getLocation(str(element['destinationIPv4Address']))
+			element['destinationNetworkLocation'] = self.locl.getLocation(int(element['destinationIPv4Address']))
 		else:
 			element['destinationNetworkLocation'] = 'unknown'
 		
 		# Same conversations in same Queue (but separate processes):
-		id = self.__getHash(element, self.conversation_consumer_threads)
-		self.queue_director.putFlow(QueueEnum.Corrector, element, id)
+		self.queue_director.putFlow(QueueEnum.Corrector, element, self.router.getOwner(element['socketIdentifier']))
+				
+	def __handleBatch(self, batch):
+		'''
+		Same as handle, column by column.
+		'''
+		batch.mapColumn('sourceTransportPort', 'sourceTransportPortName', serviceNum2Name)
+		batch.mapColumn('destinationTransportPort', 'destinationTransportPortName', serviceNum2Name)
+		batch.mapColumn('protocolIdentifier', 'protocolIdentifierName', transportNum2Name)
+		
+		if not batch.isComplete('flowDurationMilliseconds'):
+			durations = batch.getValues('flowDurationMilliseconds')
+			starts = batch.getValues('flowStartSysUpTime')
+			ends = batch.getValues('flowEndSysUpTime')
+			valid = [i for i, (d, s, e) in enumerate(zip(durations, starts, ends)) if d is not None or (s is not None and e is not None)]
+			if len(valid) < len(batch): # without duration: dropped like in handle (only these flows)
+				log.warning("%i flows without duration (flowStartSysUpTime / flowEndSysUpTime) dropped." % (len(batch) - len(valid)))
+				if not valid:
+					return
+				batch = batch.select(valid)
+				durations, starts, ends = [[values[i] for i in valid] for values in (durations, starts, ends)]
+			batch.setColumn('flowDurationMilliseconds', [d if d is not None else self.__getDuration(s, e) for d, s, e in zip(durations, starts, ends)], batch.kinds.get('flowDurationMilliseconds', FlowBatch.INT))
+		if not batch.has('exportInterface'):
+			batch.header['exportInterface'] = None
+		elif 'exportInterface' in batch.columns:
+			interfaces = batch.getValues('exportInterface')
+			for i, interface in enumerate(interfaces):
+				if interface is not None and interface >= 10000: # @Bugfix: see handle
+					log.warning("Received IPFIX-Message with an unusual Export-Interface (OutOfRange: %i > 10000). Export-Interface treated as None." % interface)
+					interfaces[i] = None
+			batch.setColumn('exportInterface', interfaces)
+			
+		# socketIdentifier for distinct conversations (packed, rendered as string by IPFIXConversation):
+		if batch.has('sourceIPv4Address') and batch.has('destinationIPv4Address'):
+			batch.setColumn('socketIdentifier', [getSocketKey(s, d, sp, dp, p) if s is not None and d is not None else None for s, d, sp, dp, p in zip(
+				batch.getValues('sourceIPv4Address', False), 
+				batch.getValues('destinationIPv4Address', False), 
+				batch.getValues('sourceTransportPort'), 
+				batch.getValues('destinationTransportPort'), 
+				batch.getValues('protocolIdentifier')
+			)])
+		else:
+			batch.header['socketIdentifier'] = None
+		
+		# Lookup Location
+		for direction in ['source', 'destination']:
+			addresses = batch.getValues(direction + 'IPv4Address', False)
+			locations = self.locl.getLocations(addresses)
+			batch.setColumn(direction + 'NetworkLocation', [l if a is not None else 'unknown' for a, l in zip(addresses, locations)])
+			
+		# Same conversations in same Queue (but separate processes):
+		for owner, part in splitByOwner(batch, self.router):
+			self.queue_director.putFlow(QueueEnum.Corrector, part, owner)
 				
 	def __getFlowDurationMilliseconds(self, flow):
-		flowStartSysUpTime = flow['flowStartSysUpTime']
-		flowEndSysUpTime = flow['flowEndSysUpTime']
+		return self.__getDuration(flow['flowStartSysUpTime'], flow['flowEndSysUpTime'])
+		
+	def __getDuration(self, flowStartSysUpTime, flowEndSysUpTime):
 		if self.ipfix_extreme_network_patch:
 			# This is a workaround, because Extreme Network don't know that 1s = 1000ms (!)
 			# Achtung: Nur bei EXTREME 2^16, sonst 2^32 (!)
@@ -220,49 +390,213 @@ class CorrectorConsumer(GenericProcess):
 			else: # flowStartSysUpTime > flowEndSysUpTime:
 				return ((flowEndSysUpTime + 4294967296) - flowStartSysUpTime)
 				
-	def __getSocketIdentifier(self, flow):
+	def __getSocketKey(self, flow):
 		# Layer 3 Connection
-		if 'sourceIPv4Address' in flow and 'destinationIPv4Address' in flow and 'sourceTransportPortName' in flow and 'destinationTransportPortName' in flow:
-			socketSource = flow['sourceIPv4Address'].__str__() + ':' + flow['sourceTransportPortName']
-			socketDestination = flow['destinationIPv4Address'].__str__() + ':' + flow['destinationTransportPortName']
-			if socketSource < socketDestination:
-				return "%s-%s" % (socketSource, socketDestination)
-			else:
-				return "%s-%s" % (socketDestination, socketSource)
-		# Layer "2" Connection
-		elif 'sourceMacAddress' in flow and 'destinationMacAddress' in flow:
-			if flow['sourceMacAddress'] < flow['destinationMacAddress']:
-				return "%s-%s" % (flow['sourceMacAddress'], flow['destinationMacAddress'])
-			else:
-				return "%s-%s" % (flow['destinationMacAddress'], flow['sourceMacAddress'])
-		# else physical? currently not supported.
-		
-	def __getHash(self, flow, max_thread_count = 1):
 		if 'sourceIPv4Address' in flow and 'destinationIPv4Address' in flow:
-			return (hash(flow['sourceIPv4Address']) + hash(flow['destinationIPv4Address']))
-		else:
-			return 0
+			return getSocketKey(int(flow['sourceIPv4Address']), int(flow['destinationIPv4Address']), 
+				flow.get('sourceTransportPort'), flow.get('destinationTransportPort'), flow.get('protocolIdentifier'))
+		# Layer "2" Connection: not aggregated by OpenSocketAggregator (yet)
+		return None
 
 			
 from ipfix.conversation_aggregator import OpenSocketAggregator
+from base.checkpoint import Checkpoint
+import signal
+class ConversationHandoff():
+	'''
+	Open conversations handed over from one conversation worker to another 
+	(after workers were added or removed). Without states: wakes a worker up.
+	'''
+	def __init__(self, states = {}):
+		self.states = states
+		
 class ConversationConsumer(GenericProcess):
-	def __init__(self, queue_director, threadIdMapping, ttl_response_received=5, ttl_no_response=10): 
-		self.osa = OpenSocketAggregator(ttl_response_received, ttl_no_response)
+	'''
+	@param statistics: shared Array, STATISTICS values per consumer (written once per second)
+	@param checkpoint_directory: Open conversations are checkpointed there every 
+		checkpoint_interval seconds (0: disabled) and on SIGTERM, restored at start.
+	@param router: ConversationRouter. If its workers change, open conversations 
+		of other workers are handed over to them and flows still routed to this 
+		worker (queued before) are forwarded to their owner. A removed worker hands 
+		over what is left and stops once it is drained (at least REBALANCE_SECONDS 
+		after the change).
+	'''
+	STATISTICS = ['entries', 'bytes', 'evicted_entries', 'evicted_bytes', 'flows']
+	REBALANCE_SECONDS = 5
+	IDLE_SECONDS = 1 # Expiry, statistics and checkpoints at least that often (also without flows)
+	
+	def __init__(self, queue_director, index, ttl_response_received=5, ttl_no_response=10, max_entries=0, max_bytes=0, statistics=None, checkpoint_directory=None, checkpoint_interval=0, router=None): 
+		self.osa = OpenSocketAggregator(ttl_response_received, ttl_no_response, max_entries, max_bytes, bool(checkpoint_interval))
+		self.router = router or ConversationRouter()
+		self.router_version = None
+		self.rebalanced = 0
+		self.flows = 0
 		self.last_cache_access = time.time()
-		self.threadIdMapping = threadIdMapping
-		super(ConversationConsumer, self).__init__(queue_director)
+		self.statistics = statistics
+		self.last_evicted_entries = 0
+		self.checkpoint_directory = checkpoint_directory
+		self.checkpoint_interval = checkpoint_interval
+		self.checkpoint = None
+		self.last_checkpoint = time.time()
+		super(ConversationConsumer, self).__init__(queue_director, index)
+		
+	@staticmethod
+	def adoptCheckpoints(directory, router):
+		'''
+		Moves checkpointed conversations to the checkpoints of their current 
+		owners before the workers are started (restarted with fewer or more 
+		workers). Checkpoints of slots without a worker are removed.
+		'''
+		active = router.getActive()
+		moved = dict()
+		for name in Checkpoint.getNames(directory):
+			prefix, _, slot = name.rpartition('-')
+			if prefix != 'conversations' or not slot.isdigit():
+				continue
+			checkpoint = Checkpoint(directory, name)
+			states = checkpoint.load()
+			kept = dict()
+			for socket, state in states.items():
+				owner = router.getOwner(socket)
+				if owner == int(slot):
+					kept[socket] = state
+				else:
+					moved.setdefault(owner, dict())[socket] = state
+			if int(slot) not in active:
+				checkpoint.remove()
+			elif len(kept) < len(states):
+				checkpoint.compact(kept)
+			checkpoint.close()
+			if len(kept) < len(states):
+				log.info("%i conversations of checkpoint %s moved to other workers." % (len(states) - len(kept), name))
+		for owner, states in moved.items():
+			checkpoint = Checkpoint(directory, 'conversations-%i' % owner)
+			states.update(checkpoint.load()) # own state wins
+			checkpoint.compact(states)
+			checkpoint.close()
+			
+	def run(self):
+		if self.checkpoint_interval:
+			signal.signal(signal.SIGTERM, self.__terminate)
+			self.checkpoint = Checkpoint(self.checkpoint_directory, 'conversations-%i' % self.index)
+			states = self.checkpoint.load()
+			if states:
+				self.osa.restore(states)
+				self.osa.takeChanges() # in the checkpoint already
+				log.info("%s restored %i open conversations." % (self._name, len(states)))
+		try:
+			super(ConversationConsumer, self).run()
+		except KeyboardInterrupt:
+			pass
+		if self.checkpoint:
+			signal.signal(signal.SIGTERM, signal.SIG_IGN) # don't interrupt the checkpoint
+			self.__writeCheckpoint()
+			self.checkpoint.close()
+			log.info("%s checkpointed %i open conversations." % (self._name, self.osa.cache_size()))
+			
+	def __terminate(self, signum, frame):
+		self.stop() # leave run() after the current element (getFlow waits IDLE_SECONDS at most), then checkpoint
+		
+	def __writeCheckpoint(self):
+		upserts, removed = self.osa.takeChanges()
+		self.checkpoint.append(upserts, removed, self.osa.getStates)
+		self.last_checkpoint = time.time()
 		
 	def handle(self):
 		log.debug('%s consuming.' %(self._name))
-		element = self.queue_director.getFlow(QueueEnum.Conversation)
+		try:
+			element = self.queue_director.getFlow(QueueEnum.Conversation, self.index, ConversationConsumer.IDLE_SECONDS)
+		except Empty:
+			self.__maintain() # expire and checkpoint without flows, too
+			raise
+		
+		if self.router_version != self.router.version[0]:
+			self.__rebalance()
+		if isinstance(element, ConversationHandoff):
+			if element.states:
+				self.osa.restore(element.states)
+				log.info("%s took over %i open conversations." % (self._name, len(element.states)))
+			elif self.index not in self.router.getActive() and self.rebalanced + ConversationConsumer.REBALANCE_SECONDS < time.time() and self.queue_director.queues[QueueEnum.Conversation]['queues'][self.index].qsize() == 0:
+				self.__handOver(lambda socket: True) # e.g. flows without conversation key
+				self.__publishStatistics()
+				self.enabled = False # removed and drained
+				log.info("%s has been removed." % self._name)
+			return
+		if len(self.router.getActive()) > 1 or self.index not in self.router.getActive():
+			element = self.__forward(element) # queued before the workers changed
+			if element is None:
+				return
 		
 		self.osa.process(element) # Flows verarbeiten
+		self.flows += len(element) if isinstance(element, FlowBatch) else 1
 		
-		if self.last_cache_access + 1 < time.time(): # Nur einmal pro Sekunde abholen und speichern ... (Performance sparen)
-			self.last_cache_access = time.time() # Zeit aktualisieren
-			conv = self.osa.getItemsOutOfTTL()
-			if conv:
-				self.queue_director.putFlow(QueueEnum.Conversation, conv)
+		if self.last_cache_access + ConversationConsumer.IDLE_SECONDS < time.time() or len(self.osa.evicted) >= OpenSocketAggregator.EVICTION_BATCH: # Nur einmal pro Sekunde abholen und speichern ... (Performance sparen)
+			self.__maintain()
+			
+	def __maintain(self):
+		'''
+		Emits expired conversations, publishes statistics and checkpoints (if due).
+		'''
+		self.last_cache_access = time.time() # Zeit aktualisieren
+		conv = self.osa.getItemsOutOfTTL()
+		if conv:
+			self.queue_director.putFlow(QueueEnum.Conversation, conv)
+		self.__publishStatistics()
+		if self.checkpoint and self.last_checkpoint + self.checkpoint_interval < time.time():
+			self.__writeCheckpoint()
+			
+	def __rebalance(self):
+		'''
+		Hands over all open conversations this worker does not own any more.
+		'''
+		if self.router_version is not None: # not at start (restored checkpoint)
+			self.rebalanced = time.time()
+		self.router_version = self.router.version[0]
+		self.__handOver(lambda socket: self.router.getOwner(socket) != self.index)
+		
+	def __handOver(self, select):
+		'''
+		Hands over the open conversations selected (by socket) to their owner.
+		'''
+		states = self.osa.takeStates(select)
+		handoffs = dict()
+		for socket, state in states.items():
+			handoffs.setdefault(self.router.getOwner(socket), dict())[socket] = state
+		for owner, part in handoffs.items():
+			self.queue_director.putFlow(QueueEnum.Corrector, ConversationHandoff(part), owner)
+		if states:
+			log.info("%s handed over %i open conversations to %i workers." % (self._name, len(states), len(handoffs)))
+			
+	def __forward(self, element):
+		'''
+		Forwards flows routed before the workers changed to their owner.
+		@return the flows owned by this worker (None: no flow)
+		'''
+		if isinstance(element, FlowBatch):
+			own = None
+			for owner, part in splitByOwner(element, self.router):
+				if owner == self.index:
+					own = part
+				else:
+					self.queue_director.putFlow(QueueEnum.Corrector, part, owner)
+			return own
+		key = element.get('socketIdentifier')
+		if key is None or self.router.getOwner(key) == self.index: # not aggregated: stays
+			return element
+		self.queue_director.putFlow(QueueEnum.Corrector, element, self.router.getOwner(key))
+		return None
+		
+	def __publishStatistics(self):
+		statistics = self.osa.getStatistics()
+		statistics['flows'] = self.flows
+		if statistics['evicted_entries'] > self.last_evicted_entries:
+			log.warning("%s: %i conversations flushed early as partial (cache limit reached, %i open, ~%i bytes)." % (
+				self._name, statistics['evicted_entries'] - self.last_evicted_entries, statistics['entries'], statistics['bytes']))
+			self.last_evicted_entries = statistics['evicted_entries']
+		if self.statistics is not None:
+			offset = self.index * len(ConversationConsumer.STATISTICS)
+			for i, name in enumerate(ConversationConsumer.STATISTICS):
+				self.statistics[offset + i] = statistics[name]
 
 
 
@@ -279,7 +613,7 @@ class SecurityConsumer(GenericProcess):
 		
 	def handle(self):
 		log.debug('%s consuming.' %(self._name))
-		conversations = self.queue_director.getFlow(QueueEnum.Security)
+		conversations = self.queue_director.getFlow(QueueEnum.Security, self.index)
 		
 		if not self.bypass:
 			for c in conversations:
@@ -297,13 +631,13 @@ class SecurityConsumer(GenericProcess):
 			
 from network.dns import DNSCache
 class PostprocessingConsumer(GenericProcess):
-	def __init__(self, queue_director, dnscache):
+	def __init__(self, queue_director, dnscache, index = 0):
 		self.dnscache = dnscache 
-		super(PostprocessingConsumer, self).__init__(queue_director)
+		super(PostprocessingConsumer, self).__init__(queue_director, index)
 		
 	def handle(self):
 		log.debug('%s consuming.' %(self._name))
-		element = self.queue_director.getFlow(QueueEnum.Postprocessing)
+		element = self.queue_director.getFlow(QueueEnum.Postprocessing, self.index)
 
 		conversationsWithHostnames = [self.__setHostnames(item) for item in element]
 
@@ -332,10 +666,10 @@ class StatsConsumer(GenericProcess):
 		
 	def handle(self):
 		log.debug('%s consuming.' %(self._name))
-		flows = self.queue_director.getFlow(QueueEnum.Stats)
+		flows = self.queue_director.getFlow(QueueEnum.Stats, self.index)
 		
-		if not isinstance(flows, list):
-			flows = [flows] # make list
+		if isinstance(flows, dict):
+			flows = [flows] # make list (FlowBatch: iterated flow by flow without dicts)
 			
 		for flow in flows:
 			if flow['sourceNetworkLocation'] and not flow['destinationNetworkLocation']: # Home to other network
@@ -387,27 +721,60 @@ class StatsConsumer(GenericProcess):
 from handler.elasticsearch import ElasticsearchClient
 from handler.file import FileWriter
 from handler.udpsender import UDPSender
+from handler.archive import ArchiveWriter
 class OutputConsumer(GenericProcess):
-	def __init__(self, queue_director, enabled_handlers, elasticsearch, filename, udpreceiver):
+	POLL_SECONDS = 1 # Writers with buffers are polled at least that often
+	
+	def __init__(self, queue_director, enabled_handlers, elasticsearch, filename, udpreceiver, elasticsearch_bulk = {}, file_output = {}, archive = {}):
 		self.enabled_handlers = enabled_handlers
 		if self.enabled_handlers['elasticsearch']:
-			self.es_client = ElasticsearchClient(elasticsearch['host'], elasticsearch['port'], elasticsearch['index'])
+			self.es_client = ElasticsearchClient(elasticsearch['host'], elasticsearch['port'], elasticsearch['index'], bulk=elasticsearch_bulk)
 			log.info("Saving to Elasticsearch enabled. Destination: http://%s:%s/%s" % (
 				elasticsearch['host'], elasticsearch['port'], elasticsearch['index']
 			))
 		if self.enabled_handlers['file']:
-			self.file_writer = FileWriter(filename)
+			self.file_writer = FileWriter(filename, **file_output)
 			log.info("Saving to File enabled. Filename: %s" % filename)
 		if self.enabled_handlers['screen']:
 			log.info("Output to Screen (STDOUT) enabled.")
 		if self.enabled_handlers['udpreceiver']:
 			self.udpsender = UDPSender(udpreceiver['host'], udpreceiver['port']) 
 			log.info("Output via UDP-Pickle enabled.")
+		if self.enabled_handlers.get('archive'):
+			self.archive_writer = ArchiveWriter(**archive)
+			log.info("Columnar archive enabled. Directory: %s" % archive['directory'])
 		super(OutputConsumer, self).__init__(queue_director)
 		
+	def run(self):
+		signal.signal(signal.SIGTERM, self.__terminate)
+		try:
+			super(OutputConsumer, self).run()
+		except KeyboardInterrupt:
+			pass
+		signal.signal(signal.SIGTERM, signal.SIG_IGN) # don't interrupt writing out
+		if self.enabled_handlers['elasticsearch']:
+			self.es_client.close() # send pending documents
+		if self.enabled_handlers['file']:
+			self.file_writer.close()
+		if self.enabled_handlers.get('archive'):
+			self.archive_writer.close()
+			
+	def __terminate(self, signum, frame):
+		self.stop() # leave run() after the current batch (getFlow waits POLL_SECONDS at most), then close the writers
+		
+	def __poll(self):
+		if self.enabled_handlers['file']:
+			self.file_writer.poll()
+		if self.enabled_handlers.get('archive'):
+			self.archive_writer.poll()
+		
 	def handle(self):
 		log.debug('%s consuming.' %(self._name))
-		bulk_data = self.queue_director.getFlow(QueueEnum.Output)
+		try:
+			bulk_data = self.queue_director.getFlow(QueueEnum.Output, self.index, OutputConsumer.POLL_SECONDS)
+		except Empty:
+			self.__poll() # nothing arrived: write out buffered conversations anyway
+			raise
 	
 
 		if self.enabled_handlers['elasticsearch']:
@@ -415,63 +782,120 @@ class OutputConsumer(GenericProcess):
 			log.debug("Writeout %i %s(s) to elasticsearch." % (len(bulk_data[0]), bulk_data[1]))
 		if bulk_data[1] != 'stats':
 			if self.enabled_handlers['file']:
-				for conv in bulk_data[0]:
-					self.file_writer.append(conv)
+				self.file_writer.appendMany(bulk_data[0])
 				log.debug("Writeout %i conversations to file." % len(bulk_data[0]))
 			if self.enabled_handlers['screen']:
 				for conv in bulk_data[0]:
 					print(conv)
 			if self.enabled_handlers['udpreceiver']:
 				self.udpsender.send(bulk_data[0])
+			if self.enabled_handlers.get('archive'):
+				self.archive_writer.appendMany(bulk_data[0])
 					
 
-import os
-import pickle
 import time
 class BackgroundWorker(GenericProcess):
+	'''
+	Replays the spill log (elements written to disk while the queues were overloaded). 
+	The rate adapts to the queue depth: the queues are filled up to REPLAY_DEPTH of 
+	queues_maxsize, so that replaying never overloads them again. The log is read 
+	in chunks of READ_COUNT elements (datagram batches can be large).
+	'''
 	DIRECTORY = 'data/flows/'
+	REPLAY_DEPTH = 0.5
+	READ_COUNT = 64
+	BUSY_SECONDS = 0.1 # Queues deep enough: wait before looking again
+	IDLE_SECONDS = 1 # Nothing to replay
 	
-	def __init__(self, queue_director, max_queue_size):
+	def __init__(self, queue_director, max_queue_size, spill_log):
 		self.max_queue_size = max_queue_size
+		self.spill_log = spill_log
 		super(BackgroundWorker, self).__init__(queue_director)
 		
 	def handle(self):
-		qs = self.queue_director.getOverallLength()
-		if qs < int(self.max_queue_size / 3):
-			files = os.listdir(BackgroundWorker.DIRECTORY)
-			if len(files) >= 1:
-				filename = os.path.join(BackgroundWorker.DIRECTORY, files[0]) # pick only one file
-				log.info('%s consuming: %s.' % (self._name, filename))
-				flows = pickle.load(open(filename, "rb")) # load file
-				for flow in flows:
-					self.queue_director.putFlow(QueueEnum.Start, flow) # put into initial queue
-				os.remove(filename) # remove flow file
-		time.sleep(5) # im 10 Sekunden Intervall ausführen, sonst nimmt der alle Dateien auf einmal!
+		free = int(self.max_queue_size * BackgroundWorker.REPLAY_DEPTH) - self.queue_director.getOverallLength()
+		if free <= 0:
+			time.sleep(BackgroundWorker.BUSY_SECONDS)
+			return
+		replayed = 0
+		while replayed < free:
+			count = min(free - replayed, BackgroundWorker.READ_COUNT)
+			elements = self.spill_log.read(count)
+			for element, shard in elements:
+				if isinstance(element, bytes): # datagram batch of decoder shard
+					self.queue_director.putFlow(QueueEnum.Start, element, shard)
+				else: # Netflow: flow (dict) or FlowBatch
+					self.queue_director.putFlow(QueueEnum.Flow, element)
+			replayed += len(elements)
+			if len(elements) < count: # nothing more (yet)
+				break
+		self.spill_log.commit()
+		if replayed:
+			log.debug('%s replayed %i elements.' % (self._name, replayed))
+		else:
+			time.sleep(BackgroundWorker.IDLE_SECONDS)
+			
+	def run(self):
+		super(BackgroundWorker, self).run()
+		self.spill_log.close()
 
 		
-from ipfix.misc import DelayedWriter
+from ipfix.spilllog import SpillLog
+from network.udpstats import getUDPSocketStats
 class Manager:
+	QUEUE_DEPTH_INTERVAL = 0.1 # Seconds between two samples of the queue depth
+	STOP_SECONDS = 30 # Waiting for a process to write out (checkpoint, pending documents) before it is killed
+	
 	def __init__(self):
 		self.config = Configuration()
-		self.queue_director = QueueDirector(self.config.flow_log_interval)
+		self.consumers = {
+			QueueEnum.Flow: self.config.flow_consumer_threads,
+			QueueEnum.Corrector: self.config.corrector_consumer_threads,
+			QueueEnum.Conversation: max(self.config.conversation_consumer_threads, self.config.conversation_consumer_max_threads), # Slots (ConversationRouter)
+			QueueEnum.Security: 1,
+			QueueEnum.Postprocessing: 2,
+			QueueEnum.Stats: 1,
+			QueueEnum.Output: 1
+		}
+		self.queue_director = QueueDirector(self.config.flow_log_interval, 
+			self.config.shared_memory_queues, 
+			self.consumers, 
+			self.config.shared_memory_queue_size
+		)
 		self.dnscache = DNSCache(self.config.dns_cache_seconds)
 		self.workers = []
-		self.delayed_writer = DelayedWriter(BackgroundWorker.DIRECTORY, 1000)
+		self.spill_log = SpillLog(BackgroundWorker.DIRECTORY, self.config.spill_segment_size, self.config.spill_sync_seconds)
+		self.router = DecoderRouter(self.consumers[QueueEnum.Flow])
+		self.decoders = []
+		self.batches = [DatagramBatch(self.config.transport_batch_packets, self.config.transport_batch_microseconds) for i in range(self.consumers[QueueEnum.Flow])]
+		self.last_decoder_check = time.time()
+		self.receivers = [] # Receiver processes (SO_REUSEPORT). Empty: main process receives.
+		self.last_udp_drops = {} # port -> drops at the last check
+		self.last_udp_check = time.time()
+		self.queue_depth = 0
+		self.queue_depth_time = 0
+		self.conversation_statistics = Array('q', len(ConversationConsumer.STATISTICS) * self.consumers[QueueEnum.Conversation], lock=False)
+		self.conversation_router = ConversationRouter(self.consumers[QueueEnum.Conversation], self.config.conversation_consumer_threads)
+		self.conversation_workers = [None] * self.consumers[QueueEnum.Conversation]
+		self.last_conversation_flows = None
+		self.last_conversation_check = time.time()
 
 	def start(self):
 		# TODO: Evtl zuerst Prozesse initialisieren, dann Queue, Config laden, dann Prozesse starten (enable) --> Performance
-		self.workers.append(FlowConsumer(self.queue_director)) # One Worker (Each Process needs each own IPFIX-Template!! Some Procs may never receive Templates!!!)
-		for i in range(0, self.config.corrector_consumer_threads):
-			self.workers.append(CorrectorConsumer(self.queue_director, self.config.ipfix_extreme_network_patch, self.config.conversation_consumer_threads))
-		
-		for i in range(0, self.config.conversation_consumer_threads):
-			self.workers.append(ConversationConsumer(self.queue_director, i, 
-				self.config.opensocketcache['ttl_no_response'],
-				self.config.opensocketcache['ttl_response_received']
-			))
+		for i in range(0, self.consumers[QueueEnum.Flow]): # Sharded by exporter, templates are broadcasted to all decoders
+			self.decoders.append(FlowConsumer(self.queue_director, i, self.config.flow_batches))
+		self.workers.extend(self.decoders)
+		for i in range(0, self.consumers[QueueEnum.Corrector]):
+			self.workers.append(CorrectorConsumer(self.queue_director, self.config.ipfix_extreme_network_patch, self.conversation_router, i))
 		
-		self.workers.append(PostprocessingConsumer(self.queue_director, self.dnscache))  # Multiple Workers (gemeinsames dict)
-		self.workers.append(PostprocessingConsumer(self.queue_director, self.dnscache))
+		if self.config.checkpoint_interval:
+			ConversationConsumer.adoptCheckpoints(self.config.checkpoint_directory, self.conversation_router)
+		for i in self.conversation_router.getActive():
+			self.conversation_workers[i] = self.__createConversationConsumer(i)
+			self.workers.append(self.conversation_workers[i])
+		
+		for i in range(0, self.consumers[QueueEnum.Postprocessing]):
+			self.workers.append(PostprocessingConsumer(self.queue_director, self.dnscache, i))  # Multiple Workers (gemeinsames dict)
 		self.workers.append(SecurityConsumer(self.queue_director, self.config.security_sample_percentage))
 		self.workers.append(StatsConsumer(self.queue_director, 
 			self.config.ipfix_cache_seconds
@@ -480,33 +904,239 @@ class Manager:
 			self.config.enabled_handlers, 
 			self.config.elasticsearch, 
 			self.config.filename,
-			self.config.udpreceiver
+			self.config.udpreceiver,
+			self.config.elasticsearch_bulk,
+			self.config.file_output,
+			self.config.archive
 		)) # Multiple Workers possible (2?).
-		self.workers.append(BackgroundWorker(self.queue_director, self.config.queues_maxsize))
+		self.workers.append(BackgroundWorker(self.queue_director, self.config.queues_maxsize, self.spill_log))
 
 		for w in self.workers:
 			w.start()
 			
-	def put(self, element):
-		if self.queue_director.getOverallLength() <= self.config.queues_maxsize:
-			self.queue_director.putFlow(QueueEnum.Start, element)
-		else:
-			self.delayed_writer.put(element)
-			log.debug("Extremly long queue. IPFIX-Message flushed to disk (will be processed later).")
+	def __createConversationConsumer(self, slot):
+		return ConversationConsumer(self.queue_director, slot, 
+			self.config.opensocketcache['ttl_no_response'],
+			self.config.opensocketcache['ttl_response_received'],
+			self.config.conversation_cache_max_entries,
+			self.config.conversation_cache_max_bytes,
+			self.conversation_statistics,
+			self.config.checkpoint_directory,
+			self.config.checkpoint_interval,
+			self.conversation_router
+		)
+		
+	def setConversationWorkers(self, count):
+		'''
+		Adds or removes conversation workers at runtime (up to conversation_consumer_max_threads). 
+		Only the conversations of added / removed workers move (see ConversationRouter), 
+		open ones are handed over by the workers themselves.
+		'''
+		if count < 1 or count > self.conversation_router.slots:
+			raise ValueError("Number of conversation workers must be between 1 and %i (conversation_consumer_max_threads)." % self.conversation_router.slots)
+		active = self.conversation_router.getActive()
+		for slot in range(self.conversation_router.slots):
+			if (slot < count) != (slot in active):
+				self.conversation_router.setActive(slot, slot < count)
+		for slot in range(count):
+			worker = self.conversation_workers[slot]
+			if worker is None or not worker.is_alive():
+				if worker is not None:
+					self.workers.remove(worker)
+				self.conversation_workers[slot] = self.__createConversationConsumer(slot)
+				self.workers.append(self.conversation_workers[slot])
+				self.conversation_workers[slot].start()
+		self.__wakeConversationWorkers() # hand over open conversations now
+		log.info("%i conversation workers active." % count)
+		return self.conversation_router.getActive()
+		
+	def __wakeConversationWorkers(self):
+		for slot, worker in enumerate(self.conversation_workers):
+			if worker is not None and worker.is_alive():
+				self.queue_director.putFlow(QueueEnum.Corrector, ConversationHandoff(), slot)
+		
+	def execute(self, command):
+		'''
+		Command of the management endpoint, e.g. "conversation-workers 4".
+		@return result (JSON serializable)
+		'''
+		arguments = command.split()
+		if len(arguments) == 2 and arguments[0] == 'conversation-workers':
+			return { 'conversation_workers': self.setConversationWorkers(int(arguments[1])) }
+		raise ValueError("Unknown command: %s" % command)
+		
+	def put(self, data, exporter):
+		decoder = self.router.getDecoder(data, exporter)
+		self.batches[decoder].append(data, exporter)
+		if len(self.batches) > 1 and hasTemplateSet(data):
+			for i in self.router.getDecoders(): # not to failed decoders (queue would grow)
+				if i != decoder:
+					self.batches[i].append(data, exporter, DatagramBatch.TEMPLATES_ONLY)
+		if self.batches[decoder].isDue():
+			self.flush()
+			
+	def poll(self):
+		'''
+		Called by the receivers for every element and when idle (completes idle segments of the spill log).
+		'''
+		self.spill_log.poll()
+		
+	def flush(self):
+		self.poll()
+		due = [(i, batch) for i, batch in enumerate(self.batches) if batch.isDue()]
+		if not due:
+			return
+		overloaded = self.isOverloaded()
+		decoders = self.router.getDecoders()
+		for i, batch in due:
+			if i not in decoders: # failed after the batch was started: to the decoder of its shard
+				i = self.router.routes[i]
+			if not overloaded:
+				self.queue_director.putFlow(QueueEnum.Start, batch.take(), i)
+			else:
+				self.spill_log.append(batch.take(), i)
+				log.debug("Extremly long queue. IPFIX-Messages flushed to disk (will be processed later).")
+		if not self.receivers: # otherwise supervise() does it in the main process
+			self.checkHealth()
+		
+	def getQueueDepth(self):
+		'''
+		Elements in all queues, sampled at most every QUEUE_DEPTH_INTERVAL.
+		Asking every queue for its size per datagram costs more than 
+		receiving it (qsize takes a lock / semaphore per queue).
+		'''
+		now = time.time()
+		if now - self.queue_depth_time >= Manager.QUEUE_DEPTH_INTERVAL:
+			self.queue_depth = self.queue_director.getOverallLength()
+			self.queue_depth_time = now
+		return self.queue_depth
+		
+	def isOverloaded(self):
+		return self.getQueueDepth() > self.config.queues_maxsize
+		
+	def getStatus(self):
+		'''
+		@return dict with queue lengths, decoder health and kernel UDP statistics (management endpoint)
+		'''
+		status = {
+			'queues': self.queue_director.getLengths(),
+			'queues_maxsize': self.config.queues_maxsize,
+			'decoders': [d.is_alive() for d in self.decoders],
+			'receivers': [r.is_alive() for r in self.receivers],
+			'conversation_cache': self.__getConversationStatistics(),
+			'conversation_workers': self.conversation_router.getActive()
+		}
+		stats = getUDPSocketStats(self.getUDPPorts())
+		if stats is not None:
+			status['udp'] = { str(port): dict(zip(['sockets', 'queued', 'drops'], values)) for port, values in stats.items() }
+		return status
+		
+	def getUDPPorts(self):
+		'''
+		@return UDP ports of all receiving endpoints (see ipfix_receiver)
+		'''
+		ports = [self.config.netflow_port]
+		if self.config.asyncio_receiver and self.config.netflow_version == 10 and self.config.netflow_v5_port:
+			ports.append(self.config.netflow_v5_port)
+		return ports
+		
+	def __getConversationStatistics(self):
+		n = len(ConversationConsumer.STATISTICS)
+		values = list(self.conversation_statistics)
+		return [dict(zip(ConversationConsumer.STATISTICS, values[i:i + n])) for i in range(0, len(values), n)]
+		
+	def startReceivers(self, target, count):
+		'''
+		Starts count receiver processes, each running target(self) with its own
+		socket on the same port (SO_REUSEPORT).
+		'''
+		for i in range(0, count):
+			self.receivers.append(Process(target=target, args=(self,), name='Receiver-%i' % i))
+		for r in self.receivers:
+			r.start()
+		
+	def supervise(self):
+		while True:
+			time.sleep(1)
+			self.checkHealth()
+		
+	def checkHealth(self):
+		self.__checkDecoders()
+		self.__checkUDPDrops()
+		self.__checkConversationWorkers()
+		
+	def __checkDecoders(self):
+		if not self.decoders or self.last_decoder_check + 1 > time.time():
+			return
+		self.last_decoder_check = time.time()
+		for shard, decoder in self.router.failover([d.is_alive() for d in self.decoders]):
+			log.warning("Decoder for shard %i is not alive. %s takes over." % (shard, self.decoders[decoder]._name))
+		
+	def __checkConversationWorkers(self):
+		'''
+		Logs the load (flows) per conversation worker and wakes up removed 
+		workers, so that they stop once they are drained.
+		'''
+		if self.config.flow_log_interval == 0 or self.last_conversation_check + self.config.flow_log_interval > time.time():
+			return
+		self.last_conversation_check = time.time()
+		active = self.conversation_router.getActive()
+		for slot, worker in enumerate(self.conversation_workers):
+			if slot not in active and worker is not None and worker.is_alive():
+				self.queue_director.putFlow(QueueEnum.Corrector, ConversationHandoff(), slot)
+		flows = [s['flows'] for s in self.__getConversationStatistics()]
+		if self.last_conversation_flows is not None:
+			load = [max(0, flows[slot] - self.last_conversation_flows[slot]) for slot in active] # restarted: counter reset
+			mean = sum(load) / len(load)
+			if len(load) > 1 and mean > 0 and max(load) > 2 * mean:
+				log.warning("Conversation workers unevenly loaded (flows per worker since last check: %s)." % load)
+			else:
+				log.info("Conversation workers: flows per worker since last check: %s." % load)
+		self.last_conversation_flows = flows
+		
+	def __checkUDPDrops(self):
+		if self.config.flow_log_interval == 0 or self.last_udp_check + self.config.flow_log_interval > time.time():
+			return
+		self.last_udp_check = time.time()
+		stats = getUDPSocketStats(self.getUDPPorts())
+		if stats is None:
+			return
+		for port, (sockets, queued, drops) in stats.items():
+			last_drops = self.last_udp_drops.get(port)
+			if last_drops is not None and drops > last_drops:
+				log.warning("UDP port %i: %i datagrams dropped by the kernel since last check (%i in total, %i bytes queued, %i sockets). Increase receive_buffer_size or receiver_processes." % (
+					port, drops - last_drops, drops, queued, sockets))
+			else:
+				log.info("UDP port %i: %i drops in total, %i bytes queued, %i sockets." % (port, drops, queued, sockets))
+			self.last_udp_drops[port] = drops
 		
 	def putNetflow(self, element):
-		if self.queue_director.getOverallLength() <= self.config.queues_maxsize:
+		'''
+		@param element: flow (dict) or FlowBatch
+		'''
+		self.poll()
+		if not self.isOverloaded():
 			self.queue_director.putFlow(QueueEnum.Flow, element)
 		else:
-			self.delayed_writer.put(element)
+			self.spill_log.append(element)
 			log.debug("Extremly long queue. Netflow-Message flushed to disk (will be processed later).")
+		if not self.receivers:
+			self.checkHealth()
 
 	def join(self):
 		try:
+			for r in self.receivers:
+				r.terminate()
 			for w in reversed(self.workers):
 				w.beforeStop()
 				w.stop()
 				w.terminate()
+				w.join(Manager.STOP_SECONDS)
+				if w.is_alive():
+					log.warning("%s did not stop within %i seconds." % (w._name, Manager.STOP_SECONDS))
+					w.kill()
 			del(self.workers)
+			self.spill_log.close()
+			self.queue_director.close()
 		except KeyboardInterrupt:
 			log.info("All processes were stopped.")
@@ -33,54 +33,109 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
-import socketserver
 from ipfix.workers import Manager
 from base.applog import *
 from netflow.netflow_v5 import NetflowV5
+from network.receiver import DatagramReceiver
+from network.asyncreceiver import AsyncReceiver
 
 class ExceptionInvalidNetflowVersion(Exception):
 	pass
 	
-class IPFIXUDPHandler(socketserver.DatagramRequestHandler):
-	def handle(self):
-		log.debug('IPFIX-Message received from %s' % self.client_address[0])
-		self.server.ipfix_manager.put((self.request[0], str(self.client_address[0])))
+class IPFIXHandler():
+	def __init__(self, manager):
+		self.manager = manager
+		
+	def handle(self, data, exporter):
+		log.debug('IPFIX-Message received from %s' % exporter)
+		self.manager.put(data, exporter) # copied from the ring into the current batch
 		
 class NetflowV5Handler():
 	def __init__(self, manager):
 		self.manager = manager
 		
-	def handle(self, flow):
-		log.debug('Netflow-Message received.')
-		self.manager.putNetflow(flow)
+	def handle(self, batch):
+		log.debug('Netflow-Message with %i records received.' % len(batch))
+		if self.manager.config.flow_batches:
+			self.manager.putNetflow(batch)
+		else:
+			for flow in batch.getFlows():
+				self.manager.putNetflow(flow)
+		
+	def handleDatagram(self, data, exporter):
+		self.handle(NetflowV5.parse(data, exporter))
+		
+def receiveIPFIX(mgr):
+	receiver = DatagramReceiver(mgr.config.netflow_ip_mask, mgr.config.netflow_port, 
+		reuse_port = mgr.config.receiver_processes > 1, 
+		receive_buffer = mgr.config.receive_buffer_size
+	)
+	handler = IPFIXHandler(mgr)
+	try:
+		receiver.serve(handler.handle, mgr.flush, mgr.config.transport_batch_microseconds / 1000000)
+	except KeyboardInterrupt:
+		receiver.close()
+		
+def receiveNetflowV5(mgr):
+	o = NetflowV5(mgr.config.netflow_ip_mask, mgr.config.netflow_port, 
+		reuse_port = mgr.config.receiver_processes > 1, 
+		receive_buffer = mgr.config.receive_buffer_size
+	)
+	n = NetflowV5Handler(mgr)
+	try:
+		o.subscribe(n.handle, mgr.poll, mgr.config.transport_batch_microseconds / 1000000) 	# register Callback method
+	except KeyboardInterrupt:
+		pass
+		
+def receiveAsync(mgr):
+	receiver = AsyncReceiver(mgr, mgr.config.netflow_ip_mask, 
+		interval = mgr.config.transport_batch_microseconds / 1000000, 
+		max_pause = mgr.config.receiver_max_pause_milliseconds / 1000, 
+		reuse_port = mgr.config.receiver_processes > 1, 
+		receive_buffer = mgr.config.receive_buffer_size
+	)
+	if mgr.config.netflow_version == 10:
+		receiver.addEndpoint('IPFIX', mgr.config.netflow_port, IPFIXHandler(mgr).handle)
+		if mgr.config.netflow_v5_port:
+			receiver.addEndpoint('Netflow v5', mgr.config.netflow_v5_port, NetflowV5Handler(mgr).handleDatagram)
+	else:
+		receiver.addEndpoint('Netflow v5', mgr.config.netflow_port, NetflowV5Handler(mgr).handleDatagram)
+	if mgr.config.management_port:
+		if mgr.config.receiver_processes > 1:
+			log.warning("Management endpoint is only available with one receiver process.")
+		else:
+			receiver.setManagementEndpoint(mgr.config.management_port)
+	try:
+		receiver.run()
+	except KeyboardInterrupt:
+		pass
 		
 if __name__ == "__main__":
 	mgr = Manager()
 	if mgr.config.netflow_version == 10:
-		server = socketserver.UDPServer((
-			mgr.config.netflow_ip_mask, 
-			mgr.config.netflow_port
-		), IPFIXUDPHandler)
-		server.ipfix_manager = mgr
-		log.info("Listening on %s:%s" % (
-			mgr.config.netflow_ip_mask, 
-			mgr.config.netflow_port
-		))
-		log.info("Waiting for First IPFIX Template.")
-		try:
-			mgr.start()
-			#server.ipfix_manager.start()
-			server.serve_forever()
-		except KeyboardInterrupt:
-			log.info("Graceful Exit")
-			server.ipfix_manager.join()
+		receive = receiveIPFIX
 	elif mgr.config.netflow_version == 5:
-		o = NetflowV5(mgr.config.netflow_ip_mask, mgr.config.netflow_port)
-		n = NetflowV5Handler(mgr)
-		try:
-			mgr.start()
-			o.subscribe(n.handle) 	# register Callback method
-		except KeyboardInterrupt:
-			print("Exit. Bye bye.")
+		receive = receiveNetflowV5
 	else:
 		raise ExceptionInvalidNetflowVersion('Only Netflow v5 or IPFIX (=Netflow v10) are supported.')
+	if mgr.config.asyncio_receiver:
+		receive = receiveAsync
+		
+	log.info("Listening on %s:%s (%i receiver process(es))." % (
+		mgr.config.netflow_ip_mask, 
+		mgr.config.netflow_port,
+		mgr.config.receiver_processes
+	))
+	if mgr.config.netflow_version == 10:
+		log.info("Waiting for First IPFIX Template.")
+	try:
+		mgr.start()
+		if mgr.config.receiver_processes > 1:
+			mgr.startReceivers(receive, mgr.config.receiver_processes)
+			mgr.supervise()
+		else:
+			receive(mgr)
+	except KeyboardInterrupt:
+		pass
+	log.info("Graceful Exit")
+	mgr.join()
@@ -30,10 +30,15 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import socket, struct
-from socket import inet_ntoa
 import atexit	
 import math
 import ipaddress
+from network.receiver import createUDPSocket
+from ipfix.flowbatch import FlowBatch
+try:
+	import numpy
+except ImportError: # optional: struct.iter_unpack is used instead
+	numpy = None
 
 class ExceptionInvalidNetflowVersion(Exception):
     pass
@@ -42,98 +47,121 @@ class ExceptionInvalidNetflowHeader(Exception):
 class ExceptionNoCallbackMethod(Exception):
     pass
 	
+# Netflow v5 record (48 Bytes), field by field. Addresses are read as 32 bit integers.
+RECORD_FIELDS = [
+	('sourceIPv4Address', 'I'),			# Source IP Address
+	('destinationIPv4Address', 'I'),	# Destination IP Address
+	('ipNextHopIPv4Address', 'I'),		# Next hop router's IP Address
+	('ingressInterface', 'H'),			# Input interface index 
+	('egressInterface', 'H'),			# Output interface index
+	('packetDeltaCount', 'I'),			# Packets sent in Duration 
+	('octetDeltaCount', 'I'),			# Octets sent in Duration
+	('flowStartSysUpTime', 'I'),		# SysUptime at start of flow
+	('flowEndSysUpTime', 'I'),			# and of last packet of flow
+	('sourceTransportPort', 'H'),		# TCP/UDP source port number or equivalent
+	('destinationTransportPort', 'H'),	# TCP/UDP destination port number or equiv
+	('pad1', 'B'),						# unused
+	('tcpControlBits', 'B'),			# Cumulative OR of tcp flags
+	('protocolIdentifier', 'B'),		# IP protocol, e.g., 6=TCP, 17=UDP, ... (https://en.wikipedia.org/wiki/List_of_IP_protocol_numbers)
+	('ipClassOfService', 'B'),			# IP Type-of-Service
+	('bgpSourceAsNumber', 'H'),			# originating AS of source address
+	('bgpDestinationAsNumber', 'H'),	# originating AS of destination address
+	('sourceIPv4PrefixLength', 'B'),	# source address prefix mask bits
+	('destinationIPv4PrefixLength', 'B'),# destination address prefix mask bits
+	('pad2', 'H')						# unused, drops
+]
+RECORD_STRUCT = struct.Struct('!' + ''.join([t for n, t in RECORD_FIELDS]))
+RECORD_COLUMNS = [n for n, t in RECORD_FIELDS if not n.startswith('pad')]
+RECORD_KINDS = { n: FlowBatch.IPV4 if n.endswith('IPv4Address') else FlowBatch.INT for n in RECORD_COLUMNS }
+if numpy:
+	RECORD_DTYPE = numpy.dtype([(n, '>u%i' % struct.calcsize(t)) for n, t in RECORD_FIELDS]) # big endian
+	
 class NetflowV5: # Observable
 	SIZE_OF_HEADER = 24
 	SIZE_OF_RECORD = 48
 
-	def __init__(self, netflow_ip_mask = '0.0.0.0', netflow_port = 2055):
-		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-		self.sock.bind((netflow_ip_mask, netflow_port))
+	def __init__(self, netflow_ip_mask = '0.0.0.0', netflow_port = 2055, reuse_port = False, receive_buffer = 0):
+		self.sock = createUDPSocket(netflow_ip_mask, netflow_port, reuse_port, receive_buffer)
 		atexit.register(self.exit_handler)
 		self.enabled = True
 		
-	def subscribe(self, callback_method):
+	def subscribe(self, callback_method, idle_method=None, timeout=None):
+		'''
+		@param callback_method: called once per PDU with a FlowBatch
+		@param idle_method: called whenever no PDU arrived within timeout (seconds)
+		'''
 		if not callback_method:
 			raise ExceptionNoCallbackMethod('A call back method must be spcified!')
 			
+		buf = bytearray(1500)
+		self.sock.settimeout(timeout)
 		while self.enabled:
-			header = {}
-			
-			buf, addr = self.sock.recvfrom(1500)
-			header['exporter'] = addr[0]
-			header['exportInterface'] = None
-	
-			# Unpack the header
-			header_raw = struct.unpack('!HHIIIIBBH', buf[:NetflowV5.SIZE_OF_HEADER])
-			
-			# Sanity check - fields
-			if len(header_raw) != 9:
-				raise ExceptionInvalidNetflowHeader("Netflow v5 must contain exactly 9 elements.")
+			try:
+				nbytes, addr = self.sock.recvfrom_into(buf)
+			except socket.timeout:
+				if idle_method:
+					idle_method()
+				continue
+			callback_method (NetflowV5.parse(memoryview(buf)[:nbytes], addr[0]))
 				
-			
-			header['version'] = header_raw[0] 		# version = 5
-			
-			header['flow_count'] = header_raw[1] 	# The number of records in the PDU
-			header['sys_uptime'] = header_raw[2] 	# Current time in millisecs since router booted (not in IPFIX!)
-			if header_raw[4] == 0: # Residual nanoseconds since 0000 UTC 1970 
-				header['timestamp'] = header_raw[3]	# Current seconds since 0000 UTC 1970
-			else:
-				header['timestamp'] = header_raw[3] + (header_raw[4] / 1000000000)
-			header['sequence'] = header_raw[5]		# Seq counter of total flows seen
-			header['engine_type'] = header_raw[6]	# Type of flow switching engine (RP,VIP,etc.)
-													# Engine 0 - Regular netflow
-													# Engine 1 - Regular netflow
-													# Engine 2 - Only sampled netflow
-													# Engine 3 - Both, sample and aggregate netflow
-													# Engine 4 and 4+ - Only sampled netflow
-			header['domain_id'] = header_raw[7]		# Slot number of the flow switching engine
-			header['sampling_interval'] = header_raw[8]	# reserved / not used?
-
-			# Sanity check - version
-			if header['version'] != 5:
-				raise ExceptionInvalidNetflowVersion("Not a NetFlow v5 packet.")
-
-			# Sanity check - count
-			if header['flow_count'] <= 0:
-				raise ExceptionInvalidNetflowHeader("Invalid header count {0}".format(header['flow_count']))
-
-			for i in range(0, header['flow_count']):
-				base = NetflowV5.SIZE_OF_HEADER+(i*NetflowV5.SIZE_OF_RECORD)
+	@staticmethod
+	def parse(buf, exporter):
+		'''
+		Decodes the records of a PDU at once: with numpy as structured array 
+		(one call), otherwise with struct.iter_unpack.
+		@return FlowBatch (header stored once, addresses as integers)
+		'''
+		header = {}
+		
+		header['exporter'] = exporter
+		header['exportInterface'] = None
 
-				data = struct.unpack('!HHIIIIHHBBBBHHBBH',buf[base+12:base+NetflowV5.SIZE_OF_RECORD])
+		# Unpack the header
+		header_raw = struct.unpack_from('!HHIIIIBBH', buf)
+		
+		# Sanity check - fields
+		if len(header_raw) != 9:
+			raise ExceptionInvalidNetflowHeader("Netflow v5 must contain exactly 9 elements.")
+			
+		
+		header['version'] = header_raw[0] 		# version = 5
+		
+		header['flow_count'] = header_raw[1] 	# The number of records in the PDU
+		header['sys_uptime'] = header_raw[2] 	# Current time in millisecs since router booted (not in IPFIX!)
+		if header_raw[4] == 0: # Residual nanoseconds since 0000 UTC 1970 
+			header['timestamp'] = header_raw[3]	# Current seconds since 0000 UTC 1970
+		else:
+			header['timestamp'] = header_raw[3] + (header_raw[4] / 1000000000)
+		header['sequence'] = header_raw[5]		# Seq counter of total flows seen
+		header['engine_type'] = header_raw[6]	# Type of flow switching engine (RP,VIP,etc.)
+												# Engine 0 - Regular netflow
+												# Engine 1 - Regular netflow
+												# Engine 2 - Only sampled netflow
+												# Engine 3 - Both, sample and aggregate netflow
+												# Engine 4 and 4+ - Only sampled netflow
+		header['domain_id'] = header_raw[7]		# Slot number of the flow switching engine
+		header['sampling_interval'] = header_raw[8]	# reserved / not used?
 
-				nfdata = {}
+		# Sanity check - version
+		if header['version'] != 5:
+			raise ExceptionInvalidNetflowVersion("Not a NetFlow v5 packet.")
 
-				# Decode the addresses
-				nfdata['sourceIPv4Address'] = ipaddress.ip_address(inet_ntoa(buf[base+0:base+4]))	# Source IP Address
-				nfdata['destinationIPv4Address'] = ipaddress.ip_address(inet_ntoa(buf[base+4:base+8]))	# Destination IP Address
-				nfdata['ipNextHopIPv4Address'] = ipaddress.ip_address(inet_ntoa(buf[base+8:base+12]))	# Next hop router's IP Address
+		# Sanity check - count
+		if header['flow_count'] <= 0:
+			raise ExceptionInvalidNetflowHeader("Invalid header count {0}".format(header['flow_count']))
+		end = NetflowV5.SIZE_OF_HEADER + (header['flow_count'] * NetflowV5.SIZE_OF_RECORD)
+		if end > len(buf):
+			raise ExceptionInvalidNetflowHeader("PDU too short for {0} records".format(header['flow_count']))
 
-				# The rest of the data
-				nfdata['ingressInterface'] = data[0]			# Input interface index 
-				nfdata['egressInterface'] = data[1]				# Output interface index
-				nfdata['packetDeltaCount'] = data[2]			# Packets sent in Duration 
-				nfdata['octetDeltaCount'] = data[3]				# Octets sent in Duration
-				nfdata['flowStartSysUpTime'] = data[4]			# SysUptime at start of flow
-				nfdata['flowEndSysUpTime'] = data[5]			# and of last packet of flow
-				nfdata['sourceTransportPort'] = data[6]			# TCP/UDP source port number or equivalent
-				nfdata['destinationTransportPort'] = data[7]	# TCP/UDP destination port number or equiv
-				# nfdata['pad1'] = data[8] 						# unused
-				nfdata['tcpControlBits'] = data[9] 				# Cumulative OR of tcp flags
-				
-				# https://en.wikipedia.org/wiki/List_of_IP_protocol_numbers
-				nfdata['protocolIdentifier'] = data[10] 		# IP protocol, e.g., 6=TCP, 17=UDP, ...
-				
-				nfdata['ipClassOfService'] = data[11]			# IP Type-of-Service
-				nfdata['bgpSourceAsNumber'] = data[12]			# originating AS of source address
-				nfdata['bgpDestinationAsNumber'] = data[13]		# originating AS of destination address
-				nfdata['sourceIPv4PrefixLength'] = data[14]		# source address prefix mask bits
-				nfdata['destinationIPv4PrefixLength'] = data[15]# destination address prefix mask bits
-				#nfdata['pad2'] = data[16] 						# unused, drops
-				
-				# Python 3.5 only (fast merge via pointer):
-				flow = {**header, **nfdata}
-				callback_method (flow)
+		if numpy:
+			records = numpy.frombuffer(buf, RECORD_DTYPE, header['flow_count'], NetflowV5.SIZE_OF_HEADER).copy() # buf is reused by the receiver
+			columns = { name: records[name].tolist() for name in RECORD_COLUMNS }
+		else:
+			rows = RECORD_STRUCT.iter_unpack(memoryview(buf)[NetflowV5.SIZE_OF_HEADER:end])
+			columns = { name: column for name, column in zip([n for n, t in RECORD_FIELDS], zip(*rows)) if not name.startswith('pad') }
+		batch = FlowBatch(header)
+		batch.append(columns, header['flow_count'], RECORD_KINDS)
+		return batch
 				
 	def exit_handler(self):
 		self.enabled = False
@@ -148,8 +176,9 @@ class FlowReceiver:
 		except KeyboardInterrupt:
 			print("Exit. Bye bye.")
 		
-	def insertFlow(self, flow):
-		print(flow)
+	def insertFlow(self, batch):
+		for flow in batch.getFlows():
+			print(flow)
 		
 ## Test:
 # FlowReceiver()
@@ -0,0 +1,159 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio, json, time
+from base.applog import *
+from network.receiver import createUDPSocket
+
+class CallbackDatagramProtocol(asyncio.DatagramProtocol):
+	'''
+	Hands every datagram to callback_method(data, exporter).
+	'''
+	def __init__(self, callback_method):
+		self.callback_method = callback_method
+		self.transport = None
+		self.datagrams = 0
+		
+	def connection_made(self, transport):
+		self.transport = transport
+		
+	def datagram_received(self, data, address):
+		self.datagrams += 1
+		try:
+			self.callback_method(data, address[0])
+		except Exception as e:
+			log.error("Datagram from %s could not be processed: %s" % (address[0], e))
+			
+	def error_received(self, exc):
+		log.error("UDP socket: %s" % exc)
+
+class AsyncReceiver():
+	'''
+	Serves several UDP endpoints (e.g. IPFIX and Netflow v5) and a management 
+	endpoint in one asyncio event loop. The management endpoint (TCP) answers 
+	every connection with the status of the manager as JSON. A command sent 
+	first (e.g. "conversation-workers 4") is executed before.
+	
+	Backpressure: While the manager is overloaded, reading is paused and the 
+	datagrams wait in the kernel receive buffer. If this lasts longer than 
+	max_pause, reading is resumed and the manager spills to disk until the 
+	queues are drained.
+	
+	@param manager: provides flush(), isOverloaded(), getStatus() and execute(command)
+	@param interval: Seconds between two flushes / backpressure checks
+	@param max_pause: Seconds to pause reading before spilling to disk
+	'''
+	RECEIVING = 'receiving'
+	PAUSED = 'paused'
+	SPILLING = 'spilling'
+	COMMAND_TIMEOUT = 0.2 # Seconds to wait for a command on the management endpoint
+	
+	def __init__(self, manager, ip='0.0.0.0', interval=0.002, max_pause=0.5, reuse_port=False, receive_buffer=0):
+		self.manager = manager
+		self.ip = ip
+		self.interval = interval
+		self.max_pause = max_pause
+		self.reuse_port = reuse_port
+		self.receive_buffer = receive_buffer
+		self.endpoints = [] # List of (name, port, callback_method)
+		self.protocols = dict()
+		self.management = None
+		self.state = AsyncReceiver.RECEIVING
+		self.paused_since = 0
+		
+	def addEndpoint(self, name, port, callback_method):
+		self.endpoints.append((name, port, callback_method))
+		
+	def setManagementEndpoint(self, port, ip='127.0.0.1'):
+		self.management = (ip, port)
+		
+	def run(self):
+		asyncio.run(self.serve())
+		
+	async def serve(self):
+		loop = asyncio.get_running_loop()
+		for name, port, callback_method in self.endpoints:
+			sock = createUDPSocket(self.ip, port, self.reuse_port, self.receive_buffer)
+			transport, protocol = await loop.create_datagram_endpoint(lambda c=callback_method: CallbackDatagramProtocol(c), sock=sock)
+			self.protocols[name] = protocol
+			log.info("Receiving %s on %s:%i." % (name, self.ip, port))
+		if self.management:
+			await asyncio.start_server(self.__status, *self.management)
+			log.info("Management endpoint on %s:%i." % self.management)
+		while True:
+			await asyncio.sleep(self.interval)
+			self.manager.flush()
+			self.__backpressure()
+			
+	def __backpressure(self):
+		overloaded = self.manager.isOverloaded()
+		if self.state == AsyncReceiver.RECEIVING:
+			if overloaded:
+				self.__setReading(False)
+				self.state = AsyncReceiver.PAUSED
+				self.paused_since = time.time()
+				log.warning("Extremly long queue. Reading paused.")
+		elif not overloaded:
+			if self.state == AsyncReceiver.PAUSED:
+				self.__setReading(True)
+			self.state = AsyncReceiver.RECEIVING
+			log.info("Queues drained. Reading resumed.")
+		elif self.state == AsyncReceiver.PAUSED and time.time() - self.paused_since > self.max_pause:
+			self.__setReading(True) # kernel buffer would overflow: spill to disk instead (Manager)
+			self.state = AsyncReceiver.SPILLING
+			log.warning("Queues still full after %s seconds. Datagrams are flushed to disk." % self.max_pause)
+			
+	def __setReading(self, enabled):
+		for protocol in self.protocols.values():
+			if enabled:
+				protocol.transport.resume_reading()
+			else:
+				protocol.transport.pause_reading()
+				
+	async def __status(self, reader, writer):
+		status = dict()
+		try: # Optional: one command line (see Manager.execute)
+			command = (await asyncio.wait_for(reader.readline(), AsyncReceiver.COMMAND_TIMEOUT)).decode('utf-8').strip()
+		except asyncio.TimeoutError:
+			command = None
+		if command:
+			try:
+				status['result'] = self.manager.execute(command)
+			except Exception as e:
+				status['error'] = str(e)
+		status.update(self.manager.getStatus())
+		status['receiver'] = {
+			'state': self.state,
+			'datagrams': { name: protocol.datagrams for name, protocol in self.protocols.items() }
+		}
+		writer.write(json.dumps(status).encode('utf-8') + b'\n')
+		await writer.drain()
+		writer.close()
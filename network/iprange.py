@@ -29,44 +29,42 @@
 # OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
 # POSSIBILITY OF SUCH DAMAGE.
 
-from bisect import bisect_left
 import ipaddress
+from network.prefixtable import PrefixTable
 
 class IPRangeLookupManager():
+	'''
+	Ranges of addresses with an attribute, looked up in a PrefixTable 
+	(overlapping ranges: the smallest enclosing prefix wins).
+	'''
 	def __init__(self):
-		self.data = []
-		self.__changed = True
+		self.table = PrefixTable()
 		
 	def addSubnet(self, subnet, attribute):
-		net = ipaddress.ip_network(subnet, strict=False)
-		return self.addIPByNum(int(net[0]), int(net[-1]), attribute)
+		self.table.addSubnet(subnet, attribute)
 	
 	def addIP(self, start_ip, end_ip, attribute):
 		self.addIPByNum(int(ipaddress.ip_address(start_ip)), int(ipaddress.ip_address(end_ip)), attribute)
 		
 	def addIPByNum(self, start_ip, end_ip, attribute):
-		self.data.append((start_ip, end_ip, attribute))
-		self.__changed = True
+		self.table.addRange(start_ip, end_ip, attribute)
 		
 	def prepare(self):
-		self.data.sort(key=lambda r: r[0])
-		self.keys = [y for _,y,_ in self.data]
-		self.__changed = False
-		#print("[IPRangeLookupManager] IP-Ranges were (re)loaded.")
+		self.table.prepare()
 		
 	def lookupIP(self, ip):
-		return self.lookupIPbyNum(int(ipaddress.ip_address(ip)))
+		'''
+		@param ip: int, IPv4Address or string
+		'''
+		if type(ip) is not int:
+			ip = int(ipaddress.ip_address(ip))
+		return self.table.lookup(ip)
 			
 	def lookupIPbyNum(self, ipnum):
-		if self.__changed:
-			self.prepare()
-		try:
-			result = self.data[bisect_left(self.keys, ipnum)]
-			if ipnum >= result[0] and ipnum <= result[1]:
-				return result[2]
-			return None
-		except IndexError:
-			return None
+		return self.table.lookup(ipnum)
+		
+	def lookupIPsByNum(self, ipnums):
+		return self.table.lookupMany(ipnums)
 			
 if __name__ == '__main__':
 	ipm = IPRangeLookupManager()
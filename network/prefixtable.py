@@ -0,0 +1,189 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+from bisect import bisect_right
+import heapq
+from array import array
+import ipaddress
+
+class PrefixTable():
+	'''
+	Longest prefix match over integer IPv4 addresses. Prefixes (and ranges) 
+	may overlap: the most specific one wins (longest prefix / smallest range), 
+	of equal ones the one with the higher priority, then the last added.
+	
+	prepare() pushes the values of all prefixes down to their leaves (as a 
+	radix trie with leaf pushing would) and flattens them into two arrays: 
+	start address of every block of addresses with the same result and the 
+	result. A lookup is one bisect, independent of the number of prefixes.
+	
+	@param default: Result of addresses without a matching prefix
+	'''
+	def __init__(self, default=None):
+		self.default = default
+		self.ranges = dict() # (first, last address) -> (priority, sequence, value)
+		self.starts = array('L')
+		self.results = []
+		self.__sequence = 0
+		self.__changed = True
+		
+	def __len__(self):
+		return len(self.ranges)
+		
+	def addPrefix(self, network, length, value, priority=0):
+		'''
+		@param network: address of the prefix (int)
+		'''
+		network &= ~((1 << (32 - length)) - 1) & 0xFFFFFFFF
+		self.addRange(network, network + (1 << (32 - length)) - 1, value, priority)
+		
+	def addSubnet(self, subnet, value, priority=0):
+		net = ipaddress.ip_network(subnet, strict=False)
+		self.addPrefix(int(net.network_address), net.prefixlen, value, priority)
+		
+	def addRange(self, start, end, value, priority=0):
+		'''
+		@param start, end: first and last address (int)
+		'''
+		current = self.ranges.get((start, end))
+		if current is None or priority >= current[0]:
+			self.ranges[(start, end)] = (priority, self.__sequence, value)
+			self.__sequence += 1
+		self.__changed = True
+			
+	def prepare(self):
+		'''
+		Sweeps over all start / end addresses: the ranges covering the current 
+		address are kept in a heap, the most specific on top (ranges behind 
+		the current address are removed when they come to the top).
+		'''
+		starts = []
+		results = []
+		ranges = sorted(self.ranges.items())
+		boundaries = sorted(set([0] + [start for (start, end) in self.ranges] + [end + 1 for (start, end) in self.ranges if end < 0xFFFFFFFF]))
+		heap = []
+		i = 0
+		for address in boundaries:
+			while i < len(ranges) and ranges[i][0][0] == address:
+				(start, end), (priority, sequence, value) = ranges[i]
+				heapq.heappush(heap, (end - start, -priority, -sequence, end, value))
+				i += 1
+			while heap and heap[0][3] < address:
+				heapq.heappop(heap)
+			result = heap[0][4] if heap else self.default
+			if not results or results[-1] is not result:
+				starts.append(address)
+				results.append(result)
+		self.starts = array('L', starts)
+		self.results = results
+		self.__changed = False
+		
+	def lookup(self, ip):
+		'''
+		@param ip: address as int
+		'''
+		if self.__changed:
+			self.prepare()
+		return self.results[bisect_right(self.starts, ip) - 1]
+		
+	def lookupMany(self, ips):
+		'''
+		@param ips: addresses as int (None: default)
+		@return list of results
+		'''
+		if self.__changed:
+			self.prepare()
+		starts, results, default = self.starts, self.results, self.default
+		return [results[bisect_right(starts, ip) - 1] if ip is not None else default for ip in ips]
+		
+class IntervalIndex():
+	'''
+	Ranges of several lists merged into one index: every block of addresses 
+	carries the bitset of the lists (bit n: n-th list) with a range covering 
+	it, so one lookup returns all matching lists.
+	
+	@param lists: List of range lists [(first, last address as int), ...]
+	'''
+	def __init__(self, lists=[]):
+		events = []
+		for bit, ranges in enumerate(lists):
+			for start, end in ranges:
+				events.append((start, bit, 1))
+				if end < 0xFFFFFFFF:
+					events.append((end + 1, bit, -1))
+		events.sort()
+		counts = [0] * len(lists) # ranges of the list covering the current address (lists may overlap themselves)
+		starts = [0]
+		masks = [0]
+		mask = 0
+		for address, bit, delta in events:
+			counts[bit] += delta
+			if counts[bit]:
+				mask |= 1 << bit
+			else:
+				mask &= ~(1 << bit)
+			if starts[-1] == address:
+				masks[-1] = mask
+			elif masks[-1] != mask:
+				starts.append(address)
+				masks.append(mask)
+		self.starts = array('L', starts)
+		self.masks = array('Q', masks) if len(lists) <= 64 else masks
+		
+	@classmethod
+	def fromArrays(cls, starts, masks):
+		'''
+		@param starts, masks: arrays (or memoryviews) of a built index
+		'''
+		index = cls()
+		index.starts = starts
+		index.masks = masks
+		return index
+		
+	def isCompact(self):
+		'''
+		@return True: bitsets fit into 64 bits (flat array)
+		'''
+		return type(self.masks) is not list
+		
+	def __len__(self):
+		return len(self.starts)
+		
+	def lookup(self, ip):
+		'''
+		@param ip: address as int
+		@return bitset of the lists (int)
+		'''
+		return self.masks[bisect_right(self.starts, ip) - 1]
+		
+	def lookupMany(self, ips):
+		starts, masks = self.starts, self.masks
+		return [masks[bisect_right(starts, ip) - 1] if ip is not None else 0 for ip in ips]
@@ -0,0 +1,90 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import socket
+from base.applog import *
+
+def createUDPSocket(ip, port, reuse_port=False, receive_buffer=0):
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	if reuse_port:
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+	if receive_buffer:
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+		actual = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+		if actual < receive_buffer: # Linux doubles the value, but caps it at net.core.rmem_max
+			log.warning("Receive buffer of %i bytes requested, got %i bytes (check net.core.rmem_max)." % (receive_buffer, actual))
+	sock.bind((ip, port))
+	return sock
+
+class DatagramReceiver():
+	'''
+	Receives UDP datagrams with recvfrom_into into one reusable buffer 
+	(bytearray). No bytes-object is allocated per datagram; the caller 
+	gets a memoryview of the buffer, which is only valid until the next 
+	datagram is received (the callback has to copy what it keeps, e.g. 
+	Manager.put into the current DatagramBatch).
+	
+	@param reuse_port: SO_REUSEPORT. Several processes may bind the same 
+		port, the kernel spreads the exporters across them.
+	@param receive_buffer: SO_RCVBUF in bytes (0: system default)
+	'''
+	MAX_DATAGRAM_SIZE = 65535
+	
+	def __init__(self, ip='0.0.0.0', port=4739, buffer_size=MAX_DATAGRAM_SIZE, reuse_port=False, receive_buffer=0):
+		self.sock = createUDPSocket(ip, port, reuse_port, receive_buffer)
+		self.buffer = bytearray(buffer_size)
+		self.view = memoryview(self.buffer)
+		self.enabled = True
+		
+	def receive(self):
+		nbytes, address = self.sock.recvfrom_into(self.view)
+		return self.view[:nbytes], address
+		
+	def serve(self, callback_method, idle_method=None, timeout=None):
+		'''
+		@param idle_method: called whenever no datagram arrived within timeout (seconds)
+		'''
+		self.sock.settimeout(timeout)
+		while self.enabled:
+			try:
+				data, address = self.receive()
+			except socket.timeout:
+				if idle_method:
+					idle_method()
+				continue
+			callback_method(data, address[0])
+			
+	def stop(self):
+		self.enabled = False
+		
+	def close(self):
+		self.stop()
+		self.sock.close()
@@ -33,28 +33,32 @@ import ipaddress # for subnetchecking
 from base.appconfig import Configuration
 from base.applog import *
 
+from network.prefixtable import PrefixTable
 class HomeNetworkChecker():
 	# zwecks Bestimmung der Richtung des Flows (oder später ggf. autonom einlernen?)
 	
 	def __init__(self):
 		config = Configuration()
 		self.networks = config.exporter_networks
+		self.tables = dict() # exporter -> PrefixTable (networks -> definition of the exporter)
+		for exporter, definition in self.networks.items():
+			self.tables[exporter] = PrefixTable(False)
+			for net in definition['networks']:
+				self.tables[exporter].addSubnet(net, definition)
+			self.tables[exporter].prepare()
 		self.error_written_exporter = dict()
 		#self.error_written_networks = dict() # das macht keinen sinn, da nicht alle netze definiert werden können (inet) --> log trash
 	
 	def isThisIPinItsHomeNetwork(self, exporter, ip, exportInterface = None):
+		'''
+		@param ip: int, IPv4Address or string
+		'''
 		try:
 			if exportInterface:
 				exporter = "%s:%s" % (exporter, exportInterface)
-			for net in self.networks[exporter]['networks']:
-				#print (exporter, net, ip)
-				if ipaddress.ip_address(ip) in ipaddress.ip_network(net, strict=False):
-					return self.networks[exporter]
-				#if ip not in self.error_written_networks:
-				#	log.warning("Exporter '%s' defined, but it does not include IP %s (add network in config)." % (exporter, ip))
-				#	self.error_written_networks[ip] = True
-			else:
-				return False
+			if type(ip) is not int:
+				ip = int(ipaddress.ip_address(ip))
+			return self.tables[exporter].lookup(ip)
 		except KeyError:
 			if exporter not in self.error_written_exporter:
 				log.warning("Exporter '%s' and its networks not defined in config." % exporter)
@@ -64,14 +68,24 @@ class HomeNetworkChecker():
 		return False
 		
 
-from network.iprange import IPRangeLookupManager
 class LocationClassifier():
 	def __init__(self):
-		self.iprlm = IPRangeLookupManager()
+		self.table = PrefixTable()
 		for item in Configuration().networks:
 			for net in item[1]: 				# 1: NetworkS
-				self.iprlm.addSubnet(net, item[0]) 	# 0: City
-		self.iprlm.prepare()
+				self.table.addSubnet(net, item[0]) 	# 0: City
+		self.table.prepare()
 
 	def getLocation(self, myip):
-		return self.iprlm.lookupIP(myip)
\ No newline at end of file
+		'''
+		@param myip: int, IPv4Address or string
+		'''
+		if type(myip) is not int:
+			myip = int(ipaddress.ip_address(myip))
+		return self.table.lookup(myip)
+		
+	def getLocations(self, ips):
+		'''
+		@param ips: addresses as int
+		'''
+		return self.table.lookupMany(ips)
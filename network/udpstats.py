@@ -0,0 +1,64 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Statistics of the kernel about UDP sockets (Linux only).
+'''
+
+PROC_FILES = ['/proc/net/udp', '/proc/net/udp6']
+
+def getUDPSocketStats(ports):
+	'''
+	@param ports: list of UDP ports
+	@return dict port -> (sockets, bytes in receive queues, drops) of all sockets 
+		bound to port or None, if /proc/net/udp is not available.
+	'''
+	stats = { port: [0, 0, 0] for port in ports }
+	available = False
+	for filename in PROC_FILES:
+		try:
+			with open(filename) as fo:
+				next(fo) # Header
+				for line in fo:
+					# sl local_address rem_address st tx_queue:rx_queue tr:tm->when retrnsmt uid timeout inode ref pointer drops
+					columns = line.split()
+					values = stats.get(int(columns[1].rsplit(':', 1)[1], 16))
+					if values is None:
+						continue
+					values[0] += 1
+					values[1] += int(columns[4].split(':')[1], 16)
+					values[2] += int(columns[12])
+			available = True
+		except (OSError, IndexError, ValueError, StopIteration):
+			pass
+	if not available:
+		return None
+	return { port: tuple(values) for port, values in stats.items() }
@@ -0,0 +1,94 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, shutil, sys, tempfile, unittest
+from ipaddress import IPv4Address
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from handler.archive import ArchiveWriter, ArchiveReader
+
+class ArchiveTest(unittest.TestCase):
+	COLUMNS = ['sourceIPv4Address', 'bytes', 'responsetime', 'service', 'securityValue', 'flow_request.octetDeltaCount']
+	
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.writer = ArchiveWriter(self.directory, rows_per_group=10)
+		
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+		
+	def __getDocument(self, i):
+		document = {'sourceIPv4Address': IPv4Address('10.0.0.%i' % (i % 250)), 'bytes': 1000 - 7 * i, 'responsetime': i / 4, 
+			'service': 'https' if i % 3 else 'ssh', 'securityValue': i % 2 == 0, 'flow_request': {'octetDeltaCount': i}}
+		if i % 5 == 0:
+			del document['service'] # missing: null
+		return document
+		
+	def __getFilename(self):
+		return self.writer.getFilename(self.writer.hour)
+		
+	def testRoundTrip(self):
+		for i in range(25):
+			self.writer.append(self.__getDocument(i))
+		self.writer.close()
+		reader = ArchiveReader(self.__getFilename())
+		self.assertEqual([rows for rows, kinds in reader.getGroups()], [10, 10, 5])
+		kinds = next(reader.getGroups())[1]
+		self.assertEqual([kinds[name] for name in ArchiveTest.COLUMNS], ['a', 'i', 'f', 's', 'b', 'i'])
+		rows = list(reader.getRows(ArchiveTest.COLUMNS))
+		self.assertEqual(len(rows), 25)
+		for i, row in enumerate(rows):
+			expected = self.__getDocument(i)
+			expected['flow_request.octetDeltaCount'] = expected.pop('flow_request')['octetDeltaCount']
+			self.assertEqual(row, expected)
+			
+	def testScanOnlyRequestedColumns(self):
+		self.writer.appendMany([self.__getDocument(i) for i in range(10)])
+		self.writer.close()
+		groups = list(ArchiveReader(self.__getFilename()).scan(['bytes', 'unknown']))
+		self.assertEqual(groups, [{'bytes': [1000 - 7 * i for i in range(10)], 'unknown': [None] * 10}])
+		
+	def testTornRowGroup(self):
+		for i in range(20):
+			self.writer.append(self.__getDocument(i))
+		self.writer.close()
+		filename = self.__getFilename()
+		size = os.path.getsize(filename)
+		with open(filename, 'r+b') as f: # crash while writing the second group
+			f.truncate(size - 20)
+		self.assertEqual([rows for rows, kinds in ArchiveReader(filename).getGroups()], [10])
+		writer = ArchiveWriter(self.directory, rows_per_group=10) # after the restart
+		writer.appendMany([self.__getDocument(i) for i in range(20, 25)])
+		writer.close()
+		rows = list(ArchiveReader(filename).getRows(['bytes']))
+		self.assertEqual([row['bytes'] for row in rows], [1000 - 7 * i for i in list(range(10)) + list(range(20, 25))])
+		
+if __name__ == '__main__':
+	unittest.main()
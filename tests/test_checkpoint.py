@@ -0,0 +1,94 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, shutil, sys, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from base.checkpoint import Checkpoint
+
+class CheckpointTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+		
+	def __write(self):
+		checkpoint = Checkpoint(self.directory, 'test')
+		checkpoint.compact({'a': 1, 'b': 2})
+		checkpoint.append({'c': 3}, [], None)
+		checkpoint.append({'a': 4}, ['b'], None)
+		checkpoint.close()
+		return checkpoint
+		
+	def testJournalReplay(self):
+		self.__write()
+		self.assertEqual(Checkpoint(self.directory, 'test').load(), {'a': 4, 'c': 3})
+		
+	def testTornJournal(self):
+		checkpoint = self.__write()
+		with open(checkpoint.journal_filename, 'r+b') as f: # crash within the last record
+			f.truncate(os.path.getsize(checkpoint.journal_filename) - 3)
+		self.assertEqual(Checkpoint(self.directory, 'test').load(), {'a': 1, 'b': 2, 'c': 3})
+		
+	def testGenerationMismatch(self):
+		checkpoint = self.__write()
+		with open(checkpoint.journal_filename, 'rb') as f:
+			journal = f.read()
+		checkpoint = Checkpoint(self.directory, 'test')
+		checkpoint.load()
+		checkpoint.compact({'x': 1}) # new snapshot (next generation) ...
+		checkpoint.close()
+		with open(checkpoint.journal_filename, 'wb') as f: # ... but crashed before the journal was replaced
+			f.write(journal)
+		self.assertEqual(Checkpoint(self.directory, 'test').load(), {'x': 1})
+		
+	def testCompaction(self):
+		Checkpoint.MIN_JOURNAL_SIZE, size = 0, Checkpoint.MIN_JOURNAL_SIZE
+		try:
+			state = {'a': 1}
+			checkpoint = Checkpoint(self.directory, 'test')
+			for i in range(20):
+				state['a'] = 'x' * 100 + str(i)
+				checkpoint.append({'a': state['a']}, [], lambda: dict(state))
+			checkpoint.close()
+			self.assertGreater(checkpoint.generation, 2)
+			self.assertEqual(Checkpoint(self.directory, 'test').load(), state)
+		finally:
+			Checkpoint.MIN_JOURNAL_SIZE = size
+			
+	def testMissingOrUnusable(self):
+		self.assertEqual(Checkpoint(self.directory, 'test').load(), {})
+		with open(os.path.join(self.directory, 'test.base'), 'wb') as f:
+			f.write(b'garbage')
+		self.assertEqual(Checkpoint(self.directory, 'test').load(), {})
+		
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,87 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, unittest
+from ipaddress import IPv4Address
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from network.prefixtable import PrefixTable
+
+def ip(address):
+	return int(IPv4Address(address))
+	
+class PrefixTableTest(unittest.TestCase):
+	def setUp(self):
+		self.table = PrefixTable('internet')
+		self.table.addSubnet('10.0.0.0/8', 'private')
+		self.table.addSubnet('10.1.0.0/16', 'site')
+		self.table.addSubnet('10.1.2.0/24', 'lab')
+		self.table.addSubnet('10.1.2.128/32', 'host')
+		
+	def testLongestPrefix(self):
+		self.assertEqual(self.table.lookup(ip('10.200.0.1')), 'private')
+		self.assertEqual(self.table.lookup(ip('10.1.0.1')), 'site')
+		self.assertEqual(self.table.lookup(ip('10.1.2.1')), 'lab')
+		self.assertEqual(self.table.lookup(ip('10.1.2.128')), 'host')
+		self.assertEqual(self.table.lookup(ip('10.1.2.129')), 'lab') # after the most specific one
+		self.assertEqual(self.table.lookup(ip('10.1.3.0')), 'site')
+		self.assertEqual(self.table.lookup(ip('11.0.0.0')), 'internet')
+		self.assertEqual(self.table.lookup(ip('9.255.255.255')), 'internet')
+		
+	def testBoundaries(self):
+		self.table.addSubnet('0.0.0.0/0', 'default route')
+		self.table.addSubnet('255.255.255.255/32', 'broadcast')
+		self.assertEqual(self.table.lookup(0), 'default route')
+		self.assertEqual(self.table.lookup(ip('10.255.255.255')), 'private')
+		self.assertEqual(self.table.lookup(ip('255.255.255.254')), 'default route')
+		self.assertEqual(self.table.lookup(0xFFFFFFFF), 'broadcast')
+		
+	def testPriorityAndOrder(self):
+		self.table.addSubnet('10.1.0.0/16', 'other site') # same prefix: last one wins
+		self.table.addSubnet('10.1.0.0/16', 'ignored', priority=-1)
+		self.assertEqual(self.table.lookup(ip('10.1.0.1')), 'other site')
+		self.table.addSubnet('10.1.0.0/16', 'preferred', priority=1)
+		self.table.addSubnet('10.1.0.0/16', 'ignored')
+		self.assertEqual(self.table.lookup(ip('10.1.0.1')), 'preferred')
+		
+	def testRangesAndHostBits(self):
+		self.table.addRange(ip('10.1.2.10'), ip('10.1.2.20'), 'range')
+		self.table.addPrefix(ip('192.168.1.77'), 24, 'home') # host bits are ignored
+		self.assertEqual(self.table.lookup(ip('10.1.2.15')), 'range')
+		self.assertEqual(self.table.lookup(ip('10.1.2.21')), 'lab')
+		self.assertEqual(self.table.lookup(ip('192.168.1.1')), 'home')
+		
+	def testLookupMany(self):
+		ips = [ip('10.1.2.128'), None, ip('8.8.8.8'), ip('10.1.9.9')]
+		self.assertEqual(self.table.lookupMany(ips), ['host', 'internet', 'internet', 'site'])
+		self.assertEqual(self.table.lookupMany(ips), [self.table.lookup(i) if i is not None else 'internet' for i in ips])
+		
+if __name__ == '__main__':
+	unittest.main()
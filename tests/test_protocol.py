@@ -0,0 +1,107 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, struct, sys, unittest
+from ipaddress import IPv4Address
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from ipfix.protocol import IPFIXReader, Flow, Template, TemplateDecoder
+
+FIELDS = [(8, 4), (12, 4), (7, 2), (11, 2), (4, 1), (1, 8), (2, 3), (56, 6)] # ID, length
+RECORD = struct.Struct('!IIHHBQ3s6s')
+
+def getTemplateSet(template_id, fields):
+	body = struct.pack('!HH', template_id, len(fields)) + b''.join(struct.pack('!HH', *field) for field in fields)
+	return struct.pack('!HH', 2, 4 + len(body)) + body
+	
+def getDataSet(template_id, records, padding=0):
+	body = b''.join(records) + bytes(padding)
+	return struct.pack('!HH', template_id, 4 + len(body)) + body
+	
+def getMessage(*sets):
+	body = b''.join(sets)
+	return struct.pack('!HHIII', 10, 16 + len(body), 1500000000, 1, 1) + body
+	
+def getVariableLength(value):
+	if len(value) < 255:
+		return struct.pack('!B', len(value)) + value
+	return struct.pack('!BH', 255, len(value)) + value
+	
+class TemplateDecoderTest(unittest.TestCase):
+	def setUp(self):
+		self.records = [RECORD.pack(0x0A000001 + i, 0xC0A80001, 1024 + i, 443, 6, 1500 * i, (i + 1).to_bytes(3, 'big'), bytes([0, 0x1B, 0x21, 0, 0, i])) for i in range(3)]
+		self.exporter = 'exporter-%s' % self.id() # templates are cached per exporter
+		
+	def __getDictFlows(self, message, template):
+		# Field by field (Flow), the decoder the struct decoder replaced
+		offset = 16 + len(getTemplateSet(256, FIELDS)) + 4
+		flows = []
+		for i in range(len(self.records)):
+			flow = Flow(message, template, offset + i * RECORD.size)
+			flows.append({k: v for k, v in flow.__dict__.items() if not k.startswith('_')})
+		return flows
+		
+	def testStructDecoderMatchesDictDecoder(self):
+		message = getMessage(getTemplateSet(256, FIELDS), getDataSet(256, self.records, padding=3))
+		template = Template(getTemplateSet(256, FIELDS), len(FIELDS), 8)
+		self.assertTrue(TemplateDecoder(template).fixed)
+		flows = IPFIXReader(message, self.exporter).getFlows()
+		self.assertEqual(len(flows), 3) # padding is not a record
+		self.assertEqual(flows, self.__getDictFlows(message, template))
+		self.assertEqual(flows[1]['sourceIPv4Address'], IPv4Address('10.0.0.2'))
+		self.assertEqual(flows[2]['packetDeltaCount'], 3)
+		self.assertEqual(flows[2]['sourceMacAddress'], self.__getDictFlows(message, template)[2]['sourceMacAddress'])
+		
+	def testColumnarDecoderMatchesDictDecoder(self):
+		message = getMessage(getTemplateSet(256, FIELDS), getDataSet(256, self.records, padding=3))
+		batch = IPFIXReader(message, self.exporter, columnar=True).getFlowBatch()
+		self.assertEqual(len(batch), 3)
+		self.assertEqual(batch.getFlows(), IPFIXReader(message, self.exporter).getFlowsWithHeader())
+		
+	def testSeveralDataSets(self):
+		message = getMessage(getTemplateSet(256, FIELDS), getDataSet(256, self.records[:1]), getDataSet(256, self.records[1:], padding=1))
+		flows = IPFIXReader(message, self.exporter).getFlows()
+		self.assertEqual([flow['sourceTransportPort'] for flow in flows], [1024, 1025, 1026])
+		
+	def testVariableLengthFallback(self):
+		fields = [(8, 4), (82, TemplateDecoder.VARIABLE_LENGTH), (1, 8)]
+		names = [b'eth0', 'x'.encode() * 300, b'']
+		records = [struct.pack('!I', 0x0A000001 + i) + getVariableLength(name) + struct.pack('!Q', i) for i, name in enumerate(names)]
+		template = Template(getTemplateSet(257, fields), len(fields), 8)
+		self.assertFalse(TemplateDecoder(template).fixed)
+		message = getMessage(getTemplateSet(257, fields), getDataSet(257, records))
+		expected = [{'sourceIPv4Address': IPv4Address(0x0A000001 + i), 'interfaceName': name.decode(), 'octetDeltaCount': i} for i, name in enumerate(names)]
+		reader = IPFIXReader(message, self.exporter)
+		self.assertEqual(reader.getFlows(), expected)
+		batch = IPFIXReader(message, self.exporter, columnar=True).getFlowBatch()
+		self.assertEqual(batch.getFlows(), reader.getFlowsWithHeader())
+		
+if __name__ == '__main__':
+	unittest.main()
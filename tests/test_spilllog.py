@@ -0,0 +1,96 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, shutil, subprocess, sys, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from ipfix.spilllog import SpillLog
+
+class SpillLogTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+		
+	def __getDeadPid(self):
+		process = subprocess.Popen([sys.executable, '-c', 'pass'])
+		process.wait()
+		return process.pid
+		
+	def testTornTailOfDeadWriter(self):
+		# Segment of a writer which died within its second record
+		name = '%013i-%i-%06i' % (1, self.__getDeadPid(), 1)
+		with open(os.path.join(self.directory, name + SpillLog.OPEN), 'wb') as f:
+			f.write(SpillLog.RECORD.pack(3, SpillLog.RAW, 2) + b'abc')
+			f.write(SpillLog.RECORD.pack(10, SpillLog.RAW, 0) + b'abcd')
+		reader = SpillLog(self.directory)
+		self.assertEqual(reader.read(10), [(b'abc', 2)])
+		self.assertEqual(reader.read(10), [])
+		self.assertEqual(os.listdir(self.directory), [])
+		
+	def testTornTailOfEarlierRun(self):
+		# Segment of a writer with the PID of a running process (reused), created before it started
+		name = '%013i-%i-%06i' % (1, os.getpid(), 1)
+		with open(os.path.join(self.directory, name + SpillLog.OPEN), 'wb') as f:
+			f.write(SpillLog.RECORD.pack(3, SpillLog.RAW, 1) + b'abc')
+			f.write(SpillLog.RECORD.pack(10, SpillLog.RAW, 0) + b'ab')
+		reader = SpillLog(self.directory)
+		self.assertEqual(reader.read(10), [(b'abc', 1)])
+		self.assertEqual(reader.read(10), [])
+		self.assertEqual(os.listdir(self.directory), [])
+		
+	def testOpenSegmentOfLiveWriter(self):
+		writer = SpillLog(self.directory)
+		writer.append(b'abc', 1)
+		writer.file.write(SpillLog.RECORD.pack(10, SpillLog.RAW, 0)) # record in progress
+		writer.file.flush()
+		reader = SpillLog(self.directory)
+		self.assertEqual(reader.read(10), [(b'abc', 1)])
+		self.assertEqual(reader.read(10), [])
+		self.assertEqual(len(os.listdir(self.directory)), 1) # waits for the writer
+		writer.file.close()
+		
+	def testReplayAfterRestart(self):
+		writer = SpillLog(self.directory, segment_size=64)
+		for i in range(20):
+			writer.append(b'%02i' % i, i % 3)
+		writer.append({'flow': 1})
+		writer.close()
+		reader = SpillLog(self.directory)
+		first = reader.read(5)
+		reader.commit()
+		reader.close()
+		rest = SpillLog(self.directory).read(100)
+		self.assertEqual([e for e, shard in first + rest][:20], [b'%02i' % i for i in range(20)])
+		self.assertEqual(rest[-1], ({'flow': 1}, 0))
+		
+if __name__ == '__main__':
+	unittest.main()
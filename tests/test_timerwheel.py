@@ -0,0 +1,83 @@
+# Copyright (c) 2014 Alexander Bredo
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the 
+# following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above 
+# copyright notice, this list of conditions and the following 
+# disclaimer in the documentation and/or other materials 
+# provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND 
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, 
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF 
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, 
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE 
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR 
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT 
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT 
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from base.timerwheel import TimerWheel
+
+class TimerWheelTest(unittest.TestCase):
+	def setUp(self):
+		self.wheel = TimerWheel(1, now=1000)
+		
+	def testExpireInOrderOfDeadline(self):
+		self.wheel.schedule('a', 1002)
+		self.wheel.schedule('b', 1000.5) # rounded up to the next tick
+		self.wheel.schedule('c', 1001.5)
+		self.assertEqual(self.wheel.expire(1000), [])
+		self.assertEqual(self.wheel.expire(1001), ['b'])
+		self.assertEqual(self.wheel.expire(1002), ['a', 'c'])
+		self.assertEqual(len(self.wheel), 0)
+		
+	def testReschedule(self):
+		self.wheel.schedule('a', 1002)
+		self.wheel.schedule('a', 1005) # stale entry in the bucket of 1002
+		self.assertEqual(self.wheel.expire(1004), [])
+		self.assertIn('a', self.wheel)
+		self.wheel.schedule('a', 1003) # earlier again (tick already passed: next tick)
+		self.assertEqual(self.wheel.expire(1005), ['a'])
+		self.assertEqual(self.wheel.expire(1010), []) # not twice
+		
+	def testCancel(self):
+		self.wheel.schedule('a', 1002)
+		self.wheel.schedule('b', 1002)
+		self.wheel.cancel('a')
+		self.wheel.cancel('c') # unknown
+		self.assertNotIn('a', self.wheel)
+		self.assertEqual(self.wheel.expire(1003), ['b'])
+		
+	def testNeverEarlier(self):
+		self.wheel.expire(1010)
+		self.wheel.schedule('a', 1000) # in the past: expires with the next tick
+		self.assertEqual(self.wheel.expire(1010), [])
+		self.assertEqual(self.wheel.expire(1011), ['a'])
+		
+	def testLongIdle(self):
+		for i in range(100):
+			self.wheel.schedule(i, 1000 + i * 3600)
+		self.wheel.cancel(50)
+		expired = self.wheel.expire(1000 + 99 * 3600) # visits the buckets only, not every tick
+		self.assertEqual(expired, [i for i in range(100) if i != 50])
+		self.assertEqual(len(self.wheel), 0)
+		self.wheel.schedule('a', 1000 + 99 * 3600 + 1)
+		self.assertEqual(self.wheel.expire(1000 + 99 * 3600 + 1), ['a'])
+		
+if __name__ == '__main__':
+	unittest.main()